@@ -0,0 +1,94 @@
+"""
+Benchmark for write_embedded_edgelist in user_interaction_networks.
+
+Builds a synthetic day of tweets with hashtag lists, writes the hashtag edgelist with the vectorized writer,
+and compares it to the original row-by-row loop. The loop is timed on a prefix of the day and
+extrapolated, since running it on a full 1M-tweet day takes far too long; the two outputs are
+checked to be byte-identical on that prefix.
+
+* Input parameters:
+- tweets. Number of synthetic tweets in the day. Default 1000000.
+- looptweets. Number of tweets the original loop is timed on. Default 20000.
+
+Example:
+python benchmarks/bench_embedded_edgelist.py --tweets 1000000
+"""
+
+import argparse
+import csv
+import datetime
+import filecmp
+import os
+import random
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import user_interaction_networks
+
+
+def loop_embedded_edgelist(df, output_file, embedded_field, output_field):
+    """
+    The original writer: one iloc lookup per tweet and one writerow per hashtag.
+    """
+    headers = list(df.columns)
+    headers.remove(embedded_field)
+    headers.append(output_field)
+    with open(output_file, 'w') as out:
+        writer = csv.writer(out)
+        writer.writerow(headers)
+        for i in range(df.shape[0]):
+            row = df.iloc[i]
+            for f_index in range(len(row[embedded_field])):
+                writer.writerow([row['created_at'], row['id_str'], row['user.id_str'], row[embedded_field][f_index]])
+
+
+def synthetic_day(n_tweets, seed = 0):
+    rng = random.Random(seed)
+    tags = ["tag{0}".format(i) for i in range(50000)]
+    weights = [1.0 / (i + 1) for i in range(len(tags))] # Zipf-like popularity
+    lengths = rng.choices([1, 2, 3, 4, 5], weights=[50, 25, 12, 8, 5], k=n_tweets)
+    flat = rng.choices(tags, weights=weights, k=sum(lengths))
+    hashtags = []
+    offset = 0
+    for length in lengths:
+        hashtags.append(flat[offset:offset + length])
+        offset += length
+    return pd.DataFrame({"created_at": ["Wed Jan 01 {0:02}:00:00 +0000 2020".format(i % 24) for i in range(n_tweets)],
+                         "id_str": [str(10 ** 18 + i) for i in range(n_tweets)],
+                         "user.id_str": [str(rng.randrange(10 ** 6)) for i in range(n_tweets)],
+                         "hashtags": hashtags})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the embedded (mentions/hashtags) edgelist writer.")
+    parser.add_argument('--tweets', type = int, default = 1000000)
+    parser.add_argument('--looptweets', type = int, default = 20000)
+    args = parser.parse_args()
+
+    print("==Generating {0:,} tweets==".format(args.tweets))
+    day = synthetic_day(args.tweets)
+    date = datetime.date(2020, 1, 1)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.makedirs(os.path.join(tmp_dir, "hashtags"))
+        output_format = tmp_dir + "/{interaction}/{l}_{y}_{m:02}_{d:02}.csv"
+
+        prefix = day.iloc[:args.looptweets]
+        start = time.perf_counter()
+        loop_embedded_edgelist(prefix, os.path.join(tmp_dir, "loop.csv"), "hashtags", "hashtag")
+        loop_time = time.perf_counter() - start
+        user_interaction_networks.write_embedded_edgelist(prefix, output_format, "hashtags", "hashtag", "hashtags", "en", date)
+        assert filecmp.cmp(os.path.join(tmp_dir, "loop.csv"), output_format.format(interaction="hashtags", l="en", y=2020, m=1, d=1),
+                           shallow=False), "vectorized output differs from the original loop"
+
+        start = time.perf_counter()
+        user_interaction_networks.write_embedded_edgelist(day, output_format, "hashtags", "hashtag", "hashtags", "en", date)
+        vector_time = time.perf_counter() - start
+
+    loop_estimate = loop_time * args.tweets / len(prefix)
+    print("loop:       {0:8.2f}s ({1:,} tweets), ~{2:.0f}s extrapolated to the full day".format(loop_time, len(prefix), loop_estimate))
+    print("vectorized: {0:8.2f}s for {1:,} tweets ({2:,.0f} tweets/s)".format(vector_time, args.tweets, args.tweets / vector_time))
+    print("speedup:    ~{0:.0f}x".format(loop_estimate / vector_time))
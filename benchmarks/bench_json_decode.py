@@ -0,0 +1,72 @@
+"""
+Benchmark for tweet ingestion in convert_to_csvs.
+
+Compares the throughput of each installed JSON backend on synthetic line-by-line tweets (see synthetic.py),
+and the cost of reading the same day file plain versus compressed.
+
+* Input parameters:
+- tweets. Number of synthetic tweets to generate. Default 50000.
+- repeat. Number of timed runs per backend; the best run is reported. Default 3.
+
+Example:
+python benchmarks/bench_json_decode.py --tweets 100000
+"""
+
+import argparse
+import datetime
+import gzip
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import convert_to_csvs
+import synthetic
+
+
+def time_read(filename, loads, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = 0
+        with convert_to_csvs.open_tweet_file(filename) as tweet_file:
+            for (tweet, error) in convert_to_csvs.read_tweets(tweet_file, loads):
+                count += 1
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return (count, best)
+
+
+def report(label, count, elapsed, size):
+    print("{0:<24} {1:>12,.0f} tweets/s {2:>8.1f} MB/s".format(label, count / elapsed, size / elapsed / 1e6))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark JSON decoding and compressed input reading.")
+    parser.add_argument('--tweets', type = int, default = 50000)
+    parser.add_argument('--repeat', type = int, default = 3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        plain_file = os.path.join(tmp_dir, "01.txt")
+        synthetic.write_day(plain_file, "en", datetime.date(2020, 1, 1), args.tweets)
+        size = os.path.getsize(plain_file)
+        print("==Decoding {0:,} tweets ({1:.1f} MB)==".format(args.tweets, size / 1e6))
+        for backend in convert_to_csvs.JSON_BACKENDS:
+            try:
+                loads = convert_to_csvs.load_json_decoder(backend)
+            except ImportError:
+                print("{0:<24} not installed".format(backend))
+                continue
+            (count, elapsed) = time_read(plain_file, loads, args.repeat)
+            report(backend, count, elapsed, size)
+
+        print("==Reading compressed input (default decoder)==")
+        gz_file = plain_file + ".gz"
+        with open(plain_file, 'rb') as infile, gzip.open(gz_file, 'wb') as outfile:
+            outfile.write(infile.read())
+        loads = convert_to_csvs.load_json_decoder()
+        for filename in [plain_file, gz_file]:
+            (count, elapsed) = time_read(filename, loads, args.repeat)
+            report(os.path.basename(filename), count, elapsed, size)
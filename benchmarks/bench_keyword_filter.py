@@ -0,0 +1,100 @@
+"""
+Micro-benchmark for KeywordFilter in convert_to_csvs.
+
+Times the precompiled keyword lookups against the original per-keyword loops for growing keyword lists,
+and checks that both give the same answer for every tweet and filter.
+
+* Input parameters:
+- tweets. Number of synthetic tweets to check. Default 2000.
+- counts. Comma-separated keyword list sizes. Default 10,100,1000,5000,20000.
+
+Example:
+python benchmarks/bench_keyword_filter.py --counts 100,20000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import convert_to_csvs
+
+
+class LoopKeywordFilter(convert_to_csvs.KeywordFilter):
+    """
+    The original KeywordFilter checks, which scan every keyword for every tweet.
+    """
+
+    def match_author(self, tweet):
+        author = tweet['user']['screen_name']
+        return next((term for term in self.keywords if term.replace(" ", "") == author), None)
+
+    def match_entities(self, tweet):
+        entities = tweet['entities']
+        vals = [h['text'].lower() for h in entities["hashtags"]] + [m['screen_name'] for m in entities["user_mentions"]]
+        return next((val for val in vals if val in self.keywords), None)
+
+    def match_text(self, tweet):
+        text = tweet['text'].lower()
+        return next((term for term in self.keywords if term in text), None)
+
+
+def random_word(rng):
+    alphabet = "abcdefghijklmnopqrstuvwxyzабвгдежзийклмнопрстуфхцчшщыэюя"
+    return "".join(rng.choice(alphabet) for _ in range(rng.randint(4, 10)))
+
+
+def synthetic_keywords(rng, count):
+    keywords = []
+    for _ in range(count):
+        if rng.random() < 0.2:
+            keywords.append(random_word(rng) + " " + random_word(rng))
+        else:
+            keywords.append(random_word(rng))
+    return keywords
+
+
+def synthetic_tweets(rng, keywords, count):
+    tweets = []
+    for i in range(count):
+        words = [random_word(rng) for _ in range(rng.randint(8, 25))]
+        if i % 10 == 0: # one tweet in ten mentions a keyword
+            words.insert(rng.randrange(len(words)), rng.choice(keywords))
+        hashtag = rng.choice(keywords) if i % 25 == 0 else random_word(rng)
+        tweets.append({"text": " ".join(words), "truncated": False,
+                       "user": {"screen_name": random_word(rng)},
+                       "entities": {"hashtags": [{"text": hashtag}], "user_mentions": [{"screen_name": random_word(rng)}]}})
+    return tweets
+
+
+def time_filter(keywordfilter, tweets):
+    start = time.perf_counter()
+    results = [keywordfilter.check_tweet(tweet) for tweet in tweets]
+    return (results, time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark KeywordFilter against growing keyword lists.")
+    parser.add_argument('--tweets', type = int, default = 2000)
+    parser.add_argument('--counts', default = "10,100,1000,5000,20000")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    print("{0:>8} {1:>14} {2:>14} {3:>9}".format("keywords", "loop tweets/s", "compiled tw/s", "speedup"))
+    for count in [int(c) for c in args.counts.split(",")]:
+        keywords = synthetic_keywords(rng, count)
+        tweets = synthetic_tweets(rng, keywords, args.tweets)
+        start = time.perf_counter()
+        compiled = convert_to_csvs.KeywordFilter(keywords, "contains_keyword", False)
+        build_time = time.perf_counter() - start
+        loop = LoopKeywordFilter(keywords, "contains_keyword", False)
+        for field in compiled.filters:
+            (expected, _) = time_filter(LoopKeywordFilter(keywords, "contains_keyword", False, [field]), tweets)
+            (actual, _) = time_filter(convert_to_csvs.KeywordFilter(keywords, "contains_keyword", False, [field]), tweets)
+            assert expected == actual, "{0} filter disagrees with the original for {1} keywords".format(field, count)
+        (_, loop_time) = time_filter(loop, tweets)
+        (_, compiled_time) = time_filter(compiled, tweets)
+        print("{0:>8} {1:>14,.0f} {2:>14,.0f} {3:>8.1f}x   (compiled in {4:.2f}s)".format(
+            count, len(tweets) / loop_time, len(tweets) / compiled_time, loop_time / compiled_time, build_time))
@@ -0,0 +1,254 @@
+"""
+Allocation benchmark for the record path of convert_to_csvs.
+
+Builds the output rows of synthetic tweets (see synthetic.py), including their retweeted/quoted tweets, two ways:
+- dict. The original path, copied unchanged from before the row path: record_tweet and record_user building a dict
+  per tweet and per user (with "user.{f}" keys formatted on every call), entities parsed into a dict of lists per
+  entities object, and csv.DictWriter turning each dict into a list of cells (lists written as their repr).
+- row. tweet_row and user_row building tuples in output order, with every entity list filled in one pass and
+  encoded as the row is built, written by csv.writer as they are.
+
+Neither path keeps any state between tweets, so every tweet pays for all of its rows. Per tweet, it reports:
+- peak. The most memory in use at once while building the tweet's rows, temporaries included (formatted keys,
+  intermediate dicts and lists), from tracemalloc's peak, with the rows dropped after each tweet as the serial
+  writer does. Writing is left out, which only favours the dict path: its list cells are turned into strings there.
+- blocks, bytes. The memory blocks allocated for the rows and the bytes they take, as held in pipeline batches
+  before writing, from tracemalloc snapshots taken before and after building the rows of the whole batch.
+- us. Time per tweet, building and writing.
+It prints the measured ratios of the two paths (about 2.07x lower peak and 2.95x fewer blocks on 20k tweets with Python
+3.11), checks that both paths write the same csv, and fails only if a ratio drops below its REGRESSION_FLOORS entry,
+which leaves room for allocator and Python version differences. The peak ratio is close to 2x, not safely above it.
+
+* Input parameters:
+- tweets. Number of synthetic tweets. Default 20000.
+
+Example:
+python benchmarks/bench_record_allocations.py --tweets 50000
+"""
+
+import argparse
+import csv
+import datetime
+import gc
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import convert_to_csvs
+import synthetic
+
+from convert_to_csvs import BASIC_FIELDS, ENTITY_FIELDS, FIELDNAMES, TWEET_REF_FIELDS, USER_FIELDS, USER_FIELDS_OUT, encode_list
+
+REGRESSION_FLOORS = {"peak": 1.75, "blocks": 2.5} # lowest ratios (dict / row) accepted before the run fails
+
+
+# The original record path
+
+def dict_parse_entity_details(entities):
+    record = { field : [] for field in ENTITY_FIELDS }
+    if entities is not None:
+        urls = entities.get("urls")
+        url_links = []
+        if urls is not None and len(urls) > 0:
+            url_links = [u['expanded_url'] for u in urls]
+        record['urls'] = url_links
+        media = entities.get("media")
+        media_links = []
+        if media is not None and len(media) > 0:
+            media_links = [m['media_url'] for m in media]
+        record['media'] = media_links
+        hashtags = entities.get("hashtags")
+        if hashtags is not None and len(hashtags) > 0:
+            record['hashtags'] = [h['text'] for h in hashtags]
+        mentions = entities.get("user_mentions")
+        if mentions is not None and len(mentions) > 0:
+            record["user_id_mentions"] = [m['id_str'] for m in mentions]
+            record["user_screenname_mentions"] = [m["screen_name"] for m in mentions]
+        symbols = entities.get("symbols")
+        if symbols is not None and len(symbols) > 0:
+            record["symbols"] = [s["text"] for s in symbols]
+    return record
+
+
+def dict_extract_entities(tweet):
+    entities = tweet.get("entities")
+    parsed_entities = dict_parse_entity_details(entities)
+    if tweet.get("truncated") is True:
+        extended = tweet.get("extended_tweet")
+        entities2 = extended.get("entities")
+        if entities2 is not None:
+            parsed_entities2 = dict_parse_entity_details(entities2)
+            for field in ENTITY_FIELDS:
+                parsed_entities[field].extend(parsed_entities2[field])
+        ext_entities = extended.get("extended_entities")
+        if ext_entities is not None:
+            parsed_ext_entities = dict_parse_entity_details(ext_entities)
+            for field in ENTITY_FIELDS:
+                parsed_entities[field].extend(parsed_ext_entities[field])
+    return parsed_entities
+
+
+def dict_record_user(tweet):
+    user = tweet.get("user")
+    user_record = { field: None for field in USER_FIELDS_OUT }
+    user_record["tweet.created_at"] = tweet.get("created_at")
+    for field in USER_FIELDS:
+        user_record["user.{f}".format(f=field)] = user.get(field)
+    return user_record
+
+
+def dict_record_tweet(tweet):
+    record = { field: None for field in FIELDNAMES }
+    record_refs = []
+    for field in BASIC_FIELDS:
+        record[field] = tweet.get(field)
+    if tweet.get("truncated") is True:
+        extended = tweet.get("extended_tweet")
+        record['text'] = extended.get("full_text")
+    # extract entities
+    entities = dict_extract_entities(tweet)
+    for field in ENTITY_FIELDS:
+        record[field] = entities[field]
+    # handle references to retweeted or quoted tweets
+    for field in TWEET_REF_FIELDS:
+        ref = tweet.get(field)
+        if ref is not None:
+            record[field] = ref.get("id_str")
+            record_refs.append(ref)
+    return (record, record_refs)
+
+
+def dict_rows(tweet, out):
+    (record, refs) = dict_record_tweet(tweet)
+    user_record = dict_record_user(tweet)
+    record['user.id_str'] = user_record["user.id_str"]
+    out.append(record)
+    out.append(user_record)
+    for ref in refs:
+        dict_rows(ref, out)
+
+
+class DictWriters:
+    def __init__(self, sink):
+        self.tweets = csv.DictWriter(sink, FIELDNAMES, extrasaction='ignore')
+        self.users = csv.DictWriter(sink, USER_FIELDS_OUT, extrasaction='ignore')
+
+    def write(self, tweet):
+        out = []
+        dict_rows(tweet, out)
+        for (record, user_record) in zip(out[0::2], out[1::2]):
+            self.tweets.writerow(record)
+            self.users.writerow(user_record)
+
+
+# The row path
+
+def row_rows(tweet, out):
+    (row, refs) = convert_to_csvs.tweet_row(tweet, encode_list)
+    out.append(row)
+    out.append(convert_to_csvs.user_row(tweet))
+    for ref in refs:
+        row_rows(ref, out)
+
+
+class RowWriters:
+    def __init__(self, sink):
+        self.tweets = csv.writer(sink, lineterminator='\r\n') # DictWriter's default, so the outputs compare
+        self.users = self.tweets
+
+    def write(self, tweet):
+        out = []
+        row_rows(tweet, out)
+        for (row, user) in zip(out[0::2], out[1::2]):
+            self.tweets.writerow(row)
+            self.users.writerow(user)
+
+
+class NullSink:
+    def write(self, line):
+        pass
+
+
+def measure(build, writers, tweets):
+    gc.collect()
+    gc.disable()
+    out = [None] * (4 * len(tweets)) # preallocated, so growing it is not counted
+    out.clear()
+    peak = 0
+    tracemalloc.start()
+    for tweet in tweets:
+        rows = []
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        build(tweet, rows)
+        peak += tracemalloc.get_traced_memory()[1] - current # working set of this tweet, temporaries included
+        del rows
+    before = tracemalloc.take_snapshot()
+    for tweet in tweets:
+        build(tweet, out)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    gc.enable()
+    diff = after.compare_to(before, "filename")
+    blocks = sum(stat.count_diff for stat in diff)
+    kept = sum(stat.size_diff for stat in diff)
+    writer = writers(NullSink())
+    start = time.perf_counter()
+    for tweet in tweets:
+        writer.write(tweet)
+    elapsed = time.perf_counter() - start
+    return (peak / len(tweets), blocks / len(tweets), kept / len(tweets), elapsed / len(tweets))
+
+
+def written(writers, tweets):
+    sink = io.StringIO()
+    writer = writers(sink)
+    for tweet in tweets:
+        writer.write(tweet)
+    return sink.getvalue()
+
+
+def dict_csv(text):
+    """
+    Rewrites the list cells of the dict path (Python repr) as JSON arrays, as the row path writes them.
+    """
+    import ast
+    rows = []
+    for row in csv.reader(io.StringIO(text)):
+        if len(row) == len(FIELDNAMES):
+            for i in range(len(BASIC_FIELDS) + len(TWEET_REF_FIELDS), len(BASIC_FIELDS) + len(TWEET_REF_FIELDS) + len(ENTITY_FIELDS)):
+                row[i] = json.dumps(ast.literal_eval(row[i]), ensure_ascii=False)
+        rows.append(row)
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure allocations of the dict and row record paths with tracemalloc.")
+    parser.add_argument('--tweets', type = int, default = 20000)
+    args = parser.parse_args()
+
+    generator = synthetic.TweetGenerator("en")
+    tweets = list(generator.tweets(datetime.date(2020, 1, 1), args.tweets))
+    assert dict_csv(written(DictWriters, tweets)) == list(csv.reader(io.StringIO(written(RowWriters, tweets)))), "outputs differ"
+    results = {}
+    for (label, build, writers) in [("dict", dict_rows, DictWriters), ("row", row_rows, RowWriters)]:
+        results[label] = measure(build, writers, tweets)
+
+    print("==Per tweet, over {0:,} tweets and their references==".format(args.tweets))
+    print("{0:<6} {1:>12} {2:>10} {3:>12} {4:>10}".format("path", "peak bytes", "blocks", "bytes", "us"))
+    for (label, (peak, blocks, kept, seconds)) in results.items():
+        print("{0:<6} {1:>12,.0f} {2:>10.1f} {3:>12,.0f} {4:>10.2f}".format(label, peak, blocks, kept, seconds * 1e6))
+    (dict_result, row_result) = (results["dict"], results["row"])
+    print("row path: {0:.2f}x lower peak, {1:.2f}x fewer row blocks, {2:.2f}x fewer row bytes, {3:.2f}x faster".format(
+        *[d / r for (d, r) in zip(dict_result, row_result)]))
+    ratios = {"peak": dict_result[0] / row_result[0], "blocks": dict_result[1] / row_result[1]}
+    regressed = [name for (name, floor) in REGRESSION_FLOORS.items() if ratios[name] < floor]
+    if regressed:
+        print("Regressed: {0}".format(", ".join("{0} {1:.2f}x (floor {2:.2f}x)".format(name, ratios[name], REGRESSION_FLOORS[name])
+                                               for name in regressed)))
+        sys.exit(1)
+    print("==No regression: peak {0:.2f}x, blocks {1:.2f}x==".format(ratios["peak"], ratios["blocks"]))
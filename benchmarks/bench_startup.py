@@ -0,0 +1,96 @@
+"""
+Benchmark for the startup time of the scripts.
+
+Imports each script in a fresh interpreter under python -X importtime and reports the cumulative import time of the
+script, whether a heavy dependency (pandas, numpy, pyarrow, scipy) was imported with it, and the slowest modules it
+pulled in, then times "python sna_cli.py <command> --help" for every command. Every script must start without the heavy
+dependencies and within the budget, and so must every --help; the run exits with status 1 otherwise, so it can be used
+as a check after changing imports.
+
+* Input parameters:
+- repeat. Number of fresh interpreters per script; the best run is reported. Default 5.
+- budget. Startup budget in milliseconds for every script and every --help. Default 150.
+- top. Number of slowest imported modules listed per script. Default 3.
+
+Example:
+python benchmarks/bench_startup.py --repeat 10
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT_DIR)
+from sna_cli import COMMANDS
+SCRIPTS = ["sna_cli", "convert_to_csvs", "tweet_author_index", "external_dedup", "user_interaction_networks", "get_cooccurences"]
+HEAVY_MODULES = ["pandas", "numpy", "pyarrow", "scipy"] # only imported by the functions that need them
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def import_times(module):
+    """
+    {module: cumulative microseconds} for one fresh import of module, from the -X importtime report.
+    """
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module], cwd=ROOT_DIR,
+                            stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, check=True).stderr.decode()
+    times = {}
+    for match in IMPORT_LINE.finditer(output):
+        times[match.group(4)] = int(match.group(2))
+    return times
+
+
+def measure(module, repeat):
+    best = None
+    for _ in range(repeat):
+        times = import_times(module)
+        if best is None or times[module] < best[module]:
+            best = times
+    return best
+
+
+def help_time(command, repeat):
+    """
+    Best wall time in milliseconds of python sna_cli.py command --help, interpreter startup included.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "sna_cli.py", command, "--help"], cwd=ROOT_DIR,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the import time of each script.")
+    parser.add_argument('--repeat', type = int, default = 5)
+    parser.add_argument('--budget', type = float, default = 150.0)
+    parser.add_argument('--top', type = int, default = 3)
+    args = parser.parse_args()
+
+    failed = []
+    print("==Import time, best of {0}==".format(args.repeat))
+    for module in SCRIPTS:
+        times = measure(module, args.repeat)
+        total = times[module] / 1000
+        heavy = [name for name in HEAVY_MODULES if name in times]
+        slowest = sorted(((t, name) for (name, t) in times.items() if name != module and "." not in name), reverse=True)[:args.top]
+        print("{0:<28} {1:>8.1f} ms  heavy: {2:<14}  slowest: {3}".format(
+            module, total, ",".join(heavy) or "none", ", ".join("{0} {1:.0f} ms".format(name, t / 1000) for (t, name) in slowest)))
+        if heavy or total > args.budget:
+            failed.append(module)
+    print("==sna_cli.py <command> --help, best of {0}==".format(args.repeat))
+    for command in COMMANDS:
+        total = help_time(command, args.repeat)
+        print("{0:<28} {1:>8.1f} ms".format(command, total))
+        if total > args.budget:
+            failed.append(command + " --help")
+    if failed:
+        print("Over the {0:.0f} ms startup budget or importing a heavy dependency: {1}".format(args.budget, ", ".join(failed)))
+        sys.exit(1)
+    print("==Within the {0:.0f} ms startup budget==".format(args.budget))
@@ -0,0 +1,262 @@
+"""
+End-to-end benchmark suite over synthetic Twitter v1.1 data (see synthetic.py).
+
+For each scale, generates one day of tweets split across the five languages, then times each stage of the pipeline
+on it in a fresh process, so that peak memory is measured per stage:
+- convert. convert_to_csvs.main over the raw day files.
+- keyword_filter. KeywordFilter.evaluate over the decoded tweets (decoding is not timed).
+- networks. user_interaction_networks.create_networks over the converted tweets.
+- cooccurrence. get_cooccurences.combine_coocurrences over the hashtag edgelists.
+- cooccurrence_selfjoin. The original get_coocurrences self-join over the same edgelists, only up to selfjoinlimit rows.
+
+Each stage reports seconds, items processed and items per second, peak RSS and output size. Results are saved as JSON
+together with the scale, seed and environment, so runs on different commits or machines can be compared.
+
+* Input parameters:
+- scales. Comma-separated tweets per day, e.g. 10k,100k,1M,10M. Default 10k,100k.
+- output. Path of the JSON results file. Default benchmark_results.json.
+- compare. Nullable. Path of an earlier results file; prints the throughput ratio of every stage against it.
+- workdir. Nullable. Directory for the generated data, kept afterwards. Defaults to a temporary directory that is removed.
+- keywords. Number of keywords for keyword_filter. Default 1000.
+- selfjoinlimit. Largest edgelist (rows) the self-join stage runs on. Default 200000.
+- seed. Seed for the generator. Default 0.
+
+Example:
+python benchmarks/run_benchmarks.py --scales 10k,1M --output results.json --compare baseline.json
+"""
+
+import argparse
+import concurrent.futures
+import contextlib
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, ".."))
+import synthetic
+
+STAGES = ["convert", "keyword_filter", "networks", "cooccurrence", "cooccurrence_selfjoin"]
+DATE = datetime.date(2020, 1, 1)
+KEYWORD_BATCH_SIZE = 10000
+
+
+def peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024 # kilobytes on Linux
+
+
+def directory_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for (root, dirs, files) in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return total
+
+
+def count_rows(paths):
+    rows = 0
+    for path in paths:
+        with open(path, 'rb') as infile:
+            rows += max(sum(1 for _ in infile) - 1, 0)
+    return rows
+
+
+def stage_convert(work_dir, params):
+    import convert_to_csvs
+    convert_to_csvs.main(os.path.join(work_dir, "source"), os.path.join(work_dir, "csv"), [DATE])
+    return (params["tweets"], os.path.join(work_dir, "csv"))
+
+
+def stage_keyword_filter(work_dir, params):
+    import convert_to_csvs
+    generator = synthetic.TweetGenerator("en", params["seed"])
+    keywords = []
+    for i in range(params["keywords"]):
+        if i % 2:
+            keywords.append(generator.hashtags[i])
+        else:
+            keywords.append(generator.user(i)["screen_name"])
+    keywordfilter = convert_to_csvs.KeywordFilter(keywords, flag="keyword", do_filter=False)
+    loads = convert_to_csvs.load_json_decoder()
+    elapsed = 0.0
+    count = 0
+    for path in sorted(synthetic_paths(work_dir)):
+        with convert_to_csvs.open_tweet_file(path) as tweet_file:
+            batch = []
+            for (tweet, error) in convert_to_csvs.read_tweets(tweet_file, loads):
+                if tweet is not None:
+                    batch.append(tweet)
+                if len(batch) == KEYWORD_BATCH_SIZE:
+                    elapsed += time_evaluate(keywordfilter, batch)
+                    count += len(batch)
+                    batch = []
+            elapsed += time_evaluate(keywordfilter, batch)
+            count += len(batch)
+    return (count, None, elapsed)
+
+
+def time_evaluate(keywordfilter, tweets):
+    start = time.perf_counter()
+    for tweet in tweets:
+        keywordfilter.evaluate(tweet)
+    return time.perf_counter() - start
+
+
+def stage_networks(work_dir, params):
+    import user_interaction_networks
+    user_interaction_networks.create_networks(os.path.join(work_dir, "csv"), os.path.join(work_dir, "networks"), [DATE])
+    return (params["tweets"], os.path.join(work_dir, "networks"))
+
+
+def stage_cooccurrence(work_dir, params):
+    import get_cooccurences
+    output_path = os.path.join(work_dir, "cooccurrences.csv")
+    get_cooccurences.combine_coocurrences(hashtag_dir(work_dir), output_path, "hashtag")
+    return (count_rows(get_cooccurences.list_edgelists(hashtag_dir(work_dir))), output_path)
+
+
+def stage_cooccurrence_selfjoin(work_dir, params):
+    import pandas as pd
+    import get_cooccurences
+    paths = get_cooccurences.list_edgelists(hashtag_dir(work_dir))
+    rows = count_rows(paths)
+    if rows > params["selfjoinlimit"]:
+        return None
+    output_path = os.path.join(work_dir, "cooccurrences_selfjoin")
+    os.makedirs(output_path, exist_ok=True)
+    for path in paths:
+        edgelist = pd.read_csv(path, dtype=object)[["user.id_str", "hashtag"]].dropna()
+        edgelist["hashtag"] = edgelist["hashtag"].str.lower()
+        coocurrs = get_cooccurences.get_coocurrences(edgelist, "hashtag")
+        coocurrs.to_csv(os.path.join(output_path, os.path.basename(path)), index=False)
+    return (rows, output_path)
+
+
+def hashtag_dir(work_dir):
+    return os.path.join(work_dir, "networks", "user_interactions", "hashtags")
+
+
+def synthetic_paths(work_dir):
+    source_dir = os.path.join(work_dir, "source")
+    return [os.path.join(source_dir, lang, "{0}_{1:02}".format(DATE.year, DATE.month), "{0:02}.txt".format(DATE.day))
+            for lang in synthetic.LANGUAGES]
+
+
+def run_stage(stage, work_dir, params):
+    """
+    Runs one stage in the current (fresh) process and returns its measurements, or None if the stage was skipped.
+    Stage output is discarded; only the measurements are returned.
+    """
+    function = globals()["stage_" + stage]
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        result = function(work_dir, params)
+        elapsed = time.perf_counter() - start
+    if result is None:
+        return None
+    if len(result) == 3: # the stage timed itself
+        (items, output_path, elapsed) = result
+    else:
+        (items, output_path) = result
+    return {"seconds": round(elapsed, 3),
+            "items": items,
+            "items_per_s": round(items / elapsed, 1) if elapsed else None,
+            "peak_rss_mb": round(peak_rss_bytes() / 2 ** 20, 1),
+            "output_bytes": directory_size(output_path) if output_path else None}
+
+
+def run_isolated(stage, work_dir, params):
+    context = multiprocessing.get_context("spawn") # a fresh interpreter, so peak RSS belongs to this stage only
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(run_stage, stage, work_dir, params).result()
+
+
+def run_scale(n_tweets, work_dir, args):
+    params = {"tweets": n_tweets, "seed": args.seed, "keywords": args.keywords, "selfjoinlimit": args.selfjoinlimit}
+    start = time.perf_counter()
+    paths = synthetic.write_source_tree(os.path.join(work_dir, "source"), [DATE], n_tweets, seed=args.seed)
+    generate_time = time.perf_counter() - start
+    params["tweets"] = (n_tweets // len(synthetic.LANGUAGES)) * len(synthetic.LANGUAGES)
+    results = {"tweets": params["tweets"], "input_bytes": sum(os.path.getsize(p) for p in paths),
+               "generate_seconds": round(generate_time, 3), "stages": {}}
+    for stage in STAGES:
+        measurement = run_isolated(stage, work_dir, params)
+        if measurement is None:
+            print("{0:<22} skipped".format(stage))
+            continue
+        results["stages"][stage] = measurement
+        print("{0:<22} {1:>9.2f}s {2:>12,.0f} items/s {3:>9.1f} MB peak {4:>12,} bytes out".format(
+            stage, measurement["seconds"], measurement["items_per_s"] or 0, measurement["peak_rss_mb"],
+            measurement["output_bytes"] or 0))
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=BENCHMARK_DIR, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    versions = {}
+    for module in ["pandas", "numpy", "scipy", "pyarrow", "orjson"]:
+        try:
+            versions[module] = __import__(module).__version__
+        except ImportError:
+            versions[module] = None
+    return {"commit": commit, "python": platform.python_version(), "platform": platform.platform(),
+            "cpus": os.cpu_count(), "packages": versions, "timestamp": datetime.datetime.now().isoformat(timespec="seconds")}
+
+
+def compare(results, baseline):
+    print("==Throughput relative to the baseline==")
+    for (scale, current) in results["scales"].items():
+        previous = baseline["scales"].get(scale)
+        if previous is None:
+            continue
+        for (stage, measurement) in current["stages"].items():
+            before = previous["stages"].get(stage)
+            if before and before["items_per_s"] and measurement["items_per_s"]:
+                print("{0:>10} {1:<22} {2:>6.2f}x speed {3:>6.2f}x peak RSS".format(
+                    scale, stage, measurement["items_per_s"] / before["items_per_s"],
+                    measurement["peak_rss_mb"] / before["peak_rss_mb"]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark every pipeline stage on synthetic tweets.")
+    parser.add_argument('--scales', help="Comma-separated tweets per day, e.g. 10k,100k,1M,10M", default = "10k,100k")
+    parser.add_argument('--output', help="JSON results file", default = "benchmark_results.json")
+    parser.add_argument('--compare', help="Nullable. Earlier JSON results file to compare against.", required = False)
+    parser.add_argument('--workdir', help="Nullable. Directory for the generated data. Temporary by default.", required = False)
+    parser.add_argument('--keywords', type = int, default = 1000)
+    parser.add_argument('--selfjoinlimit', type = int, default = 200000)
+    parser.add_argument('--seed', type = int, default = 0)
+    args = parser.parse_args()
+
+    results = {"environment": environment(), "seed": args.seed, "date": DATE.isoformat(), "scales": {}}
+    for scale in args.scales.split(","):
+        print("==Scale {0}==".format(scale))
+        work_dir = os.path.join(args.workdir, scale) if args.workdir else tempfile.mkdtemp(prefix="sna-benchmark-")
+        if os.path.isdir(work_dir):
+            shutil.rmtree(work_dir)
+        os.makedirs(work_dir)
+        try:
+            results["scales"][scale] = run_scale(synthetic.parse_count(scale), work_dir, args)
+        finally:
+            if not args.workdir:
+                shutil.rmtree(work_dir, ignore_errors=True)
+        with open(args.output, 'w') as outfile: # saved after every scale, so a long run keeps what finished
+            json.dump(results, outfile, indent=2)
+    print("Results saved to {0}".format(args.output))
+
+    if args.compare:
+        with open(args.compare, 'r') as infile:
+            compare(results, json.load(infile))
@@ -0,0 +1,217 @@
+"""
+Deterministic generator of synthetic Twitter v1.1 streaming data for the benchmarks.
+
+Tweets follow the shape convert_to_csvs expects from the streaming API:
+- about a third are truncated and carry "extended_tweet" with full_text and entities (sometimes extended_entities),
+- retweets embed the original as "retweeted_status" and quotes embed it as "quoted_status"
+  (originals may themselves be truncated, and quotes may be retweeted),
+- replies point at earlier tweets and users,
+- authors, mentions and hashtags are drawn from Zipf distributions, so a few users and hashtags dominate,
+- each language (see convert_to_csvs.LANGUAGES) has its own vocabulary and hashtags, including non-Latin scripts.
+
+The same seed, language and date always produce the same lines.
+
+Example:
+python benchmarks/synthetic.py --target /tmp/source --date 2020-01-01 --tweets 100000
+"""
+
+import argparse
+import bisect
+import datetime
+import gzip
+import itertools
+import json
+import os
+import random
+
+LANGUAGES = ["ar", "de", "en", "fr", "ru"]
+WORDS = {"ar": ["مرحبا", "العالم", "أخبار", "اليوم", "السياسة", "الرياضة", "الاقتصاد", "مصر", "دبي", "الناس", "جديد", "عاجل"],
+         "de": ["hallo", "welt", "nachrichten", "heute", "politik", "sport", "wirtschaft", "berlin", "menschen", "neu", "über", "straße"],
+         "en": ["hello", "world", "news", "today", "politics", "sports", "economy", "london", "people", "new", "breaking", "vote"],
+         "fr": ["bonjour", "monde", "actualités", "aujourd'hui", "politique", "sport", "économie", "paris", "gens", "nouveau", "élection", "grève"],
+         "ru": ["привет", "мир", "новости", "сегодня", "политика", "спорт", "экономика", "москва", "люди", "новый", "срочно", "выборы"]}
+SOURCES = ['<a href="http://twitter.com/download/iphone" rel="nofollow">Twitter for iPhone</a>',
+           '<a href="http://twitter.com/download/android" rel="nofollow">Twitter for Android</a>',
+           '<a href="https://mobile.twitter.com" rel="nofollow">Twitter Web App</a>']
+TWITTER_TIME_FORMAT = "%a %b %d %H:%M:%S +0000 %Y"
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def zipf_cum_weights(n, s = 1.1):
+    total = 0.0
+    cum_weights = []
+    for k in range(1, n + 1):
+        total += 1.0 / (k ** s)
+        cum_weights.append(total)
+    return cum_weights
+
+
+class TweetGenerator:
+
+    def __init__(self, lang = "en", seed = 0, n_users = 50000, n_hashtags = 20000, truncated_rate = 0.3, retweet_rate = 0.35,
+                 quote_rate = 0.1, reply_rate = 0.15):
+        self.lang = lang
+        self.rng = random.Random("{0}-{1}".format(seed, lang))
+        self.words = WORDS[lang]
+        self.n_users = n_users
+        self.user_weights = zipf_cum_weights(n_users)
+        self.hashtags = ["{0}{1}".format(self.rng.choice(self.words), i) for i in range(n_hashtags)]
+        self.hashtag_weights = zipf_cum_weights(n_hashtags)
+        self.truncated_rate = truncated_rate
+        self.retweet_rate = retweet_rate
+        self.quote_rate = quote_rate
+        self.reply_rate = reply_rate
+        self.users = {}
+        self.recent = [] # (id_str, user) of recent originals, for retweets, quotes and replies
+
+    def zipf(self, cum_weights):
+        return bisect.bisect_left(cum_weights, self.rng.random() * cum_weights[-1])
+
+    def user(self, rank = None):
+        if rank is None:
+            rank = self.zipf(self.user_weights)
+        user = self.users.get(rank)
+        if user is None:
+            user_id = 10 ** 8 + rank * 7919 + LANGUAGES.index(self.lang)
+            user = {"id": user_id, "id_str": str(user_id), "name": "{0} {1}".format(self.words[rank % len(self.words)].title(), rank),
+                    "screen_name": "{0}_{1}".format(self.lang, rank), "location": self.rng.choice([None, "Home", "Earth"]),
+                    "url": None, "description": " ".join(self.rng.choice(self.words) for _ in range(self.rng.randint(0, 12))),
+                    "translator_type": "none", "protected": False, "verified": rank < 50,
+                    "followers_count": int(1e6 / (rank + 1)), "friends_count": self.rng.randint(0, 2000),
+                    "listed_count": self.rng.randint(0, 100), "favourites_count": self.rng.randint(0, 50000),
+                    "statuses_count": self.rng.randint(1, 100000), "created_at": "Mon Jan 01 00:00:00 +0000 2018",
+                    "utc_offset": None, "time_zone": None, "geo_enabled": False, "lang": self.lang, "contributors_enabled": False,
+                    "is_translator": False, "profile_image_url": "http://pbs.twimg.com/profile_images/{0}/a.jpg".format(user_id),
+                    "profile_background_image_url": None}
+            self.users[rank] = user
+        return user
+
+    def entities(self, text_words):
+        hashtags = [self.hashtags[self.zipf(self.hashtag_weights)] for _ in range(self.rng.choice([0, 0, 1, 1, 1, 2, 3]))]
+        mentioned = [self.user() for _ in range(self.rng.choice([0, 0, 0, 1, 1, 2]))]
+        text_words.extend("#" + tag for tag in hashtags)
+        text_words[:0] = ["@" + user["screen_name"] for user in mentioned]
+        entities = {"hashtags": [{"text": tag, "indices": [0, len(tag) + 1]} for tag in hashtags],
+                    "user_mentions": [{"screen_name": u["screen_name"], "name": u["name"], "id": u["id"], "id_str": u["id_str"],
+                                       "indices": [0, 1]} for u in mentioned],
+                    "urls": [], "symbols": []}
+        if self.rng.random() < 0.2:
+            entities["urls"].append({"url": "https://t.co/x", "expanded_url": "https://example.com/{0}".format(self.rng.randrange(10 ** 6)),
+                                     "display_url": "example.com", "indices": [0, 1]})
+        return entities
+
+    def status(self, tweet_id, created, user = None):
+        user = user or self.user()
+        words = [self.rng.choice(self.words) for _ in range(self.rng.randint(5, 40))]
+        entities = self.entities(words)
+        text = " ".join(words)
+        truncated = len(text) > 140 and self.rng.random() < self.truncated_rate / 0.5
+        tweet = {"created_at": created.strftime(TWITTER_TIME_FORMAT), "id": tweet_id, "id_str": str(tweet_id),
+                 "text": text[:137] + "..." if truncated else text, "source": self.rng.choice(SOURCES), "truncated": truncated,
+                 "in_reply_to_status_id": None, "in_reply_to_status_id_str": None, "in_reply_to_user_id": None,
+                 "in_reply_to_user_id_str": None, "in_reply_to_screen_name": None, "user": user, "geo": None,
+                 "coordinates": None, "place": None, "contributors": None, "is_quote_status": False,
+                 "quote_count": 0, "reply_count": 0, "retweet_count": 0, "favorite_count": 0,
+                 "entities": entities if not truncated else {"hashtags": [], "user_mentions": [], "urls": [], "symbols": []},
+                 "favorited": False, "retweeted": False, "filter_level": "low", "lang": self.lang,
+                 "timestamp_ms": str(int((created - EPOCH).total_seconds() * 1000))}
+        if truncated:
+            tweet["extended_tweet"] = {"full_text": text, "display_text_range": [0, len(text)], "entities": entities}
+            if self.rng.random() < 0.2:
+                media = {"media_url": "http://pbs.twimg.com/media/{0}.jpg".format(tweet_id), "type": "photo"}
+                tweet["extended_tweet"]["extended_entities"] = {"media": [media]}
+        if self.recent and self.rng.random() < self.reply_rate:
+            (reply_id, reply_user) = self.rng.choice(self.recent)
+            tweet.update({"in_reply_to_status_id": int(reply_id), "in_reply_to_status_id_str": reply_id,
+                          "in_reply_to_user_id": reply_user["id"], "in_reply_to_user_id_str": reply_user["id_str"],
+                          "in_reply_to_screen_name": reply_user["screen_name"]})
+        return tweet
+
+    def tweets(self, date, n_tweets):
+        """
+        Yields n_tweets tweet objects spread over the given day, with increasing ids.
+        """
+        start = datetime.datetime(date.year, date.month, date.day)
+        base_id = int((start - EPOCH).total_seconds()) * 10 ** 6 + LANGUAGES.index(self.lang) * 10 ** 5
+        for i in range(n_tweets):
+            created = start + datetime.timedelta(seconds=86400.0 * i / max(n_tweets, 1))
+            tweet_id = base_id + i * 10
+            roll = self.rng.random()
+            if roll < self.retweet_rate:
+                original = self.status(tweet_id - 1 - self.rng.randrange(10 ** 5) * 10 ** 7, created - datetime.timedelta(hours=self.rng.randint(0, 72)))
+                if self.rng.random() < 0.2:
+                    original["is_quote_status"] = True
+                    original["quoted_status"] = self.status(tweet_id - 2 - self.rng.randrange(10 ** 5) * 10 ** 7, created - datetime.timedelta(days=5))
+                author = original["user"]
+                tweet = self.status(tweet_id, created)
+                tweet.update({"text": "RT @{0}: {1}".format(author["screen_name"], original["text"])[:140], "truncated": False,
+                              "retweeted_status": original})
+                tweet.pop("extended_tweet", None)
+                tweet["entities"] = {"hashtags": original["entities"]["hashtags"], "urls": [], "symbols": [],
+                                     "user_mentions": [{"screen_name": author["screen_name"], "name": author["name"],
+                                                        "id": author["id"], "id_str": author["id_str"], "indices": [3, 4]}]}
+            elif roll < self.retweet_rate + self.quote_rate:
+                tweet = self.status(tweet_id, created)
+                tweet["is_quote_status"] = True
+                tweet["quoted_status"] = self.status(tweet_id - 3 - self.rng.randrange(10 ** 5) * 10 ** 7, created - datetime.timedelta(hours=6))
+            else:
+                tweet = self.status(tweet_id, created)
+            self.recent.append((tweet["id_str"], tweet["user"]))
+            if len(self.recent) > 1000:
+                del self.recent[:500]
+            yield tweet
+
+
+def write_day(path, lang, date, n_tweets, seed = 0, compress = False):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    generator = TweetGenerator(lang, seed)
+    opener = gzip.open if compress else open
+    with opener(path, 'wt', encoding="utf-8") as outfile:
+        for tweet in generator.tweets(date, n_tweets):
+            outfile.write(json.dumps(tweet, ensure_ascii=False))
+            outfile.write("\n")
+
+
+def write_source_tree(source_dir, dates, n_tweets, languages = LANGUAGES, seed = 0, compress = False):
+    """
+    Writes n_tweets per day split evenly across languages, in the layout convert_to_csvs reads
+    ("{lang}/YYYY_MM/DD.txt"). Returns the list of files written.
+    """
+    paths = []
+    per_lang = max(n_tweets // len(languages), 1)
+    for (lang, date) in itertools.product(languages, dates):
+        path = os.path.join(source_dir, lang, "{0}_{1:02}".format(date.year, date.month), "{0:02}.txt".format(date.day))
+        if compress:
+            path += ".gz"
+        write_day(path, lang, date, per_lang, seed, compress)
+        paths.append(path)
+    return paths
+
+
+def parse_count(value):
+    """
+    Parses counts like "10k" or "1M".
+    """
+    multipliers = {"k": 10 ** 3, "m": 10 ** 6}
+    value = value.strip().lower()
+    if value[-1] in multipliers:
+        return int(float(value[:-1]) * multipliers[value[-1]])
+    return int(value)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write synthetic Twitter v1.1 day files in the convert_to_csvs source layout.")
+    parser.add_argument('--target', help="target (source) directory", required = True)
+    parser.add_argument('--date', help="Date to generate. Date format: YYYY-MM-DD", default = "2020-01-01")
+    parser.add_argument('--tweets', help="Tweets per day across all languages, e.g. 10k or 1M", default = "10k")
+    parser.add_argument('--languages', help="Comma-separated list of languages. All by default.", default = None)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--gzip', help="If included, writes .txt.gz files", action='store_true', default = False)
+    args = parser.parse_args()
+
+    date = datetime.date(*[int(x) for x in args.date.split("-")])
+    languages = args.languages.split(",") if args.languages else LANGUAGES
+    for path in write_source_tree(args.target, [date], parse_count(args.tweets), languages, args.seed, args.gzip):
+        print(path)
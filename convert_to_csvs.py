@@ -23,8 +23,25 @@ ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSI
 import json
 import csv
 import os
+import gzip
+import bz2
+import lzma
+import io
 import argparse
-import pandas as pd
+import concurrent.futures
+import collections
+import contextlib
+import itertools
+import queue
+import threading
+import array
+import hashlib
+import re
+from run_manifest import RunManifest, MANIFEST_NAME, TEMP_SUFFIX, shard_key, temp_path, replace_outputs, remove_files
+from run_stats import RunStats, REPORT_SUFFIX, PROFILE_SUFFIX, clock, profiled
+from partitioned_dataset import Catalog, LAYOUTS, PART_NAME
+from sampling import SampleEstimate, SAMPLE_FIELDS, sample_for
+import sna_cli
 
 """
 Script converts files containing line-by-line jsons into csvs.
@@ -36,23 +53,61 @@ Script converts files containing line-by-line jsons into csvs.
 - end. Last dated to parse (if exists). Date format: "YYYY-MM-DD"
 - keywordfile. Path to a file containing keywords.  These are expected to be listed line-by-line.
 - keywordflag. Name for column containing True/False based on whether tweet contains keywords.
+- keywordmatch. Optional. Name for a column recording which field and keyword matched first, e.g. "text:election".
 - keywordfields. Fields to check in tweet for keywords.  Options: author, text, entities. Expected to be comma-separated. If absent, will check all fields.
 - dofilter. If this is present, will only write tweets containing a keyword.
+- json. Optional. JSON decoder to use (orjson, ujson, simdjson, json). Defaults to the fastest one installed.
+- format. Optional. csv (default) or parquet. Parquet files keep list fields (hashtags, mentions, urls...) as real lists,
+  counts as integers and created_at/timestamp_ms as timestamps.
+- dedup. Optional. How duplicate tweets (same id_str) and user rows are dropped while writing.
+  exact keeps every key seen that day; bounded uses a fixed-size table of dedupslots entries and may let a rare duplicate through; none keeps all rows.
+- dedupslots. Optional. Slots of each bounded table, at least 1. A table takes 8 bytes per slot, 128 MB with the default 2^24,
+  and a shard has one for tweets and one for user rows (with users rows). Each worker converts its own shard, so with
+  workers the memory is multiplied by their number.
+- resume. Optional. If present, skips (language, date) shards already converted with the same settings from an unchanged input.
+- checksum. Optional. If present, input checksums are recorded and compared when a file's mtime changed but its size did not.
+- users. Optional. How user rows are written. rows (default) writes the author of every tweet, deduplicated by dedup.
+  daily writes one row per user per day, the latest snapshot, with the created_at of the first and last tweets it appeared in
+  (first_seen, last_seen). history writes one such row per user and profile version (name, description, urls, ...; counts
+  keep their latest value), so profile changes are kept without repeating unchanged rows. A version lasts until the
+  profile changes, in tweet time order, so a change and its reversal (A, B, A) give three non-overlapping versions.
+- userslatest. Optional. With users daily or history, also merges the day files into "users_latest.csv" (or .parquet)
+  in the target dir: the latest snapshot of each user across the run, with the earliest first_seen.
+- stats. Optional. If present, prints a progress line with rates and writes "{date}_report.json" next to each shard's outputs,
+  with counters (read, parsed, failed, filtered, written, duplicates, refs_expanded) and time per stage (read, filter, record, write; read, transform, write with pipeline).
+- profile. Optional. If present, each shard runs under cProfile and its stats are saved as "{date}_profile.pstats".
+- workers. Number of processes to spread (language, date) shards over. Defaults to 1 (serial).
+- pipeline. Optional. Number of transform processes for pipelined conversion: a reader thread, the transform processes
+  (decoding, keyword filter, building rows) and a writer thread overlap, connected by bounded queues. Outputs are identical
+  to serial conversion. Only with a single worker; 0 (default) converts each file in one thread.
+- sample. Optional. Fraction of tweets to convert, e.g. 0.01, chosen by a hash of samplefield so that the same tweets
+  (or users) are sampled on every day and by user_interaction_networks (see sampling.py).
+- samplefield. Optional. id_str (default) or user.id_str, to sample users with all their tweets.
+- limit. Optional. Stops reading each day file after this many lines.
+  With sample or limit, an estimate of the time and output size of the full run is printed at the end.
+- layout. Optional. flat (default, see below) or partitioned: "tweets/lang=xx/date=YYYY-MM-DD/part-0.csv" and the same under
+  "users", with a catalog.json in the target dir listing every partition with its row count and size (see partitioned_dataset.py).
 
 * Source directory structure:
 Source dir contains subdirectories specific to language.
 Within these subdirectories, each month is separated out via the folder name "YYYY-MM".
 Each month subdirectory contains files labeled by day "DD" (see INPUT_FORMAT).
+Day files may also be compressed, e.g. "DD.txt.gz" (.gz, .bz2, .xz, or .zst with the zstandard package).
 
 * Target directory structure:
 Target dir contains subdirectories specific to language.
-Each subdirectory will contain csv files labeled by date (see OUTPUT_FORMAT).
+Each subdirectory will contain csv (or parquet) files labeled by date (see OUTPUT_FORMAT).
+A manifest.json in the target dir records the input, settings and status of every converted shard (see run_manifest.py).
+Outputs of a shard are replaced when it is converted again.
 """
 
 LANGUAGES = ["ar", "de", "en", "fr", "ru"]
 KEYWORD_FIELDS = ["text", "author", "entities"]
 INPUT_FORMAT = "{folder}/{l}/{y}_{m:02}/{d:02}.txt"
 OUTPUT_FORMAT = "{folder}/{l}/{y}_{m:02}_{d:02}" # suffix added later
+PARTITIONED_OUTPUT_FORMAT = "{folder}/{table}/lang={l}/date={y}-{m:02}-{d:02}/" + PART_NAME # suffix added later
+TABLE_FIELD = "{table}" # left in partitioned output names, one table per output
+TABLES = ["tweets", "users"]
 
 # Note: replacing truncated fields with their full content.
 BASIC_FIELDS = ['timestamp_ms', 'in_reply_to_screen_name', 'in_reply_to_user_id_str', 'favorite_count',
@@ -72,34 +127,163 @@ TWEET_REF_FIELDS = ["retweeted_status", "quoted_status"]
 
 FIELDNAMES = BASIC_FIELDS + TWEET_REF_FIELDS + ENTITY_FIELDS + ["user.id_str"]
 
+# Reading functions
+
+COMPRESSED_SUFFIXES = [".gz", ".bz2", ".xz", ".zst"]
+JSON_BACKENDS = ["orjson", "ujson", "simdjson", "json"] # in order of preference
+
+
+def load_json_decoder(backend = None):
+    """
+    Returns a json loads function. By default uses the fastest installed backend, falling back to the stdlib.
+    """
+    backends = [backend] if backend else JSON_BACKENDS
+    for name in backends:
+        if name == "json":
+            return json.loads
+        try:
+            module = __import__(name)
+        except ImportError:
+            if backend: raise
+            continue
+        return module.loads
+    return json.loads
+
+
+def find_input_file(filename, listing = None):
+    """
+    Returns the path of the input file, allowing for a compressed copy (e.g. "01.txt.gz"), or None if absent.
+    With a sna_cli.DirectoryCache, the candidates are looked up in its listing instead of stat'ed one by one.
+    """
+    isfile = os.path.isfile if listing is None else listing.isfile
+    if isfile(filename):
+        return filename
+    for suffix in COMPRESSED_SUFFIXES:
+        if isfile(filename + suffix):
+            return filename + suffix
+    return None
+
+
+class TweetFile(io.TextIOWrapper):
+    """
+    Text stream over a possibly compressed day file that can tell how far into the (compressed) file it has read.
+    """
+
+    def __init__(self, stream, raw_file):
+        super().__init__(stream, encoding="utf-8")
+        self.raw_file = raw_file
+
+    def consumed(self):
+        """
+        Approximate part of the file read so far, from 0 to 1 (read-ahead buffers count as read).
+        """
+        size = os.fstat(self.raw_file.fileno()).st_size
+        return min(self.raw_file.tell() / size, 1.0) if size else 1.0
+
+    def close(self):
+        super().close()
+        self.raw_file.close()
+
+
+def open_tweet_file(filename):
+    raw_file = open(filename, 'rb')
+    if filename.endswith(".gz"):
+        return TweetFile(gzip.GzipFile(fileobj=raw_file, mode='rb'), raw_file)
+    if filename.endswith(".bz2"):
+        return TweetFile(bz2.BZ2File(raw_file), raw_file)
+    if filename.endswith(".xz"):
+        return TweetFile(lzma.LZMAFile(raw_file), raw_file)
+    if filename.endswith(".zst"):
+        import zstandard # optional dependency, only needed for .zst inputs
+        return TweetFile(zstandard.ZstdDecompressor().stream_reader(raw_file), raw_file)
+    return TweetFile(raw_file, raw_file)
+
+
+def read_tweets(tweet_file, loads = json.loads):
+    """
+    Lazily decodes one tweet per line. Yields (tweet, None) or (None, error) so callers can keep going past bad lines.
+    """
+    for line in tweet_file:
+        try:
+            yield (loads(line), None)
+        except Exception as e:
+            yield (None, e)
+
+
 # Filtering functions
 
+def compile_keyword_pattern(keywords):
+    """
+    Compiles keywords into a single regex shaped like a trie, e.g. ["cat", "car"] -> "ca(?:r|t)".
+    Searching it finds any keyword in one scan of the text instead of one scan per keyword.
+    """
+    trie = {}
+    for term in keywords:
+        node = trie
+        for char in term:
+            node = node.setdefault(char, {})
+        node[""] = True # marks the end of a keyword
+
+    def node_pattern(node):
+        branches = [re.escape(char) + node_pattern(child) for (char, child) in sorted(node.items()) if char != ""]
+        if not branches:
+            return ""
+        if len(branches) == 1 and "" not in node:
+            return branches[0]
+        pattern = "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            pattern = pattern + "?"
+        return pattern
+
+    if not trie:
+        return re.compile("(?!)") # never matches
+    if "" in trie: # an empty keyword matches every text
+        return re.compile("")
+    return re.compile(node_pattern(trie))
+
+
 class KeywordFilter:
     
     @classmethod
-    def from_file(cls, keywordfile, flag, do_filter, filters):
+    def from_file(cls, keywordfile, flag, do_filter, filters, match_field = None):
         keywords = []
-        with open(keywordfile, 'r') as keyfile:
+        with open(keywordfile, 'r', encoding="utf-8") as keyfile:
             for line in keyfile.readlines():
                 keywords.append(line.strip())
-        return cls(keywords, flag, do_filter, filters)
+        return cls(keywords, flag, do_filter, filters, match_field)
 
-    def __init__(self, keywords, flag, do_filter, filters = None):
+    def __init__(self, keywords, flag, do_filter, filters = None, match_field = None):
         self.keywords = keywords
+        # precompiled lookups so each check is independent of the number of keywords
+        self.keyword_set = frozenset(keywords or [])
+        self.author_terms = {term.replace(" ", ""): term for term in reversed(keywords or [])} # first listed term wins
+        self.text_pattern = compile_keyword_pattern(keywords or [])
         self.flag = flag
+        self.match_field = match_field
         self.do_filter = do_filter
-        FILTERS = {"author": self.check_author, "text": self.check_text, "entities": self.check_entities}
+        FILTERS = {"author": self.match_author, "text": self.match_text, "entities": self.match_entities}
         if filters:
             self.filters = {f: FILTERS[f] for f in FILTERS if f in filters}
         else:
             self.filters = FILTERS
 
-    def check_author(self, tweet):
+    def output_fields(self):
+        """
+        Extra tweet columns written by record_match, mapped to their kind for typed outputs.
+        """
+        fields = {}
+        if self.flag:
+            fields[self.flag] = "bool"
+        if self.match_field:
+            fields[self.match_field] = "string"
+        return fields
+
+    def match_author(self, tweet):
         author = tweet['user']['screen_name']
         # require exact equality
-        return any(term.replace(" ", "") == author for term in self.keywords)
+        return self.author_terms.get(author)
 
-    def check_entities(self, tweet):
+    def match_entities(self, tweet):
         hashtags = []
         mentions = []
         entities = tweet.get('entities')
@@ -119,197 +303,1148 @@ class KeywordFilter:
                 mentions2 = extended_entities2.get("user_mentions")
                 if hashtags2:   hashtags.extend([h['text'].lower() for h in hashtags2])
                 if mentions2:   mentions.extend([m['screen_name'] for m in mentions2])
-        vals = hashtags + mentions
-        return not set(vals).isdisjoint(self.keywords)
+        for val in hashtags + mentions:
+            if val in self.keyword_set:
+                return val
+        return None
 
-    def check_text(self, tweet):
+    def match_text(self, tweet):
         if tweet['truncated']:
             text = tweet['extended_tweet']['full_text']
         else:
             text = tweet['text']
         text = text.lower()
-        return any(term in text for term in self.keywords)
+        match = self.text_pattern.search(text)
+        return match.group(0) if match is not None else None
+
+    def check_author(self, tweet):
+        return self.match_author(tweet) is not None
+
+    def check_entities(self, tweet):
+        return self.match_entities(tweet) is not None
+
+    def check_text(self, tweet):
+        return self.match_text(tweet) is not None
+
+    def find_match(self, tweet):
+        """
+        Runs the filters in order and stops at the first hit. Returns (field, keyword), or None if nothing matched.
+        """
+        for (field, match) in self.filters.items():
+            keyword = match(tweet)
+            if keyword is not None:
+                return (field, keyword)
+        return None
 
     def check_tweet(self, tweet):
-        filter_results = [ self.filters[field](tweet) for field in self.filters.keys()]
-        tweet_result = any( filter_results )
-        return tweet_result
+        return self.find_match(tweet) is not None
+
+    def evaluate(self, tweet):
+        """
+        Single pass over the filters. Returns (write, match) where match is as in find_match.
+        """
+        match = self.find_match(tweet)
+        write = (self.keywords is None) or (self.do_filter == False) or (self.do_filter and match is not None)
+        return (write, match)
 
     def decide_write(self, tweet):
-        has_keyword = self.check_tweet(tweet)
-        return (self.keywords is None) or (self.do_filter == False) or (self.do_filter and has_keyword)
+        return self.evaluate(tweet)[0]
+
+    def record_match(self, record, match):
+        """
+        Fills in the flag and, if requested, the "field:keyword" match column for a written tweet.
+        """
+        if self.flag:
+            record[self.flag] = match is not None
+        if self.match_field:
+            record[self.match_field] = "{0}:{1}".format(match[0], match[1]) if match is not None else None
+
+    def append_match(self, row, match):
+        """
+        Row counterpart of record_match: returns the tweet row with the output_fields values appended.
+        """
+        if self.flag:
+            row += (match is not None,)
+        if self.match_field:
+            row += ("{0}:{1}".format(match[0], match[1]) if match is not None else None,)
+        return row
 
 
 
 # Parsing functions
 
+def merge_entity_details(*entities):
+    """
+    Collects the entity lists of one or more entities objects in a single pass, in ENTITY_FIELDS order.
+    """
+    urls = []
+    user_id_mentions = []
+    user_screenname_mentions = []
+    symbols = []
+    hashtags = []
+    media = []
+    for entity in entities:
+        if entity is None:
+            continue
+        for u in entity.get("urls") or ():
+            urls.append(u['expanded_url'])
+        for m in entity.get("user_mentions") or ():
+            user_id_mentions.append(m['id_str'])
+            user_screenname_mentions.append(m["screen_name"])
+        for s in entity.get("symbols") or ():
+            symbols.append(s["text"])
+        for h in entity.get("hashtags") or ():
+            hashtags.append(h['text'])
+        for m in entity.get("media") or ():
+            media.append(m['media_url'])
+    return (urls, user_id_mentions, user_screenname_mentions, symbols, hashtags, media)
+
+
 def parse_entity_details(entities):
-    record = { field : [] for field in ENTITY_FIELDS }
-    if entities is not None:
-        urls = entities.get("urls")
-        url_links = []
-        if urls is not None and len(urls) > 0:
-            url_links = [u['expanded_url'] for u in urls]
-        record['urls'] = url_links
-        media = entities.get("media")
-        media_links = []
-        if media is not None and len(media) > 0:
-            media_links = [m['media_url'] for m in media]
-        record['media'] = media_links
-        hashtags = entities.get("hashtags")
-        if hashtags is not None and len(hashtags) > 0:
-            record['hashtags'] = [h['text'] for h in hashtags]
-        mentions = entities.get("user_mentions")
-        if mentions is not None and len(mentions) > 0:
-            record["user_id_mentions"] = [m['id_str'] for m in mentions]
-            record["user_screenname_mentions"] = [m["screen_name"] for m in mentions]
-        symbols = entities.get("symbols")
-        if symbols is not None and len(symbols) > 0:
-            record["symbols"] = [s["text"] for s in symbols]
-    return record
+    return dict(zip(ENTITY_FIELDS, merge_entity_details(entities)))
 
 
-def extract_entities(tweet):
-    entities = tweet.get("entities")
-    parsed_entities = parse_entity_details(entities)
+def entity_lists(tweet):
+    """
+    Entity lists of a tweet, including those of the extended tweet when it is truncated.
+    """
     if tweet.get("truncated") is True:
         extended = tweet.get("extended_tweet")
-        entities2 = extended.get("entities")
-        if entities2 is not None:
-            parsed_entities2 = parse_entity_details(entities2)
-            for field in ENTITY_FIELDS:
-                parsed_entities[field].extend(parsed_entities2[field])
-        ext_entities = extended.get("extended_entities")
-        if ext_entities is not None:
-            parsed_ext_entities = parse_entity_details(ext_entities)
-            for field in ENTITY_FIELDS:
-                parsed_entities[field].extend(parsed_ext_entities[field])
-    return parsed_entities
+        return merge_entity_details(tweet.get("entities"), extended.get("entities"), extended.get("extended_entities"))
+    return merge_entity_details(tweet.get("entities"))
+
+
+def extract_entities(tweet):
+    return dict(zip(ENTITY_FIELDS, entity_lists(tweet)))
+
+
+# Row layout of the tweet and user outputs. Rows are tuples in FIELDNAMES (or USER_FIELDS_OUT) order,
+# so they can go straight to csv.writer without building a dict per tweet.
+TEXT_INDEX = FIELDNAMES.index("text")
+ID_INDEX = FIELDNAMES.index("id_str")
+USER_ID_INDEX = FIELDNAMES.index("user.id_str")
+REF_INDEX = len(BASIC_FIELDS)
+ENTITY_INDEX = REF_INDEX + len(TWEET_REF_FIELDS)
+
+
+def tweet_row(tweet, encode = None):
+    """
+    Returns (row, refs): the tweet's output row in FIELDNAMES order and the retweeted/quoted tweets it embeds.
+    If encode is given (e.g. encode_list for csv), the entity lists are stored encoded, so the row is written as it is.
+    The row is filled in place in a list of the final size, then copied once into the tuple.
+    """
+    get = tweet.get
+    row = [None] * len(FIELDNAMES)
+    row[:REF_INDEX] = map(get, BASIC_FIELDS)
+    if get("truncated") is True:
+        row[TEXT_INDEX] = get("extended_tweet").get("full_text")
+    refs = ()
+    for (i, field) in enumerate(TWEET_REF_FIELDS, REF_INDEX):
+        ref = get(field)
+        if ref is not None:
+            row[i] = ref.get("id_str")
+            refs += (ref,)
+    for (i, values) in enumerate(entity_lists(tweet), ENTITY_INDEX):
+        row[i] = values if encode is None else encode(values)
+    row[USER_ID_INDEX] = get("user").get("id_str")
+    return (tuple(row), refs)
+
+
+def user_row(tweet):
+    """
+    The author's output row in USER_FIELDS_OUT order.
+    """
+    return tuple(map(tweet.get("user").get, USER_FIELDS))
 
 
 def record_user(tweet):
-    user = tweet.get("user")
-    user_record = { field: None for field in USER_FIELDS_OUT }
+    user_record = dict(zip(USER_FIELDS_OUT, user_row(tweet)))
     user_record["tweet.created_at"] = tweet.get("created_at")
-    for field in USER_FIELDS:
-        user_record["user.{f}".format(f=field)] = user.get(field)
     return user_record
 
 
 def record_tweet(tweet):
-    record = { field: None for field in FIELDNAMES }
-    record_refs = []
-    for field in BASIC_FIELDS:
-        record[field] = tweet.get(field)
-    if tweet.get("truncated") is True:
-        extended = tweet.get("extended_tweet")
-        record['text'] = extended.get("full_text")
-    # extract entities
-    entities = extract_entities(tweet)
-    for field in ENTITY_FIELDS:
-        record[field] = entities[field]
-    # handle references to retweeted or quoted tweets
-    for field in TWEET_REF_FIELDS:
-        ref = tweet.get(field)
-        if ref is not None:
-            record[field] = ref.get("id_str")
-            record_refs.append(ref)
-    return (record, record_refs)
+    (row, record_refs) = tweet_row(tweet)
+    return (dict(zip(FIELDNAMES, row)), record_refs)
 
 
 # Writing functions
-                          
-def write_record_to_file(record, output_filename, is_user, keywordflag = None):
-    if is_user:
-        output_filename = output_filename + "_users.csv"
-        fieldnames = USER_FIELDS_OUT
+
+WRITE_BUFFER_SIZE = 1 << 20 # bytes buffered per output file before flushing to disk
+OUTPUT_FORMATS = ["csv", "parquet"]
+PARQUET_ROW_GROUP_SIZE = 1 << 17 # rows buffered per parquet row group
+PARQUET_COMPRESSION = "zstd"
+DEDUP_MODES = ["exact", "bounded", "none"]
+DEDUP_SLOTS = 1 << 24 # slots in a bounded seen-set, 8 bytes each: 128 MB
+
+
+class SeenSet:
+    """
+    Exact set of keys already written.
+    """
+
+    def __init__(self):
+        self.keys = set()
+
+    def add(self, key):
+        """
+        Returns True if the key has not been seen before.
+        """
+        if key in self.keys:
+            return False
+        self.keys.add(key)
+        return True
+
+
+def stable_hash(key):
+    """
+    Signed 64-bit hash of a key that does not change between processes. Keys that are already
+    digests (bytes, e.g. from user_key) are used as they are.
+    """
+    if not isinstance(key, bytes):
+        key = hashlib.blake2b(str(key).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(key[:8], "big", signed=True)
+
+
+class BoundedSeenSet:
+    """
+    Fixed-size table of key hashes, using 8 bytes per slot no matter how many keys are added.
+    Keys sharing a slot evict each other, so an old duplicate can occasionally be written twice,
+    but a new key is never dropped (short of a full 64-bit hash collision).
+    Slots come from a blake2b digest rather than hash(), which is salted per process (PYTHONHASHSEED),
+    so which duplicates get through is the same on every run.
+    The table is allocated in one piece, without a temporary zeroed copy.
+    """
+
+    def __init__(self, slots = DEDUP_SLOTS):
+        if slots < 1:
+            raise ValueError("Bounded dedup needs at least 1 slot, got {0}".format(slots))
+        self.slots = slots
+        self.table = array.array('q', [0]) * slots
+
+    def add(self, key):
+        key_hash = stable_hash(key) or 1 # 0 marks an empty slot
+        slot = key_hash % self.slots
+        if self.table[slot] == key_hash:
+            return False
+        self.table[slot] = key_hash
+        return True
+
+
+def make_seen_set(dedup, slots = DEDUP_SLOTS):
+    if dedup == "exact":
+        return SeenSet()
+    if dedup == "bounded":
+        return BoundedSeenSet(slots)
+    return None
+
+
+def tweet_key(row):
+    return row[ID_INDEX]
+
+
+def user_key(row):
+    return hashlib.blake2b(repr(row).encode("utf-8"), digest_size=16).digest()
+
+
+def encode_list(values):
+    """
+    Encodes a list cell as a JSON array, e.g. ["#news", "تويتر"], which user_interaction_networks can
+    decode a whole column at a time. Earlier versions wrote the Python repr, e.g. ['#news'].
+    """
+    if values is None:
+        return None
+    if not values:
+        return "[]"
+    if len(values) == 1:
+        return encode_single(values[0])
+    return json.dumps(values, ensure_ascii=False)
+
+
+JSON_ESCAPE = re.compile(r'[\x00-\x1f"\\]') # characters json.dumps escapes with ensure_ascii=False
+
+
+def encode_single(value):
+    """
+    encode_list for a one-element list, the most common non-empty cell. Strings without characters to escape
+    are formatted directly instead of going through json.dumps.
+    """
+    if type(value) is str and JSON_ESCAPE.search(value) is None:
+        return '["{0}"]'.format(value)
+    return json.dumps([value], ensure_ascii=False)
+
+
+class RecordWriter:
+    """
+    Keeps a single output csv open for the whole day instead of reopening it for every row.
+    The file is opened lazily on the first row so that days without output still produce no file.
+    Rows are tuples (or lists) in fieldnames order (see tweet_row and user_row) and are written as they are.
+    If a seen-set is given, rows whose key was already written are skipped.
+    List cells must already be encoded as JSON arrays: tweet rows are built with list_encoder (see encode_list).
+    """
+    list_encoder = staticmethod(encode_list)
+
+    def __init__(self, output_filename, fieldnames, buffer_size = WRITE_BUFFER_SIZE, seen = None, key = None):
+        self.output_filename = output_filename
+        self.fieldnames = fieldnames
+        self.buffer_size = buffer_size
+        self.seen = seen
+        self.key = key
+        self.outfile = None
+        self.writer = None
+        self.written = 0
+
+    def open(self):
+        write_header = os.path.isfile(self.output_filename) is False # if file is new, plan to add header
+        self.outfile = open(self.output_filename, 'a', buffering=self.buffer_size, encoding="utf-8", newline='')
+        self.writer = csv.writer(self.outfile, lineterminator='\n')
+        if write_header:  self.writer.writerow(self.fieldnames)
+
+    def write(self, row):
+        """
+        Returns False if the row was dropped as a duplicate.
+        """
+        if self.seen is not None and not self.seen.add(self.key(row)):
+            return False
+        if self.writer is None:
+            self.open()
+        self.writer.writerow(row)
+        self.written += 1
+        return True
+
+    def close(self):
+        if self.outfile is not None:
+            self.outfile.close()
+            self.outfile = None
+            self.writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# Column kinds for typed (parquet) output. Fields not listed here are written as strings.
+FIELD_KINDS = {field: "int" for field in ['favorite_count', 'quote_count', 'retweet_count', 'reply_count',
+                                          'in_reply_to_user_id', 'in_reply_to_status_id']}
+FIELD_KINDS.update({field: "bool" for field in ['favorited', 'retweeted', 'is_quote_status']})
+FIELD_KINDS.update({field: "json" for field in ['coordinates', 'place', 'geo', 'contributors']})
+FIELD_KINDS.update({field: "list" for field in ENTITY_FIELDS})
+FIELD_KINDS.update({"created_at": "twitter_time", "timestamp_ms": "epoch_ms"})
+FIELD_KINDS.update({"user.{f}".format(f=field): "int" for field in ['statuses_count', 'utc_offset', 'listed_count', 'followers_count',
+                                                                     'favourites_count', 'friends_count']})
+FIELD_KINDS.update({"user.{f}".format(f=field): "bool" for field in ['protected', 'is_translator', 'contributors_enabled',
+                                                                      'geo_enabled', 'verified']})
+FIELD_KINDS["user.created_at"] = "twitter_time"
+FIELD_KINDS.update({"first_seen": "twitter_time", "last_seen": "twitter_time"})
+TWITTER_TIME_FORMAT = "%a %b %d %H:%M:%S %z %Y"
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("parquet output requires the pyarrow package")
+    return pyarrow
+
+
+def to_int(value):
+    if value is None or isinstance(value, int):
+        return value
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def arrow_type(kind):
+    pa = import_pyarrow()
+    return {"int": pa.int64(),
+            "bool": pa.bool_(),
+            "list": pa.list_(pa.string()),
+            "twitter_time": pa.timestamp("ms", tz="UTC"), # parquet has no seconds unit, pyarrow would store ms anyway
+            "epoch_ms": pa.timestamp("ms", tz="UTC")}.get(kind, pa.string())
+
+
+def arrow_column(kind, values):
+    pa = import_pyarrow()
+    if kind == "int":
+        return pa.array([to_int(v) for v in values], pa.int64())
+    if kind == "bool":
+        return pa.array([None if v is None else bool(v) for v in values], pa.bool_())
+    if kind == "list":
+        return pa.array([None if v is None else [str(x) for x in v] for v in values], pa.list_(pa.string()))
+    if kind == "json":
+        return pa.array([None if v is None else json.dumps(v) for v in values], pa.string())
+    if kind == "epoch_ms":
+        return pa.array([to_int(v) for v in values], pa.int64()).cast(pa.timestamp("ms", tz="UTC"))
+    strings = pa.array([None if v is None else str(v) for v in values], pa.string())
+    if kind == "twitter_time":
+        return pa.compute.strptime(strings, format=TWITTER_TIME_FORMAT, unit="ms", error_is_null=True)
+    return strings
+
+
+class ParquetRecordWriter:
+    """
+    Columnar counterpart of RecordWriter. Rows are buffered per column and written as compressed
+    row groups with real list, integer, boolean and timestamp types (see FIELD_KINDS).
+    Parquet files cannot be appended to, so an existing file is replaced.
+    """
+    list_encoder = None # list cells stay lists
+
+    def __init__(self, output_filename, fieldnames, field_kinds = FIELD_KINDS, row_group_size = PARQUET_ROW_GROUP_SIZE,
+                 seen = None, key = None):
+        self.output_filename = output_filename
+        self.fieldnames = list(fieldnames)
+        self.kinds = [field_kinds.get(field, "string") for field in self.fieldnames]
+        self.row_group_size = row_group_size
+        self.seen = seen
+        self.key = key
+        self.columns = [[] for field in self.fieldnames]
+        self.rows = 0 # buffered for the next row group
+        self.written = 0
+        self.writer = None
+
+    def open(self):
+        pa = import_pyarrow()
+        schema = pa.schema([(field, arrow_type(kind)) for (field, kind) in zip(self.fieldnames, self.kinds)])
+        self.writer = pa.parquet.ParquetWriter(self.output_filename, schema, compression=PARQUET_COMPRESSION)
+
+    def write(self, row):
+        """
+        Returns False if the row was dropped as a duplicate.
+        """
+        if self.seen is not None and not self.seen.add(self.key(row)):
+            return False
+        for (column, value) in zip(self.columns, row):
+            column.append(value)
+        self.rows += 1
+        self.written += 1
+        if self.rows >= self.row_group_size:
+            self.flush()
+        return True
+
+    def flush(self):
+        if self.rows == 0:
+            return
+        if self.writer is None:
+            self.open()
+        pa = import_pyarrow()
+        arrays = [arrow_column(kind, column) for (kind, column) in zip(self.kinds, self.columns)]
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.writer.schema))
+        self.columns = [[] for field in self.fieldnames]
+        self.rows = 0
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# User dimension: one row per user per day, or one per profile version, instead of one per tweet.
+
+USER_MODES = ["rows", "daily", "history"]
+USER_DIMENSION_FIELDS = USER_FIELDS_OUT + ["first_seen", "last_seen"]
+# Counts change with almost every tweet, so history only starts a new version when another profile field changes.
+USER_COUNT_FIELDS = ['statuses_count', 'listed_count', 'followers_count', 'favourites_count', 'friends_count']
+USER_PROFILE_INDICES = [i for (i, field) in enumerate(USER_FIELDS) if field not in USER_COUNT_FIELDS]
+USER_ID_FIELD_INDEX = USER_FIELDS.index("id_str")
+MONTHS = {month: "{0:02}".format(i) for (i, month) in enumerate(["Jan", "Feb", "Mar", "Apr", "May", "Jun",
+                                                                  "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"], 1)}
+
+
+def seen_key(created_at):
+    """
+    Sortable form of a Twitter created_at (always +0000), e.g. "Wed Jan 01 10:00:00 +0000 2020" -> "2020-01-01 10:00:00".
+    Missing or malformed times sort first.
+    """
+    try:
+        return "{0}-{1}-{2} {3}".format(created_at[26:30], MONTHS[created_at[4:7]], created_at[8:10], created_at[11:19])
+    except (TypeError, KeyError):
+        return ""
+
+
+def profile_versions(observations):
+    """
+    Splits the observations of one user ([seen key, sequence, profile, created_at, row], in arrival order) into
+    versions in (seen key, sequence) order, so changes within the same second keep the order they arrived in: a version
+    ends where the profile first differs from it and the next one starts there, so A -> B -> A gives three versions.
+    Returns [first key, first_seen, last key, last_seen, row] per version, row being the version's latest.
+    """
+    versions = []
+    current = None
+    for (seen, sequence, profile, created_at, row) in sorted(observations, key=lambda observation: observation[:2]):
+        if versions and profile == current:
+            version = versions[-1]
+            version[2] = seen
+            version[3] = created_at
+            version[4] = row
+        else:
+            versions.append([seen, created_at, seen, created_at, row])
+            current = profile
+    return versions
+
+
+class UserDimension:
+    """
+    Collects the user rows of a day and writes one row per user, the latest snapshot, with the created_at
+    of the first and last tweets it was seen in. With history, writes one row per user and profile version instead
+    (see profile_versions): a new version starts whenever the profile fields (counts excluded, they keep their latest
+    value) differ from the previous version's, so the versions of a user never overlap.
+    Rows are written sorted by user id when the day is closed, through a RecordWriter or ParquetRecordWriter.
+    A dimension is opened per day file and its observations are dropped on close, so memory is bounded by one day.
+    """
+
+    def __init__(self, writer, history = False):
+        self.writer = writer
+        self.history = history
+        self.users = {}
+        self.sequence = 0
+
+    @property
+    def written(self):
+        return self.writer.written
+
+    def write(self, row, created_at):
+        user_id = row[USER_ID_FIELD_INDEX]
+        seen = seen_key(created_at)
+        if self.history:
+            # Tweets do not arrive in time order (e.g. retweeted tweets), so versions are only built on close.
+            # An observation with the same time and profile as the user's previous one (the many retweets of a tweet)
+            # only updates it: nothing arrived in between, so the versions are the same.
+            self.sequence += 1
+            profile = tuple([row[i] for i in USER_PROFILE_INDICES])
+            observations = self.users.get(user_id)
+            if observations is None:
+                self.users[user_id] = [[seen, self.sequence, profile, created_at, row]]
+                return True
+            previous = observations[-1]
+            if previous[0] == seen and previous[2] == profile:
+                previous[4] = row
+            else:
+                observations.append([seen, self.sequence, profile, created_at, row])
+            return False
+        entry = self.users.get(user_id)
+        if entry is None:
+            self.users[user_id] = [seen, created_at, seen, created_at, row]
+            return True
+        if seen < entry[0]:
+            entry[0] = seen
+            entry[1] = created_at
+        if seen >= entry[2]:
+            entry[2] = seen
+            entry[3] = created_at
+            entry[4] = row
+        return False
+
+    def close(self):
+        if self.history:
+            entries = [entry for observations in self.users.values() for entry in profile_versions(observations)]
+        else:
+            entries = self.users.values()
+        entries = sorted(entries, key=lambda entry: (entry[4][USER_ID_FIELD_INDEX] or "", entry[0]))
+        for (first_key, first_seen, last_key, last_seen, row) in entries:
+            self.writer.write(row + (first_seen, last_seen))
+        self.users = {}
+        self.sequence = 0
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.writer.close()
+
+
+def read_users(path, output_format = "csv"):
+    import pandas as pd # only needed for users_latest, so plain conversions start without it
+    if output_format == "parquet":
+        users = pd.read_parquet(path)
+        users["_first"] = users["first_seen"]
+        users["_last"] = users["last_seen"]
+    else:
+        users = pd.read_csv(path, dtype=object)
+        users["_first"] = pd.to_datetime(users["first_seen"], format=TWITTER_TIME_FORMAT, errors="coerce")
+        users["_last"] = pd.to_datetime(users["last_seen"], format=TWITTER_TIME_FORMAT, errors="coerce")
+    return users
+
+
+def latest_users(users):
+    """
+    Reduces user rows to the latest snapshot of each user, keeping the earliest first_seen.
+    """
+    latest = users.sort_values("_last", kind="stable", na_position="first").drop_duplicates("user.id_str", keep="last")
+    first = users.sort_values("_first", kind="stable", na_position="last").drop_duplicates("user.id_str")
+    first = first.set_index("user.id_str")
+    latest = latest.set_index("user.id_str", drop=False)
+    latest["first_seen"] = first["first_seen"]
+    latest["_first"] = first["_first"]
+    return latest.reset_index(drop=True)
+
+
+def merge_latest_users(paths, output_path, output_format = "csv"):
+    """
+    Merges daily user dimension files into one latest snapshot per user across the run.
+    Only one day's rows and the running snapshot are in memory at a time.
+    """
+    import pandas as pd
+    latest = None
+    for path in paths:
+        users = read_users(path, output_format)
+        latest = latest_users(users if latest is None else pd.concat([latest, users], ignore_index=True))
+    if latest is None:
+        return None
+    latest = latest.sort_values("user.id_str", kind="stable")[USER_DIMENSION_FIELDS]
+    if output_format == "parquet":
+        latest.to_parquet(output_path + TEMP_SUFFIX, index=False)
+    else:
+        latest.to_csv(output_path + TEMP_SUFFIX, index=False, lineterminator="\n")
+    os.replace(output_path + TEMP_SUFFIX, output_path)
+    return output_path
+
+
+def open_writers(output_filename, keyword_fields = None, dedup = "exact", dedup_slots = DEDUP_SLOTS, output_format = "csv",
+                 users = "rows"):
+    fieldnames = FIELDNAMES
+    if keyword_fields:
+        fieldnames = list(fieldnames) + list(keyword_fields)
+    if output_format == "parquet":
+        field_kinds = dict(FIELD_KINDS, **(keyword_fields or {}))
+        (tweet_path, user_path) = output_paths(output_filename, output_format)
+        tweet_writer = ParquetRecordWriter(tweet_path, fieldnames, field_kinds,
+                                           seen=make_seen_set(dedup, dedup_slots), key=tweet_key)
+        if users == "rows":
+            user_writer = ParquetRecordWriter(user_path, USER_FIELDS_OUT,
+                                              seen=make_seen_set(dedup, dedup_slots), key=user_key)
+        else:
+            user_writer = UserDimension(ParquetRecordWriter(user_path, USER_DIMENSION_FIELDS),
+                                        history=users == "history")
+        return (tweet_writer, user_writer)
+    (tweet_path, user_path) = output_paths(output_filename, output_format)
+    tweet_writer = RecordWriter(tweet_path, fieldnames,
+                                seen=make_seen_set(dedup, dedup_slots), key=tweet_key)
+    if users == "rows":
+        user_writer = RecordWriter(user_path, USER_FIELDS_OUT,
+                                   seen=make_seen_set(dedup, dedup_slots), key=user_key)
     else:
-        output_filename = output_filename + ".csv"
-        fieldnames = FIELDNAMES
-        if keywordflag:
-            fieldnames = list(fieldnames) + [keywordflag]
-    write_header = os.path.isfile(output_filename) is False # if file is new, plan to add header
-    with open(output_filename, 'a') as outfile:
-        writer = csv.DictWriter(outfile, fieldnames, extrasaction='ignore')
-        if write_header:  writer.writeheader()
-        writer.writerow(record)
-
-
-def process_tweet(tweet, output_file, keywordfilter):
+        user_writer = UserDimension(RecordWriter(user_path, USER_DIMENSION_FIELDS), history=users == "history")
+    return (tweet_writer, user_writer)
+
+
+def process_tweet(tweet, tweet_writer, user_writer, keywordfilter, stats = None):
+    if stats is not None:
+        start = clock()
     if keywordfilter:
-        write_record = keywordfilter.decide_write(tweet)
-        keyword_flag = keywordfilter.flag
+        (write_record, match) = keywordfilter.evaluate(tweet)
+        if stats is not None:
+            start = stats.lap("filter", start)
     else:
         write_record = True
-        keyword_flag = None
     if write_record:
-        (record, refs) = record_tweet(tweet)
-        if keyword_flag:
-            record[keyword_flag] = keywordfilter.check_tweet(tweet)
-        user_record = record_user(tweet)
-        record['user.id_str'] = user_record["user.id_str"]
-        write_record_to_file(record, output_file, False, keyword_flag)
-        write_record_to_file(user_record, output_file, True, keyword_flag)
+        (row, refs) = tweet_row(tweet, tweet_writer.list_encoder)
+        if keywordfilter:
+            row = keywordfilter.append_match(row, match)
+        if stats is not None:
+            start = stats.lap("record", start)
+        written = tweet_writer.write(row)
+        if isinstance(user_writer, UserDimension):
+            user_writer.write(user_row(tweet), tweet.get("created_at"))
+        else:
+            user_writer.write(user_row(tweet))
+        if stats is not None:
+            stats.lap("write", start)
+            stats.count("written" if written else "duplicates")
+            stats.count("refs_expanded", len(refs))
         # parse referenced tweets
         for ref in refs:
-            process_tweet(ref, output_file, keywordfilter)
+            process_tweet(ref, tweet_writer, user_writer, keywordfilter, stats)
+    elif stats is not None:
+        stats.count("filtered")
 
 
-def deduplicate_file(filename):
-    df = pd.read_csv(filename, dtype=object)
-    df = df.drop_duplicates()
-    df.to_csv(filename, index=False, float_format='%f')
+def process_file(filename, output_filename, keywordfilter = None, loads = json.loads, dedup = "exact", dedup_slots = DEDUP_SLOTS,
+                 output_format = "csv", stats = None, users = "rows", sample = None):
+    """
+    Converts one day file, or the sampled tweets of its first sample.limit lines (see sampling.py).
+    Returns the number of rows written to the tweet and user outputs, and the part of the file read (see read_part).
+    """
+    keyword_fields = keywordfilter.output_fields() if keywordfilter else None
+    (tweet_writer, user_writer) = open_writers(output_filename, keyword_fields, dedup, dedup_slots, output_format, users)
+    lines = 0
+    with open_tweet_file(filename) as tweet_file, tweet_writer, user_writer:
+        if stats is not None:
+            start = clock()
+        for (tweet, error) in read_tweets(sample.lines(tweet_file) if sample else tweet_file, loads):
+            lines += 1
+            if stats is not None:
+                stats.lap("read", start) # reading and decoding the line
+                stats.count("read")
+            if error is None and sample is not None and not sample.keep(tweet):
+                if stats is not None:
+                    stats.count("sampled_out")
+                    start = clock()
+                continue
+            if error is None:
+                try:
+                    process_tweet(tweet, tweet_writer, user_writer, keywordfilter, stats)
+                except Exception as e:
+                    error = e
+            if error is not None:
+                print("Unable to load tweet object")
+                print(error)
+            if stats is not None:
+                stats.count("failed" if error is not None else "parsed")
+                stats.progress()
+                start = clock()
+        consumed = read_part(tweet_file, sample, lines)
+        if stats is not None:
+            start = clock()
+    if stats is not None:
+        stats.lap("write", start) # flushing and closing the outputs
+    return ([tweet_writer.written, user_writer.written], consumed)
 
 
-def process_file(filename, output_filename, keywordfilter = None):
-    with open(filename, 'r') as tweet_file:
-        for line in tweet_file.readlines():
-            try:
-                tweet = json.loads(line)
-                process_tweet(tweet, output_filename, keywordfilter)
-            except Exception as e:
-                print("Unable to load tweet object")
-                print(e)
-    output_tweets = output_filename + ".csv"
-    if os.path.isfile(output_tweets):
-        deduplicate_file(output_tweets)
-    output_users = output_filename + "_users.csv"
-    if os.path.isfile(output_users):
-        deduplicate_file(output_users)
+def read_part(tweet_file, sample, lines):
+    """
+    Part of a day file read: all of it, unless the sample's limit stopped reading before the end.
+    """
+    if sample is None or sample.limit is None or lines < sample.limit or not tweet_file.readline():
+        return 1.0
+    return tweet_file.consumed()
+
+
+# Pipelined conversion: a reader thread, a pool of transform processes and a writer thread, connected by bounded queues.
+# The reader hands raw lines to the pool in batches; the main thread collects the transformed batches in the order they
+# were read and passes them to the writer, so rows come out in the same order (and with the same deduplication) as
+# process_file. At most PIPELINE_DEPTH batches wait in each queue and PIPELINE_DEPTH per worker are in flight, so memory
+# stays flat however far ahead the reader is.
+
+PIPELINE_BATCH_SIZE = 1000 # lines per batch handed to a transform worker
+PIPELINE_DEPTH = 4
+PIPELINE_POLL = 0.1 # seconds between checks for a failed stage while blocked on a full queue
+END_OF_FILE = None
+
+transform_settings = {} # keyword filter, decoder and list encoder of a transform worker, set once by init_transform
+
+
+def transform_tweet(tweet, keywordfilter, records, encode = None):
+    """
+    The record-building half of process_tweet: appends (tweet row, user row, created_at, number of references) for the
+    tweet and the tweets it references, in the order process_tweet writes them. Returns the number of tweets filtered out.
+    """
+    if keywordfilter:
+        (write_record, match) = keywordfilter.evaluate(tweet)
+        if not write_record:
+            return 1
+    (row, refs) = tweet_row(tweet, encode)
+    if keywordfilter:
+        row = keywordfilter.append_match(row, match)
+    records.append((row, user_row(tweet), tweet.get("created_at"), len(refs)))
+    filtered = 0
+    for ref in refs:
+        filtered += transform_tweet(ref, keywordfilter, records, encode)
+    return filtered
+
+
+def init_transform(keywordfilter, loads, sample = None, encode = None):
+    transform_settings["keywordfilter"] = keywordfilter
+    transform_settings["loads"] = loads
+    transform_settings["sample"] = sample
+    transform_settings["encode"] = encode
+
+
+def transform_batch(lines):
+    """
+    Decodes and transforms a batch of lines in a transform worker.
+    Returns ([(records, error, filtered, sampled_out)] per line, seconds).
+    Records built before an error are kept, as process_file would have written them.
+    """
+    start = clock()
+    keywordfilter = transform_settings["keywordfilter"]
+    loads = transform_settings["loads"]
+    sample = transform_settings["sample"]
+    encode = transform_settings["encode"]
+    results = []
+    for line in lines:
+        records = []
+        error = None
+        filtered = 0
+        try:
+            tweet = loads(line)
+        except Exception as e:
+            results.append((records, str(e), filtered, False))
+            continue
+        if sample is not None and not sample.keep(tweet):
+            results.append((records, error, filtered, True))
+            continue
+        try:
+            filtered = transform_tweet(tweet, keywordfilter, records, encode)
+        except Exception as e:
+            error = str(e)
+        results.append((records, error, filtered, False))
+    return (results, clock() - start)
+
+
+def put_unless_failed(items, item, failures):
+    """
+    Blocks until item fits in the queue, giving up if another stage failed meanwhile.
+    """
+    while not failures:
+        try:
+            items.put(item, timeout=PIPELINE_POLL)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def read_batches(filename, batch_size, batches, failures, sample = None, read_state = None):
+    """
+    Puts batches of lines of the file (up to the sample's limit) in the batches queue. Sets read_state["consumed"] to the part
+    of the file read.
+    """
+    try:
+        with open_tweet_file(filename) as tweet_file:
+            source = sample.lines(tweet_file) if sample else tweet_file
+            lines_read = 0
+            while True:
+                start = clock()
+                lines = list(itertools.islice(source, batch_size))
+                if not lines:
+                    break
+                lines_read += len(lines)
+                if not put_unless_failed(batches, (lines, clock() - start), failures):
+                    return
+            if read_state is not None:
+                read_state["consumed"] = read_part(tweet_file, sample, lines_read)
+    except Exception as e:
+        failures.append(e)
+        return
+    put_unless_failed(batches, END_OF_FILE, failures)
+
+
+def write_batches(results, tweet_writer, user_writer, stats, failures):
+    dimension = isinstance(user_writer, UserDimension)
+    while True:
+        item = results.get()
+        if item is END_OF_FILE:
+            return
+        if failures:
+            continue # keep draining so the main thread never blocks on a full queue
+        try:
+            ((lines, seconds), read_seconds) = item
+            start = clock()
+            for (records, error, filtered, sampled_out) in lines:
+                for (row, user, created_at, refs) in records:
+                    written = tweet_writer.write(row)
+                    if dimension:
+                        user_writer.write(user, created_at)
+                    else:
+                        user_writer.write(user)
+                    if stats is not None:
+                        stats.count("written" if written else "duplicates")
+                        stats.count("refs_expanded", refs)
+                if error is not None:
+                    print("Unable to load tweet object")
+                    print(error)
+                if stats is not None:
+                    stats.count("read")
+                    stats.count("failed" if error is not None else "parsed")
+                    if filtered:
+                        stats.count("filtered", filtered)
+                    if sampled_out:
+                        stats.count("sampled_out")
+            if stats is not None:
+                stats.add_time("read", read_seconds)
+                stats.add_time("transform", seconds) # summed over workers
+                stats.lap("write", start)
+                stats.progress()
+        except Exception as e:
+            failures.append(e)
+
+
+def open_transform_pool(workers, keywordfilter = None, loads = json.loads, sample = None, output_format = "csv"):
+    """
+    Starts the transform processes of pipeline_file. The settings are the same for every day of a run, so main
+    starts them once and passes the pool to each pipeline_file, instead of paying the process start-up per file.
+    """
+    encode = (ParquetRecordWriter if output_format == "parquet" else RecordWriter).list_encoder
+    return concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=init_transform,
+                                                  initargs=(keywordfilter, loads, sample, encode))
+
+
+def pipeline_file(filename, output_filename, keywordfilter = None, loads = json.loads, dedup = "exact", dedup_slots = DEDUP_SLOTS,
+                  output_format = "csv", stats = None, users = "rows", sample = None, workers = 2, batch_size = PIPELINE_BATCH_SIZE,
+                  depth = PIPELINE_DEPTH, executor = None):
+    """
+    Converts one day file like process_file, overlapping reading, transforming (in workers processes) and writing.
+    Produces the same outputs as process_file. With stats, only the main thread's stats are updated, from the writer thread.
+    The transform processes are those of executor (see open_transform_pool), opened with the same settings; without it,
+    a pool is started for this file only.
+    """
+    keyword_fields = keywordfilter.output_fields() if keywordfilter else None
+    (tweet_writer, user_writer) = open_writers(output_filename, keyword_fields, dedup, dedup_slots, output_format, users)
+    batches = queue.Queue(maxsize=depth)
+    results = queue.Queue(maxsize=depth)
+    failures = [] # exceptions of any stage; the other stages stop when it is not empty
+    read_state = {"consumed": 1.0}
+    reader = threading.Thread(target=read_batches, args=(filename, batch_size, batches, failures, sample, read_state), daemon=True)
+    writer = threading.Thread(target=write_batches, args=(results, tweet_writer, user_writer, stats, failures), daemon=True)
+    with tweet_writer, user_writer:
+        reader.start()
+        writer.start()
+        try:
+            with (contextlib.nullcontext(executor) if executor is not None else
+                  open_transform_pool(workers, keywordfilter, loads, sample, output_format)) as executor:
+                pending = collections.deque()
+                while not failures:
+                    try:
+                        batch = batches.get(timeout=PIPELINE_POLL)
+                    except queue.Empty:
+                        continue
+                    if batch is END_OF_FILE:
+                        break
+                    (lines, read_seconds) = batch
+                    pending.append((executor.submit(transform_batch, lines), read_seconds))
+                    if len(pending) >= workers * depth:
+                        (future, read_seconds) = pending.popleft()
+                        put_unless_failed(results, (future.result(), read_seconds), failures)
+                while pending and not failures:
+                    (future, read_seconds) = pending.popleft()
+                    put_unless_failed(results, (future.result(), read_seconds), failures)
+                for (future, read_seconds) in pending:
+                    future.cancel()
+        except Exception as e:
+            failures.append(e)
+        finally:
+            results.put(END_OF_FILE) # the writer drains until it sees this, so there is always room eventually
+            writer.join()
+            reader.join()
+        if failures:
+            raise failures[0]
+        start = clock()
+    if stats is not None:
+        stats.lap("write", start) # flushing and closing the outputs
+    return ([tweet_writer.written, user_writer.written], read_state["consumed"])
     
     
-def main(source_dir, target_dir, date_range, keywordfilter = None):
+def shard_filenames(source_dir, target_dir, lang, date, layout = "flat"):
+    input_filename = INPUT_FORMAT.format(folder=source_dir,
+                                         l=lang,
+                                         y=date.year,
+                                         m=date.month,
+                                         d=date.day)
+    output_filename = (PARTITIONED_OUTPUT_FORMAT if layout == "partitioned" else OUTPUT_FORMAT).format(folder=target_dir,
+                                                                                                     table=TABLE_FIELD,
+                                                                                                     l=lang,
+                                                                                                     y=date.year,
+                                                                                                     m=date.month,
+                                                                                                     d=date.day)
+    return (input_filename, output_filename)
+
+
+def output_paths(output_filename, output_format = "csv"):
+    """
+    Tweet and user outputs of a shard, in that order.
+    """
+    if TABLE_FIELD in output_filename:
+        return [output_filename.replace(TABLE_FIELD, table) + "." + output_format for table in TABLES]
+    return [output_filename + "." + output_format, output_filename + "_users." + output_format]
+
+
+def shard_side_path(output_filename, suffix):
+    """
+    Path of a shard's report or profile. In the partitioned layout it goes in the tweets partition, prefixed with "_"
+    so that dataset readers skip it.
+    """
+    if TABLE_FIELD in output_filename:
+        (partition, name) = os.path.split(output_filename.replace(TABLE_FIELD, TABLES[0]))
+        return os.path.join(partition, "_" + name + suffix)
+    return output_filename + suffix
+
+
+def process_shard(shard, keywordfilter = None, loads = json.loads, dedup = "exact", dedup_slots = DEDUP_SLOTS, output_format = "csv",
+                  stats = False, profile = False, users = "rows", pipeline = 0, sample = None, transform_pool = None):
+    """
+    Converts a single (language, date) shard. With pipeline, through pipeline_file with that many transform workers,
+    those of transform_pool if given (see open_transform_pool).
+    Returns (None, result) on success, result holding the rows written to each output, the part of the input read and
+    the time taken; otherwise (the error message, None).
+    Outputs are written under a temporary name and renamed into place when the whole day is done, so a
+    re-run replaces them instead of appending, and an interrupted run never leaves partial outputs.
+    Shards never share input or output files, so this is safe to run in separate processes.
+    With stats, counters and stage timers are printed and written to a report next to the outputs (see run_stats.py).
+    """
+    (lang, date, input_filename, output_filename) = shard
+    temp_filename = temp_path(output_filename) # e.g. "_part-0.tmp.csv", skipped by dataset readers
+    temp_paths = output_paths(temp_filename, output_format)
+    run_stats = RunStats("{0} {1}-{2:02}-{3:02}".format(lang, date.year, date.month, date.day)) if stats else None
+    start = clock()
+    try:
+        remove_files(temp_paths) # leftovers from an interrupted run
+        for directory in set(os.path.dirname(path) for path in temp_paths):
+            os.makedirs(directory, exist_ok=True)
+        with profiled(shard_side_path(output_filename, PROFILE_SUFFIX) if profile else None):
+            if pipeline:
+                (rows, consumed) = pipeline_file(input_filename, temp_filename, keywordfilter, loads, dedup, dedup_slots, output_format,
+                                                 run_stats, users, sample, pipeline, executor=transform_pool)
+            else:
+                (rows, consumed) = process_file(input_filename, temp_filename, keywordfilter, loads, dedup, dedup_slots, output_format,
+                                                run_stats, users, sample)
+        replace_outputs(temp_paths, output_paths(output_filename, output_format))
+    except Exception as e:
+        remove_files(temp_paths)
+        return ("{0}: {1}".format(type(e).__name__, e), None)
+    if run_stats is not None:
+        print(run_stats.summary())
+        run_stats.write_report(shard_side_path(output_filename, REPORT_SUFFIX))
+    return (None, {"rows": rows, "consumed": consumed, "seconds": clock() - start})
+
+
+def run_parallel(shards, keywordfilter, workers, loads = json.loads, dedup = "exact", dedup_slots = DEDUP_SLOTS, output_format = "csv",
+                 on_result = None, stats = False, profile = False, users = "rows", sample = None):
+    failed = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(process_shard, shard, keywordfilter, loads, dedup, dedup_slots, output_format, stats, profile, users, 0,
+                                   sample): shard
+                   for shard in shards}
+        for (i, future) in enumerate(concurrent.futures.as_completed(futures), 1):
+            (lang, date, input_filename, output_filename) = futures[future]
+            try:
+                (error, result) = future.result()
+            except Exception as e: # worker died, e.g. killed for running out of memory
+                (error, result) = ("{0}: {1}".format(type(e).__name__, e), None)
+            if on_result is not None:
+                on_result(futures[future], error, result)
+            label = "{0} {1}-{2:02}-{3:02}".format(lang, date.year, date.month, date.day)
+            if error is None:
+                print("[{0}/{1}] {2} done".format(i, len(shards), label))
+            else:
+                print("[{0}/{1}] {2} failed".format(i, len(shards), label))
+                print("Unable to process {f}".format(f=input_filename))
+                print(error)
+                failed.append(input_filename)
+    if failed:
+        print("{0} of {1} shards failed".format(len(failed), len(shards)))
+    return failed
+
+
+def conversion_settings(keywordfilter, dedup, dedup_slots, output_format, users = "rows", layout = "flat", sample = None):
+    """
+    Everything that changes the outputs of a shard, recorded in the manifest.
+    """
+    settings = {"format": output_format, "dedup": dedup, "dedup_slots": dedup_slots if dedup == "bounded" else None}
+    if users != "rows":
+        settings["users"] = users
+    if layout != "flat":
+        settings["layout"] = layout
+    if sample is not None:
+        settings["sample"] = sample.settings()
+    if keywordfilter is not None:
+        settings["keywords"] = hashlib.sha1("\n".join(keywordfilter.keywords or []).encode("utf-8")).hexdigest()
+        settings["keyword_options"] = [keywordfilter.flag, keywordfilter.match_field, keywordfilter.do_filter, list(keywordfilter.filters)]
+    return settings
+
+
+def main(source_dir, target_dir, date_range, keywordfilter = None, workers = 1, loads = json.loads,
+         dedup = "exact", dedup_slots = DEDUP_SLOTS, output_format = "csv", resume = False, checksum = False, stats = False, profile = False,
+         users = "rows", users_latest = False, layout = "flat", pipeline = 0, sample = None):
+    if workers > 1 and pipeline:
+        print("--pipeline only applies to serial conversion, ignoring it with {0} workers".format(workers))
+        pipeline = 0
     if not os.path.exists(target_dir):
         os.makedirs(target_dir)
+    manifest = RunManifest(os.path.join(target_dir, MANIFEST_NAME))
+    settings = conversion_settings(keywordfilter, dedup, dedup_slots, output_format, users, layout, sample)
+    catalog = Catalog(target_dir) if layout == "partitioned" else None
+    estimate = SampleEstimate(sample) if sample is not None else None
+
+    def record_result(shard, error, result = None):
+        (lang, date, input_filename, output_filename) = shard
+        status = "done" if error is None else "failed"
+        paths = output_paths(output_filename, output_format)
+        manifest.record(shard_key(lang, date), input_filename, settings, status, paths, error, checksum)
+        if error is not None:
+            return
+        if catalog is not None:
+            for (table, path, count) in zip(TABLES, paths, result["rows"]):
+                catalog.add(table, lang, date, [path], [count])
+            catalog.save()
+        if estimate is not None:
+            estimate.add(shard_key(lang, date), result["seconds"], result["consumed"],
+                         sum(os.path.getsize(path) for path in paths if os.path.isfile(path)))
     
     print("==Processing Files==")
-    for lang in LANGUAGES:
-        print("Language: {0}".format(lang))
-        lang_dir = "{0}/{1}".format(target_dir, lang)
-        if not os.path.isdir(lang_dir):
-            os.makedirs(lang_dir)
-        for date in date_range:
-            input_filename = INPUT_FORMAT.format(folder=source_dir,
-                                             l=lang,
-                                            y=date.year,
-                                            m=date.month,
-                                            d=date.day)
-            if os.path.isfile(input_filename):
-                print("{0}-{1:02}-{2:02}".format(date.year, date.month, date.day))
-                output_filename = OUTPUT_FORMAT.format(folder=target_dir,
-                                   l=lang,
-                                   y=date.year,
-                                   m=date.month,
-                                   d=date.day)
-                try:
-                    process_file(input_filename, output_filename, keywordfilter)
-                except Exception as e:
-                    print("Unable to process {f}".format(f=input_filename))
-                    print(e)
+    shards = []
+    transform_pool = open_transform_pool(pipeline, keywordfilter, loads, sample, output_format) if pipeline else None
+    try:
+        listing = sna_cli.DirectoryCache()
+        for lang in LANGUAGES:
+            print("Language: {0}".format(lang))
+            lang_dir = "{0}/{1}".format(target_dir, lang)
+            if layout == "flat" and not os.path.isdir(lang_dir):
+                os.makedirs(lang_dir)
+            for date in date_range:
+                (input_filename, output_filename) = shard_filenames(source_dir, target_dir, lang, date, layout)
+                input_filename = find_input_file(input_filename, listing)
+                if input_filename is not None:
+                    if resume and manifest.is_complete(shard_key(lang, date), input_filename, settings, checksum):
+                        print("{0}-{1:02}-{2:02} already converted, skipping".format(date.year, date.month, date.day))
+                        continue
+                    shard = (lang, date, input_filename, output_filename)
+                    if workers > 1:
+                        shards.append(shard)
+                        continue
+                    print("{0}-{1:02}-{2:02}".format(date.year, date.month, date.day))
+                    (error, result) = process_shard(shard, keywordfilter, loads, dedup, dedup_slots, output_format, stats, profile, users,
+                                                    pipeline, sample, transform_pool)
+                    record_result(shard, error, result)
+                    if error is not None:
+                        print("Unable to process {f}".format(f=input_filename))
+                        print(error)
+                        if transform_pool is not None: # a failed file may have left workers broken or busy
+                            transform_pool.shutdown()
+                            transform_pool = open_transform_pool(pipeline, keywordfilter, loads, sample, output_format)
+    finally: # never leave the transform processes behind, whatever the loop raised
+        if transform_pool is not None:
+            transform_pool.shutdown()
+    if shards:
+        print("==Converting {0} shards with {1} workers==".format(len(shards), workers))
+        run_parallel(shards, keywordfilter, workers, loads, dedup, dedup_slots, output_format, record_result, stats, profile, users, sample)
+    manifest.compact()
+    if users_latest and users != "rows":
+        print("==Merging Latest User Snapshots==")
+        if catalog is not None:
+            user_paths = catalog.paths("users", LANGUAGES, dates=date_range)
+        else:
+            user_paths = []
+            for lang in LANGUAGES:
+                for date in date_range:
+                    (input_filename, output_filename) = shard_filenames(source_dir, target_dir, lang, date)
+                    user_path = output_paths(output_filename, output_format)[1]
+                    if os.path.isfile(user_path):
+                        user_paths.append(user_path)
+        merge_latest_users(user_paths, os.path.join(target_dir, "users_latest." + output_format), output_format)
+    if estimate is not None:
+        print("==Sample Estimate==")
+        print(estimate.summary())
     print("==Done!==")
 
                     
-if __name__ == '__main__':
+def cli(argv = None):
     parser = argparse.ArgumentParser(description="Convert files containing line-by-line jsons to csvs.")
     parser.add_argument('--source', help="source directory", required = True)
     parser.add_argument('--target', help="target directory", required = True)
@@ -317,11 +1452,52 @@ if __name__ == '__main__':
     parser.add_argument('--end', help="Last date to parse (if exists). Date format: YYYY-MM-DD", required = True)
     parser.add_argument('--keywordfile', help="Path for file containing keywords. Optional for filtering/flagging.", required = False, default = None)
     parser.add_argument('--keywordflag', help="String to column denoting whether tweet contains keyword.  Optional, for flagging.", required = False, default = "contains_keyword")
+    parser.add_argument('--keywordmatch', help="Name for an extra column recording the first match as field:keyword. Optional.", required = False, default = None)
     parser.add_argument('--keywordfields', help="Comma-separated list of fields to check for keywords. Options: author, text, entities. Will check all by default.", required = False, default = None)
     parser.add_argument('--dofilter', help="If included, will filter to only write tweets containing keywords.", dest = 'dofilter', required = False,
                         action='store_true', default = False)
+    parser.add_argument('--workers', help="Number of processes converting (language, date) shards in parallel. Default 1 (serial).", required = False,
+                        type = int, default = 1)
+    parser.add_argument('--json', help="JSON decoder to use. Options: {0}. Uses the fastest installed one by default.".format(", ".join(JSON_BACKENDS)), required = False,
+                        choices = JSON_BACKENDS, default = None)
+    parser.add_argument('--format', help="Output format. Options: csv, parquet (requires pyarrow). Default csv.", required = False,
+                        choices = OUTPUT_FORMATS, default = "csv")
+    parser.add_argument('--dedup', help="How to drop duplicate tweets (by id_str) and user rows while writing. Options: exact, bounded, none. Default exact.", required = False,
+                        choices = DEDUP_MODES, default = "exact")
+    parser.add_argument('--dedupslots', help="Number of slots (8 bytes each) per table for --dedup bounded, at least 1. The default 2^24 takes 128 MB for tweets and as much for user rows, in every --workers process.", required = False,
+                        type = int, default = DEDUP_SLOTS)
+    parser.add_argument('--resume', help="If included, skips shards the manifest records as converted with the same settings and an unchanged input.",
+                        required = False, action='store_true', default = False)
+    parser.add_argument('--checksum', help="If included, records input checksums so that inputs which were only touched still count as unchanged.",
+                        required = False, action='store_true', default = False)
+    parser.add_argument('--users', help="How to write user rows. Options: rows (one per tweet, deduplicated by --dedup), daily (latest snapshot per user per day), history (one per profile version per day). Default rows.",
+                        required = False, choices = USER_MODES, default = "rows")
+    parser.add_argument('--userslatest', help="If included with --users daily or history, also writes users_latest in the target directory: the latest snapshot of every user across the run.",
+                        required = False, action='store_true', default = False)
+    parser.add_argument('--pipeline', help="Number of transform processes for pipelined (overlapped read, transform and write) conversion of each file. Only with --workers 1. Default 0 (off).",
+                        required = False, type = int, default = 0)
+    parser.add_argument('--sample', help="Fraction of tweets to convert, chosen by a hash of --samplefield. Optional, for exploratory runs.",
+                        required = False, type = float, default = None)
+    parser.add_argument('--samplefield', help="Field hashed for --sample. Options: id_str, user.id_str. Default id_str.", required = False,
+                        choices = SAMPLE_FIELDS, default = "id_str")
+    parser.add_argument('--limit', help="Stop reading each day file after this many lines. Optional, for exploratory runs.",
+                        required = False, type = int, default = None)
+    parser.add_argument('--layout', help="Output layout. Options: flat ({lang}/YYYY_MM_DD), partitioned (tweets|users/lang=xx/date=YYYY-MM-DD/part-0, with a catalog). Default flat.",
+                        required = False, choices = LAYOUTS, default = "flat")
+    parser.add_argument('--stats', help="If included, prints progress with rates and writes a JSON report of counters and stage timings per shard.",
+                        required = False, action='store_true', default = False)
+    parser.add_argument('--profile', help="If included, runs each shard under cProfile and saves the stats next to its outputs.",
+                        required = False, action='store_true', default = False)
     
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    if args.dedupslots < 1:
+        parser.error("--dedupslots must be at least 1, got {0}".format(args.dedupslots))
+    if args.pipeline < 0:
+        parser.error("--pipeline must be 0 (off) or a number of transform processes, got {0}".format(args.pipeline))
+    try:
+        sample = sample_for(args.sample, args.samplefield, args.limit)
+    except ValueError as e:
+        parser.error(str(e))
 
     dofilter = bool(args.dofilter)
     if args.keywordfields:
@@ -330,14 +1506,16 @@ if __name__ == '__main__':
         keywordfields = KEYWORD_FIELDS
     print("==Reading Keywords File==")
     if args.keywordfile is not None:
-        keywordfilter= KeywordFilter.from_file(args.keywordfile, args.keywordflag, dofilter, keywordfields)
+        keywordfilter= KeywordFilter.from_file(args.keywordfile, args.keywordflag, dofilter, keywordfields, args.keywordmatch)
     else:
         keywordfilter= None
 
-    start_date = [int(x) for x in args.start.split("-")]
-    start_date = pd.datetime(start_date[0], start_date[1], start_date[2])
-    end_date = [int(x) for x in args.end.split("-")]
-    end_date = pd.datetime(end_date[0], end_date[1], end_date[2])
-    date_range = pd.date_range(start_date, end_date)
-    main(source_dir=args.source, target_dir=args.target, date_range=date_range, keywordfilter = keywordfilter)
+    main(source_dir=args.source, target_dir=args.target, date_range=sna_cli.date_range(args.start, args.end), keywordfilter = keywordfilter, workers = args.workers,
+         loads = load_json_decoder(args.json), dedup = args.dedup, dedup_slots = args.dedupslots,
+         output_format = args.format, resume = args.resume, checksum = args.checksum, stats = args.stats, profile = args.profile,
+         users = args.users, users_latest = args.userslatest, layout = args.layout, pipeline = args.pipeline,
+         sample = sample)
 
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,315 @@
+"""
+The following code was produced as part of a project sponsored by the Department of the Navy,
+Office of Naval Research under ONR Grant No. N00014-18-1-2128.
+
+Copyright 2018 The Johns Hopkins University Applied Physics Laboratory LLC
+
+Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import os
+import csv
+import calendar
+import datetime
+import heapq
+import itertools
+import operator
+import shutil
+import tempfile
+from run_manifest import TEMP_SUFFIX, remove_files
+
+"""
+Time-windowed, weighted edgelists for user_interaction_networks.
+
+Raw edgelists have one row per interaction. With a window, each day's edges are also reduced to a partial with one row per
+(window, source, target): the number of interactions (weight) and the first and last times they happened. Partials are
+written sorted, so the edgelist of a window spanning many days (and, by default, every language) is a streaming k-way
+merge of its partials that holds one row per partial in memory, never the raw rows of the whole window. At most
+MERGE_FAN_IN partials are open at once; longer ranges are merged in intermediate passes.
+
+* Windows:
+hour, day, week, all (one window over the whole run) or a length such as 15m, 6h, 3d or 2w.
+Windows are aligned to midnight UTC, weeks (and multiples of weeks) start on Mondays.
+A run writes the windows that overlap its date range. Retweets and quotes of older tweets carry old times, so a day's
+partial can hold edges of earlier windows: those windows are left as they are, and their edges stay in the partials.
+A window that is only partly inside the range is merged with the partials already written for its other days (and for
+the days since, which may hold late edges of it), so a run over one day of a week never cuts the week to that day.
+
+* Output structure (under user_interactions):
+aggregated/{window}/{interaction}/partials/{lang}_YYYY_MM_DD.csv, one sorted partial per day, kept for later runs.
+aggregated/{window}/{interaction}/{lang}_{window start}.csv with columns source, target, weight, first_ts, last_ts,
+where lang is "all" unless languages are kept separate. Times are UTC, formatted as YYYY-MM-DDTHH:MM:SSZ.
+"""
+
+WINDOW_ALIASES = {"hour": "1h", "day": "1d", "week": "1w"}
+WINDOW_UNITS = {"m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+WEEK_OFFSET = 4 * 86400 # 1970-01-01 was a Thursday
+TWITTER_TIME_FORMAT = "%a %b %d %H:%M:%S +0000 %Y"
+ISO_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+PARTIAL_COLUMNS = ["window", "source", "target", "weight", "first_ts", "last_ts"]
+EDGE_COLUMNS = ["source", "target", "weight", "first_ts", "last_ts"]
+MERGE_FAN_IN = 64 # partials open at once while merging, see merge_partials
+
+# Column holding the target of each interaction in the extracted edges (the source is always user.id_str)
+EDGE_TARGETS = {"replies": "in_reply_to_user_id_str",
+                "retweets": "retweeted_user",
+                "quotes": "quoted_user",
+                "mentions": "user_id_mentions",
+                "hashtags": "hashtags"}
+LIST_TARGETS = ["mentions", "hashtags"] # one edge per list element
+
+
+def edge_frame(edges, interaction):
+    """
+    One row per edge of one day's extracted edges: seconds (since the epoch, UTC), source and target.
+    Edges without a time, source or target (e.g. an unresolved retweeted user) are dropped.
+    """
+    import pandas as pd
+    target = EDGE_TARGETS[interaction]
+    edges = edges[["created_at", "user.id_str", target]]
+    if interaction in LIST_TARGETS:
+        edges = edges.explode(target)
+    times = pd.to_datetime(edges["created_at"], format=TWITTER_TIME_FORMAT, errors="coerce")
+    keep = (times.notna() & edges["user.id_str"].notna() & edges[target].notna()).to_numpy()
+    seconds = (times[keep] - pd.Timestamp(0)) // pd.Timedelta(seconds=1)
+    return pd.DataFrame({"seconds": seconds.to_numpy(dtype="int64"),
+                         "source": edges["user.id_str"][keep].astype(str).to_numpy(),
+                         "target": edges[target][keep].astype(str).to_numpy()})
+
+
+def window_seconds(window):
+    """
+    Length of a window in seconds, or None for "all".
+    """
+    window = WINDOW_ALIASES.get(window, window)
+    if window == "all":
+        return None
+    try:
+        length = int(window[:-1]) * WINDOW_UNITS[window[-1]]
+    except (ValueError, KeyError, IndexError):
+        length = 0
+    if length <= 0:
+        raise ValueError("Unknown window {0}. Options: hour, day, week, all, or a length such as 15m, 6h, 3d, 2w".format(window))
+    return length
+
+
+def window_name(window):
+    return WINDOW_ALIASES.get(window, window)
+
+
+def file_label(window_start, length):
+    """
+    File name part for a window, as precise as the window length needs, e.g. "2020_01_06" or "2020_01_06_18".
+    """
+    if length is None:
+        return window_start
+    label = "{0}_{1}_{2}".format(window_start[0:4], window_start[5:7], window_start[8:10])
+    if length % 86400:
+        label += "_" + window_start[11:13]
+        if length % 3600:
+            label += window_start[14:16]
+    return label
+
+
+class WindowAggregator:
+
+    def __init__(self, output_dir, window, by_language = False, fan_in = MERGE_FAN_IN):
+        self.window = window_name(window)
+        self.length = window_seconds(window)
+        self.by_language = by_language
+        self.fan_in = fan_in
+        self.window_dir = os.path.join(output_dir, "aggregated", self.window)
+
+    def partial_path(self, interaction, lang, date):
+        return os.path.join(self.window_dir, interaction, "partials", "{0}_{1}_{2:02}_{3:02}.csv".format(lang, date.year, date.month, date.day))
+
+    def partial(self, edges, interaction):
+        """
+        Reduces one day's extracted edges to (window, source, target, weight, first_ts, last_ts), sorted by window, source and target.
+        """
+        import pandas as pd
+        edges = edge_frame(edges, interaction)
+        if self.length is None:
+            edges["window"] = 0
+        else:
+            edges["window"] = self.window_start(edges["seconds"])
+        partial = edges.groupby(["window", "source", "target"], sort=False)["seconds"].agg(["size", "min", "max"]).reset_index()
+        partial.columns = ["window", "source", "target", "weight", "first_ts", "last_ts"]
+        for column in ["first_ts", "last_ts"] + ([] if self.length is None else ["window"]):
+            partial[column] = pd.to_datetime(partial[column], unit="s").dt.strftime(ISO_FORMAT)
+        if self.length is None:
+            partial["window"] = "all"
+        return partial.sort_values(["window", "source", "target"])[PARTIAL_COLUMNS]
+
+    def write_partial(self, edges, interaction, lang, date):
+        path = self.partial_path(interaction, lang, date)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        self.partial(edges, interaction).to_csv(path + TEMP_SUFFIX, index=False)
+        os.replace(path + TEMP_SUFFIX, path)
+        return path
+
+    def window_start(self, seconds):
+        offset = WEEK_OFFSET if self.length % WINDOW_UNITS["w"] == 0 else 0
+        return seconds - (seconds - offset) % self.length
+
+    def merge_span(self, date_range):
+        """
+        Returns (days, windows): the days whose partials are merged for a date range, and the first and last windows
+        overlapping it, as labelled in the partials. The days run from the start of the first window to the end of the last one,
+        past the end of the range when it stops mid-window: partials are read up to the end of that window, so its edges
+        recorded on days after the range are included too.
+        """
+        dates = sorted(date_range)
+        range_start = calendar.timegm(dates[0].timetuple())
+        range_end = calendar.timegm(dates[-1].timetuple()) + 86400
+        first = self.window_start(range_start)
+        last = self.window_start(range_end - 1)
+        first_day = utc_time(first).date()
+        last_day = utc_time(max(last + self.length, range_end) - 1).date()
+        days = [first_day + datetime.timedelta(days=i) for i in range((last_day - first_day).days + 1)]
+        return (days, (time_label(first), time_label(last)))
+
+    def merge(self, interaction, languages, date_range):
+        """
+        Merges the partials of the date range into one edgelist per window overlapping it (and language, if kept separate).
+        Returns the paths written.
+        """
+        outputs = []
+        if not date_range:
+            return outputs
+        groups = [[lang] for lang in languages] if self.by_language else [list(languages)]
+        if self.length is None:
+            (days, windows) = (date_range, None)
+        else:
+            (days, windows) = self.merge_span(date_range)
+        for group in groups:
+            paths = [self.partial_path(interaction, lang, date) for lang in group for date in days]
+            paths = [path for path in paths if os.path.isfile(path)]
+            label = group[0] if self.by_language else "all"
+            if self.length is None:
+                dates = sorted(date_range)
+                label += "_{0}_{1:02}_{2:02}_{3}_{4:02}_{5:02}".format(dates[0].year, dates[0].month, dates[0].day,
+                                                                       dates[-1].year, dates[-1].month, dates[-1].day)
+            outputs.extend(merge_partials(paths, os.path.join(self.window_dir, interaction, label + "{window}.csv"), self.length,
+                                          self.fan_in, windows))
+        return outputs
+
+
+def utc_time(seconds):
+    return datetime.datetime.fromtimestamp(seconds, datetime.timezone.utc)
+
+
+def time_label(seconds):
+    return utc_time(seconds).strftime(ISO_FORMAT)
+
+
+def merged_rows(paths):
+    """
+    Streaming k-way merge of sorted partials: one (window, source, target, weight, first_ts, last_ts) row per key, with
+    the weights summed, the earliest first_ts and the latest last_ts. The output is sorted like a partial.
+    """
+    files = [open(path, 'r', encoding="utf-8", newline='') for path in paths]
+    try:
+        readers = []
+        for infile in files:
+            reader = csv.reader(infile)
+            next(reader, None) # header
+            readers.append(reader)
+        key = operator.itemgetter(0, 1, 2)
+        for ((window, source, target), rows) in itertools.groupby(heapq.merge(*readers, key=key), key=key):
+            weight = 0
+            first_ts = None
+            last_ts = None
+            for row in rows:
+                weight += int(row[3])
+                if first_ts is None or row[4] < first_ts:
+                    first_ts = row[4]
+                if last_ts is None or row[5] > last_ts:
+                    last_ts = row[5]
+            yield (window, source, target, weight, first_ts, last_ts)
+    finally:
+        for infile in files:
+            infile.close()
+
+
+def write_merged(paths, output_path):
+    """
+    Merges sorted partials into one sorted partial, for the intermediate passes of merge_partials.
+    """
+    with open(output_path, 'w', encoding="utf-8", newline='') as out:
+        writer = csv.writer(out, lineterminator='\n')
+        writer.writerow(PARTIAL_COLUMNS)
+        writer.writerows(merged_rows(paths))
+    return output_path
+
+
+def merge_partials(paths, output_file_format, length, fan_in = MERGE_FAN_IN, windows = None):
+    """
+    Merges sorted partials (see merged_rows), writing one edgelist per window, or only for the windows from windows[0] to
+    windows[1] (both included) if given. At most fan_in partials are open at once:
+    with more (e.g. a year of days in every language), groups of fan_in are first merged into intermediate partials,
+    in as many passes as needed, in a temporary directory next to the outputs.
+    """
+    if fan_in < 2:
+        raise ValueError("fan_in must be at least 2, got {0}".format(fan_in))
+    temp_dir = None
+    try:
+        level = 0
+        while len(paths) > fan_in:
+            if temp_dir is None:
+                temp_dir = tempfile.mkdtemp(prefix="merge-", dir=os.path.dirname(output_file_format))
+            level += 1
+            merged = [write_merged(paths[i:i + fan_in], os.path.join(temp_dir, "{0}_{1}.csv".format(level, i // fan_in)))
+                      for i in range(0, len(paths), fan_in)]
+            if level > 1:
+                remove_files(paths) # the previous pass's intermediates, never the partials themselves
+            paths = merged
+        rows = merged_rows(paths)
+        if windows is not None:
+            rows = (row for row in rows if windows[0] <= row[0] <= windows[1]) # ISO times sort as strings
+        return write_windows(rows, output_file_format, length)
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def write_windows(rows, output_file_format, length):
+    """
+    Writes merged rows to one edgelist per window. Returns the paths written.
+    """
+    outputs = []
+    out = None
+    try:
+        current_window = None
+        for (window, source, target, weight, first_ts, last_ts) in rows:
+            if window != current_window:
+                if out is not None:
+                    out.close()
+                    os.replace(outputs[-1] + TEMP_SUFFIX, outputs[-1])
+                current_window = window
+                outputs.append(output_file_format.format(window="" if length is None else "_" + file_label(window, length)))
+                out = open(outputs[-1] + TEMP_SUFFIX, 'w', encoding="utf-8", newline='')
+                writer = csv.writer(out, lineterminator='\n')
+                writer.writerow(EDGE_COLUMNS)
+            writer.writerow((source, target, weight, first_ts, last_ts))
+        if out is not None:
+            out.close()
+            out = None
+            os.replace(outputs[-1] + TEMP_SUFFIX, outputs[-1])
+    finally:
+        if out is not None:
+            out.close()
+    return outputs
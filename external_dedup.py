@@ -0,0 +1,290 @@
+"""
+The following code was produced as part of a project sponsored by the Department of the Navy,
+Office of Naval Research under ONR Grant No. N00014-18-1-2128.
+
+Copyright 2018 The Johns Hopkins University Applied Physics Laboratory LLC
+
+Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+
+import os
+import csv
+import sys
+import glob
+import heapq
+import shutil
+import argparse
+import itertools
+import tempfile
+from run_manifest import TEMP_SUFFIX
+from run_stats import RunStats, REPORT_SUFFIX, clock
+
+"""
+Script deduplicates csv outputs of convert_to_csvs and user_interaction_networks that are too large to load at once,
+e.g. a month of "_users.csv" files or of retweet edgelists, with an external merge sort.
+
+Rows are read into memory until the memory cap is reached, sorted by key, reduced to one row per key and spilled to
+disk as a sorted run. The runs are then k-way merged (at most fanin at a time, in several passes if needed), again keeping
+one row per key, so memory use depends on the cap and not on the size of the inputs.
+
+Of the rows sharing a key, the first (or last) in input order is kept: files in the order given (sorted when matched by a
+directory or pattern), rows in file order. With count, each output row also gets the number of input rows with its key,
+e.g. the weight of each (source, target) pair across a month of edgelists. The output is sorted by key.
+
+* Input parameters:
+- source. A csv file, a directory (every .csv file under it) or a glob pattern such as "target/*/2020_01_*_users.csv".
+  All inputs must have the same header.
+- target. Output csv file.
+- key. Nullable. Comma-separated columns identifying duplicates, e.g. user.id_str. Whole rows by default.
+- keep. Nullable. first (default) or last: which of the rows sharing a key is written.
+- count. Nullable. If present, adds a "count" column with the number of input rows sharing each key.
+- memory. Nullable. Approximate memory for the rows of a run, e.g. 512M or 4G. Default 1G.
+- fanin. Nullable. Runs merged at once (open files), at least 2. Default 64.
+- tmpdir. Nullable. Directory for the sorted runs. Defaults to the system temp directory. Needs up to the size of the inputs.
+- stats. Nullable. If present, prints rates and writes "{target}_report.json" with rows read and written, runs, and the time
+  spent reading and sorting runs and merging them.
+
+Example:
+python external_dedup.py --source "converted/*/2020_01_*_users.csv" --target users_2020_01.csv --key user.id_str --keep last
+"""
+
+DEFAULT_MEMORY = "1G"
+MERGE_FAN_IN = 64
+SIZE_UNITS = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+# Approximate in-memory size of a row: a list with its entry, plus one str object per cell beyond its characters
+ROW_OVERHEAD = 150
+CELL_OVERHEAD = 57
+COUNT_FIELD = "count"
+
+
+def parse_size(text):
+    """
+    Bytes in a size such as 512M, 4G or 1000000.
+    """
+    text = str(text).strip().upper().rstrip("B")
+    if text and text[-1] in SIZE_UNITS:
+        return int(float(text[:-1]) * SIZE_UNITS[text[-1]])
+    return int(text)
+
+
+def parse_fan_in(text):
+    """
+    Runs merged at once, at least 2 (merging fewer would never reduce the number of runs).
+    """
+    fan_in = int(text)
+    if fan_in < 2:
+        raise ValueError("fanin must be at least 2, got {0}".format(fan_in))
+    return fan_in
+
+
+def fan_in_arg(text):
+    try:
+        return parse_fan_in(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def list_inputs(source):
+    if os.path.isdir(source):
+        paths = glob.glob(os.path.join(source, "**", "*.csv"), recursive=True)
+    elif glob.has_magic(source):
+        paths = glob.glob(source, recursive=True)
+    else:
+        paths = [source]
+    return sorted(paths) if len(paths) > 1 else paths
+
+
+def read_rows(paths):
+    """
+    Yields the header of the inputs, then every row. Rows shorter than the header (e.g. a truncated last line) are padded.
+    """
+    header = None
+    for path in paths:
+        with open(path, 'r', encoding="utf-8", newline='') as infile:
+            reader = csv.reader(infile)
+            file_header = next(reader, None)
+            if file_header is None:
+                continue
+            if header is None:
+                header = file_header
+                yield header
+            elif file_header != header:
+                raise ValueError("{0} has a different header than the previous inputs".format(path))
+            width = len(header)
+            for row in reader:
+                if len(row) < width:
+                    row.extend([""] * (width - len(row)))
+                yield row
+
+
+def reduce_sorted(entries, keep = "first"):
+    """
+    Reduces a stream of (key, seq, count, row) sorted by key and seq to one entry per key: the first or last row,
+    with the summed count.
+    """
+    for (key, group) in itertools.groupby(entries, key=lambda entry: entry[0]):
+        entry = next(group)
+        count = entry[2]
+        for other in group:
+            count += other[2]
+            if keep == "last":
+                entry = other
+        yield (key, entry[1], count, entry[3])
+
+
+def write_run(entries, path):
+    with open(path, 'w', encoding="utf-8", newline='') as outfile:
+        writer = csv.writer(outfile, lineterminator='\n')
+        for (key, seq, count, row) in entries:
+            writer.writerow(row + [seq, count])
+    return path
+
+
+def read_run(path, key_indices):
+    with open(path, 'r', encoding="utf-8", newline='') as infile:
+        for row in csv.reader(infile):
+            count = int(row.pop())
+            seq = int(row.pop())
+            yield (tuple([row[i] for i in key_indices]), seq, count, row)
+
+
+def merge_runs(paths, key_indices, keep):
+    """
+    Merged, reduced stream of sorted runs.
+    """
+    return reduce_sorted(heapq.merge(*[read_run(path, key_indices) for path in paths], key=lambda entry: (entry[0], entry[1])), keep)
+
+
+def spill_runs(rows, key_indices, keep, memory, run_dir, run_stats = None):
+    """
+    Reads rows into sorted, reduced runs of at most about memory bytes each. Returns the run paths.
+    """
+    paths = []
+    entries = []
+    size = 0
+    start = clock()
+    for (seq, row) in enumerate(rows):
+        entries.append((tuple([row[i] for i in key_indices]), seq, 1, row))
+        size += ROW_OVERHEAD + CELL_OVERHEAD * len(row) + sum(map(len, row))
+        if size >= memory:
+            paths.append(spill(entries, keep, os.path.join(run_dir, "run_{0}.csv".format(len(paths))), run_stats))
+            entries = []
+            size = 0
+        if run_stats is not None:
+            run_stats.count("read")
+            if seq % 100000 == 0:
+                run_stats.progress()
+    if entries or not paths:
+        paths.append(spill(entries, keep, os.path.join(run_dir, "run_{0}.csv".format(len(paths))), run_stats))
+    if run_stats is not None:
+        run_stats.lap("read_sort", start)
+    return paths
+
+
+def spill(entries, keep, path, run_stats = None):
+    entries.sort(key=lambda entry: (entry[0], entry[1]))
+    write_run(reduce_sorted(entries, keep), path)
+    if run_stats is not None:
+        run_stats.count("runs")
+    return path
+
+
+def external_dedup(input_paths, output_path, key = None, keep = "first", count = False, memory = DEFAULT_MEMORY, tmp_dir = None,
+                   fan_in = MERGE_FAN_IN, stats = False):
+    """
+    Deduplicates the rows of input_paths into output_path (see the module docstring). Returns the number of rows written.
+    """
+    memory = parse_size(memory)
+    fan_in = parse_fan_in(fan_in)
+    run_stats = RunStats(os.path.basename(output_path)) if stats else None
+    rows = read_rows(input_paths)
+    header = next(rows, None)
+    if header is None:
+        print("No rows to deduplicate")
+        return 0
+    columns = key.split(",") if isinstance(key, str) else list(key or header)
+    missing = [column for column in columns if column not in header]
+    if missing:
+        raise ValueError("Key columns {0} not in the header {1}".format(missing, header))
+    key_indices = [header.index(column) for column in columns]
+    run_dir = tempfile.mkdtemp(prefix="dedup-", dir=tmp_dir)
+    written = 0
+    try:
+        print("==Sorting runs==")
+        paths = spill_runs(rows, key_indices, keep, memory, run_dir, run_stats)
+        print("{0} runs".format(len(paths)))
+        start = clock()
+        level = 0
+        while len(paths) > fan_in: # bound the number of open files with intermediate merge passes
+            level += 1
+            print("==Merging {0} runs, pass {1}==".format(len(paths), level))
+            merged = []
+            for i in range(0, len(paths), fan_in):
+                group = paths[i:i + fan_in]
+                merged.append(write_run(merge_runs(group, key_indices, keep),
+                                        os.path.join(run_dir, "merge_{0}_{1}.csv".format(level, len(merged)))))
+                for path in group:
+                    os.remove(path)
+            paths = merged
+        print("==Merging {0} runs into {1}==".format(len(paths), output_path))
+        with open(output_path + TEMP_SUFFIX, 'w', encoding="utf-8", newline='') as outfile:
+            writer = csv.writer(outfile, lineterminator='\n')
+            writer.writerow(header + [COUNT_FIELD] if count else header)
+            for (entry_key, seq, entry_count, row) in merge_runs(paths, key_indices, keep):
+                writer.writerow(row + [entry_count] if count else row)
+                written += 1
+        os.replace(output_path + TEMP_SUFFIX, output_path)
+        if run_stats is not None:
+            run_stats.lap("merge", start)
+            run_stats.count("written", written)
+            run_stats.count("merge_passes", level + 1)
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+    if run_stats is not None:
+        print(run_stats.summary())
+        run_stats.write_report(output_path + REPORT_SUFFIX)
+    return written
+
+
+def cli(argv = None):
+    parser = argparse.ArgumentParser(description="Deduplicate csv outputs larger than memory with an external merge sort.")
+    parser.add_argument('--source', help="csv file, directory of csv files, or glob pattern", required = True)
+    parser.add_argument('--target', help="output csv file", required = True)
+    parser.add_argument('--key', help="Nullable. Comma-separated columns identifying duplicates. Whole rows by default.", required = False)
+    parser.add_argument('--keep', help="Which row of a key to keep, in input order. Options: first, last. Default first.", required = False,
+                        choices = ["first", "last"], default = "first")
+    parser.add_argument('--count', help="If included, adds a count column with the number of input rows sharing each key.",
+                        required = False, action='store_true', default = False)
+    parser.add_argument('--memory', help="Approximate memory for the rows of a sorted run, e.g. 512M, 4G. Default 1G.", required = False,
+                        default = DEFAULT_MEMORY)
+    parser.add_argument('--fanin', help="Number of runs merged at once, at least 2. Default 64.", required = False, type = fan_in_arg, default = MERGE_FAN_IN)
+    parser.add_argument('--tmpdir', help="Nullable. Directory for the sorted runs. System temp directory by default.", required = False)
+    parser.add_argument('--stats', help="If included, prints rates and writes a JSON report of counters and stage timings.",
+                        required = False, action='store_true', default = False)
+    args = parser.parse_args(argv)
+
+    input_paths = list_inputs(args.source)
+    if not input_paths or not all(os.path.isfile(path) for path in input_paths):
+        print("Error: no input files found for {0}".format(args.source))
+        sys.exit(1)
+    print("==Deduplicating {0} files==".format(len(input_paths)))
+    written = external_dedup(input_paths, args.target, args.key, args.keep, args.count, args.memory, args.tmpdir, args.fanin, args.stats)
+    print("{0} rows written to {1}".format(written, args.target))
+    print("==Done!==")
+
+
+if __name__ == '__main__':
+    cli()
@@ -19,9 +19,16 @@ LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON A
 ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
-import pandas as pd
 import argparse
+import concurrent.futures
+import datetime
 import os
+import re
+import shutil
+import tempfile
+from run_stats import RunStats, REPORT_SUFFIX, PROFILE_SUFFIX, clock, profiled
+from partitioned_dataset import Catalog, CATALOG_NAME
+from sna_cli import parse_date
 
 """
 Script creates cooccurrence networks from edgelists (stored as csv).  
@@ -31,8 +38,30 @@ Script creates cooccurrence networks from edgelists (stored as csv).
 with the suffix "_cooccurrences".
 - target. Target directory or file.
 - bytag. The column name over which the cooccurrences should be caluclated.
+- weighted. Nullable. If present, uses the sparse engine and writes one row per user pair with the number of shared tags
+as "weight", instead of one row per user pair per tag. Requires scipy.
+- minweight. Nullable. With weighted (or combine), drop pairs sharing fewer tags than this. Default 1.
+- maxtagdegree. Nullable. With weighted (or combine), ignore tags used by more than this many users.
+- symmetric. Nullable. With weighted (or combine), write both (a, b) and (b, a) instead of each pair once.
+  Without weighted or combine, these three are rejected rather than ignored.
+- combine. Nullable. If present with a source directory, combines every edgelist in it (e.g. user_interactions/hashtags)
+into one weighted co-occurrence network written to the target file, out of core. Requires scipy.
+- start, end. Nullable. With combine, only edgelists dated within this window (YYYY-MM-DD, inclusive).
+- languages. Nullable. With combine, comma-separated list of languages to include. All by default.
+- partitions. Nullable. With combine, number of on-disk partitions (by tag hash, then by pair hash), at least 1. Default 64.
+- workers. Nullable. With combine, number of processes counting partitions, at least 1. Default 1.
+- tmpdir. Nullable. With combine, directory for the spilled partitions. Defaults to the system temp directory.
+- stats. Nullable. If present, prints rates and writes "{output}_report.json" next to each output, with the number of edges read
+and pairs written and the time spent per stage (read, compute, write; partition, count, merge, write with combine).
+- profile. Nullable. If present, each output is produced under cProfile and the stats saved as "{output}_profile.pstats".
+With combine only the main process (partitioning and writing) is profiled.
 """
 
+COOCCURRENCE_CHUNK_SIZE = 20000 # users per block of the sparse product
+READ_CHUNK_SIZE = 1000000 # edgelist rows read at a time when combining a directory
+PARTITIONS = 64
+EDGELIST_NAME = re.compile(r"^(?P<l>[a-z]+)_(?P<y>\d{4})_(?P<m>\d{2})_(?P<d>\d{2})\.csv$")
+
 
 def get_coocurrences(edgelist, by_tag):
     coocurrs = edgelist.merge(edgelist, how="inner", on=by_tag)
@@ -40,27 +69,324 @@ def get_coocurrences(edgelist, by_tag):
     coocurrs = coocurrs.drop_duplicates()
     return coocurrs 
 
-if __name__ == '__main__':
+
+def iter_weighted_coocurrences(edgelist, by_tag, user_field = "user.id_str", min_weight = 1, max_tag_degree = None,
+                               upper_triangle = True, chunk_size = COOCCURRENCE_CHUNK_SIZE):
+    """
+    Computes user-user co-occurrence weights (number of distinct shared tags) as A * A^T, where A is the sparse
+    user x tag incidence matrix. Rows of A are processed in blocks so memory is bounded by the non-zero entries
+    of each output block rather than by the sum of squared tag sizes. Yields one DataFrame per block.
+    """
+    import pandas as pd
+    import numpy as np
+    from scipy import sparse # optional dependency, only needed for the weighted mode
+    user_x = "{0}_x".format(user_field)
+    user_y = "{0}_y".format(user_field)
+    pairs = edgelist[[user_field, by_tag]].dropna().drop_duplicates()
+    if max_tag_degree is not None:
+        tag_degree = pairs[by_tag].map(pairs[by_tag].value_counts())
+        pairs = pairs[tag_degree <= max_tag_degree]
+    (user_codes, users) = pd.factorize(pairs[user_field])
+    (tag_codes, tags) = pd.factorize(pairs[by_tag])
+    users = np.asarray(users, dtype=object)
+    incidence = sparse.csr_matrix((np.ones(len(pairs), dtype=np.int32), (user_codes, tag_codes)),
+                                  shape=(len(users), len(tags)))
+    transposed = incidence.T.tocsc() # tag x user; CSC so that the column slice of each block is cheap
+    for start in range(0, len(users), chunk_size):
+        # with upper_triangle only columns from start onwards can hold pairs (i, j) with i < j
+        col_offset = start if upper_triangle else 0
+        block = (incidence[start:start + chunk_size] @ transposed[:, col_offset:]).tocoo()
+        rows = block.row + start
+        cols = block.col + col_offset
+        keep = (rows < cols) if upper_triangle else (rows != cols)
+        keep &= block.data >= min_weight
+        yield pd.DataFrame({user_x: users[rows[keep]], user_y: users[cols[keep]], "weight": block.data[keep]})
+
+
+def get_weighted_coocurrences(edgelist, by_tag, user_field = "user.id_str", min_weight = 1, max_tag_degree = None,
+                              upper_triangle = True, chunk_size = COOCCURRENCE_CHUNK_SIZE):
+    import pandas as pd
+    chunks = list(iter_weighted_coocurrences(edgelist, by_tag, user_field, min_weight, max_tag_degree, upper_triangle, chunk_size))
+    if not chunks:
+        return pd.DataFrame(columns=["{0}_x".format(user_field), "{0}_y".format(user_field), "weight"])
+    return pd.concat(chunks, ignore_index=True)
+
+
+def write_weighted_coocurrences(edgelist, output_path, by_tag, min_weight = 1, max_tag_degree = None, upper_triangle = True,
+                                run_stats = None):
+    header = True
+    start = clock()
+    for chunk in iter_weighted_coocurrences(edgelist, by_tag, min_weight=min_weight, max_tag_degree=max_tag_degree,
+                                            upper_triangle=upper_triangle):
+        if run_stats is not None:
+            start = run_stats.lap("compute", start)
+        chunk.to_csv(output_path, index=False, header=header, mode='w' if header else 'a')
+        header = False
+        if run_stats is not None:
+            start = run_stats.lap("write", start)
+            run_stats.count("pairs", chunk.shape[0])
+    if header: # no pairs at all, still write the header
+        get_weighted_coocurrences(edgelist.iloc[:0], by_tag).to_csv(output_path, index=False)
+
+# Out-of-core combination of many edgelists
+#
+# 1. Stream every edgelist in the window and append its (user, tag) rows to one of N partition files by tag hash.
+#    Every user of a tag ends up in the same partition, so per-tag work is exact within a partition.
+# 2. For each partition (in a process pool), count shared tags per user pair with the sparse engine and spill
+#    the partial counts into N bucket files by pair hash.
+# 3. For each bucket, sum the partial counts of each pair and append the result to the output.
+
+def list_edgelists(source_dir, start = None, end = None, languages = None):
+    """
+    Returns the paths of the "{lang}_YYYY_MM_DD.csv" edgelists in source_dir that fall inside the window.
+    If source_dir is a table of a partitioned layout (e.g. user_interactions/hashtags written with --layout partitioned),
+    the partitions are selected from the catalog of its parent directory instead.
+    """
+    (root, table) = os.path.split(os.path.normpath(source_dir))
+    if os.path.isfile(os.path.join(root, CATALOG_NAME)):
+        catalog = Catalog(root)
+        if table in catalog.tables():
+            return catalog.paths(table, languages, start, end)
+    paths = []
+    for filename in sorted(os.listdir(source_dir)):
+        match = EDGELIST_NAME.match(filename)
+        if match is None:
+            continue
+        date = datetime.date(int(match.group("y")), int(match.group("m")), int(match.group("d")))
+        if (start and date < start) or (end and date > end) or (languages and match.group("l") not in languages):
+            continue
+        paths.append(os.path.join(source_dir, filename))
+    return paths
+
+
+def hash_partition(values, partitions):
+    import pandas as pd
+    import numpy as np
+    return pd.util.hash_array(np.asarray(values, dtype=object)) % partitions
+
+
+def append_partitions(df, path_format, partition_ids):
+    for (partition, part) in df.groupby(partition_ids, sort=False):
+        path = path_format.format(partition)
+        part.to_csv(path, index=False, header=not os.path.isfile(path), mode='a')
+
+
+def partition_edgelists(input_paths, tmp_dir, by_tag, user_field = "user.id_str", partitions = PARTITIONS,
+                        chunk_size = READ_CHUNK_SIZE, run_stats = None):
+    import pandas as pd
+    path_format = os.path.join(tmp_dir, "tags-{0}.csv")
+    for input_path in input_paths:
+        for chunk in pd.read_csv(input_path, dtype=object, usecols=[user_field, by_tag], chunksize=chunk_size):
+            if run_stats is not None:
+                run_stats.count("edges", chunk.shape[0])
+                run_stats.progress(unit="edges")
+            chunk = chunk.dropna()
+            if by_tag == "hashtag":
+                chunk[by_tag] = chunk[by_tag].str.lower()
+            chunk = chunk.drop_duplicates()
+            append_partitions(chunk, path_format, hash_partition(chunk[by_tag], partitions))
+    return [path_format.format(p) for p in range(partitions) if os.path.isfile(path_format.format(p))]
+
+
+def count_partition(tag_path, tmp_dir, by_tag, user_field = "user.id_str", max_tag_degree = None, partitions = PARTITIONS):
+    """
+    Counts shared tags per user pair within one tag partition and spills the partial counts by pair hash.
+    Pairs are written with the smaller id first so the same pair from different partitions lines up.
+    """
+    import pandas as pd
+    import numpy as np
+    name = os.path.basename(tag_path)[:-4]
+    path_format = os.path.join(tmp_dir, "pairs-{0}-" + name + ".csv")
+    user_x = "{0}_x".format(user_field)
+    user_y = "{0}_y".format(user_field)
+    edgelist = pd.read_csv(tag_path, dtype=object)
+    for chunk in iter_weighted_coocurrences(edgelist, by_tag, user_field, max_tag_degree=max_tag_degree):
+        swap = (chunk[user_x] > chunk[user_y]).to_numpy()
+        (x, y) = (chunk[user_x].to_numpy(), chunk[user_y].to_numpy())
+        chunk[user_x] = np.where(swap, y, x)
+        chunk[user_y] = np.where(swap, x, y)
+        append_partitions(chunk, path_format, hash_partition(chunk[user_x] + " " + chunk[user_y], partitions))
+    os.remove(tag_path)
+
+
+def merge_bucket(tmp_dir, bucket, user_field = "user.id_str", min_weight = 1, symmetric = False):
+    import pandas as pd
+    user_x = "{0}_x".format(user_field)
+    user_y = "{0}_y".format(user_field)
+    prefix = "pairs-{0}-".format(bucket)
+    paths = [os.path.join(tmp_dir, f) for f in os.listdir(tmp_dir) if f.startswith(prefix)]
+    if not paths:
+        return None
+    pairs = pd.concat([pd.read_csv(path, dtype={user_x: object, user_y: object}) for path in paths], ignore_index=True)
+    weights = pairs.groupby([user_x, user_y], sort=False)["weight"].sum().reset_index()
+    weights = weights[weights["weight"] >= min_weight]
+    if symmetric:
+        swapped = weights.rename(columns={user_x: user_y, user_y: user_x})[[user_x, user_y, "weight"]]
+        weights = pd.concat([weights, swapped], ignore_index=True)
+    output_path = os.path.join(tmp_dir, "weights-{0}.csv".format(bucket))
+    weights.to_csv(output_path, index=False, header=False)
+    for path in paths:
+        os.remove(path)
+    return output_path
+
+
+def combine_coocurrences(source_dir, output_path, by_tag, start = None, end = None, languages = None, min_weight = 1,
+                         max_tag_degree = None, symmetric = False, partitions = PARTITIONS, workers = 1, tmp_dir = None, run_stats = None):
+    """
+    Builds one weighted co-occurrence edgelist over every edgelist in source_dir within the window,
+    keeping memory bounded by the size of a single partition.
+    """
+    user_field = "user.id_str"
+    input_paths = list_edgelists(source_dir, start, end, languages)
+    print("==Combining {0} edgelists==".format(len(input_paths)))
+    work_dir = tempfile.mkdtemp(prefix="cooccurrences-", dir=tmp_dir)
+    step = clock()
+    try:
+        tag_paths = partition_edgelists(input_paths, work_dir, by_tag, user_field, partitions, run_stats=run_stats)
+        if run_stats is not None:
+            step = run_stats.lap("partition", step)
+            run_stats.count("edgelists", len(input_paths))
+        print("==Counting {0} partitions==".format(len(tag_paths)))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(count_partition, path, work_dir, by_tag, user_field, max_tag_degree, partitions)
+                       for path in tag_paths]
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
+            if run_stats is not None:
+                step = run_stats.lap("count", step)
+            print("==Merging pair counts==")
+            futures = [executor.submit(merge_bucket, work_dir, bucket, user_field, min_weight, symmetric)
+                       for bucket in range(partitions)]
+            weight_paths = [future.result() for future in futures]
+            if run_stats is not None:
+                step = run_stats.lap("merge", step)
+        with open(output_path, 'w', encoding="utf-8", newline='') as out:
+            out.write("{0}_x,{0}_y,weight\n".format(user_field))
+            for path in weight_paths:
+                if path is not None:
+                    with open(path, 'r', encoding="utf-8", newline='') as weights:
+                        shutil.copyfileobj(weights, out)
+                    if run_stats is not None:
+                        run_stats.count("pairs", count_lines(path))
+        if run_stats is not None:
+            run_stats.lap("write", step)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print("==Done!==")
+
+
+def count_lines(path):
+    with open(path, 'rb') as infile:
+        return sum(chunk.count(b"\n") for chunk in iter(lambda: infile.read(1 << 20), b""))
+
+
+def write_coocurrences(edgelist, output_path, by_tag, weighted = False, min_weight = 1, max_tag_degree = None, symmetric = False,
+                       run_stats = None):
+    if run_stats is not None:
+        run_stats.count("edges", edgelist.shape[0])
+    if weighted:
+        write_weighted_coocurrences(edgelist, output_path, by_tag, min_weight, max_tag_degree, not symmetric, run_stats)
+        return
+    start = clock()
+    coocurrs = get_coocurrences(edgelist, by_tag)
+    if run_stats is not None:
+        start = run_stats.lap("compute", start)
+        run_stats.count("pairs", coocurrs.shape[0])
+    coocurrs.to_csv(output_path, index=False)
+    if run_stats is not None:
+        run_stats.lap("write", start)
+
+
+def stats_for(output_path, stats):
+    """
+    A RunStats labelled after the output, or None when stats are off.
+    """
+    return RunStats(os.path.basename(output_path)) if stats else None
+
+
+def finish_stats(run_stats, output_path):
+    if run_stats is not None:
+        print(run_stats.summary(unit="edges"))
+        run_stats.write_report(os.path.splitext(output_path)[0] + REPORT_SUFFIX)
+
+
+def cli(argv = None):
     parser = argparse.ArgumentParser(description="Create user-user networks based on Twitter interactions.")
     parser.add_argument('--source', help="source directory", required = True)
     parser.add_argument('--target', help="target directory", required = True)
     parser.add_argument("--bytag", help="tag to use to find coocurrences. Examples: hashtag, retweeted_user", required = True)
-    args = parser.parse_args()
+    parser.add_argument("--weighted", help="If included, writes weighted user pairs (count of shared tags) using sparse matrices.",
+                        action='store_true', default = False)
+    parser.add_argument("--minweight", help="With --weighted or --combine, minimum number of shared tags for a pair. Default 1.", type = int, default = 1)
+    parser.add_argument("--maxtagdegree", help="With --weighted or --combine, ignore tags used by more than this many users.", type = int, default = None)
+    parser.add_argument("--symmetric", help="With --weighted or --combine, write each pair in both directions.", action='store_true', default = False)
+    parser.add_argument("--combine", help="If included, combines every edgelist in the source directory into one weighted network written to target.",
+                        action='store_true', default = False)
+    parser.add_argument("--start", help="With --combine, first date to include. Date format: YYYY-MM-DD", required = False)
+    parser.add_argument("--end", help="With --combine, last date to include. Date format: YYYY-MM-DD", required = False)
+    parser.add_argument("--languages", help="With --combine, comma-separated list of languages. All by default.", required = False)
+    parser.add_argument("--partitions", help="With --combine, number of on-disk partitions. Default 64.", type = int, default = PARTITIONS)
+    parser.add_argument("--workers", help="With --combine, number of processes. Default 1.", type = int, default = 1)
+    parser.add_argument("--tmpdir", help="With --combine, directory for spilled partitions.", required = False)
+    parser.add_argument("--stats", help="If included, prints rates and writes a JSON report of counters and stage timings per output.",
+                        action='store_true', default = False)
+    parser.add_argument("--profile", help="If included, runs each output under cProfile and saves the stats next to it.",
+                        action='store_true', default = False)
+    args = parser.parse_args(argv)
+    if args.combine and not os.path.isdir(args.source):
+        parser.error("--combine needs a source directory of edgelists: {0}".format(args.source))
+    combine_only = [name for (name, value, default) in [("--start", args.start, None), ("--end", args.end, None),
+                                                       ("--languages", args.languages, None), ("--partitions", args.partitions, PARTITIONS),
+                                                       ("--workers", args.workers, 1), ("--tmpdir", args.tmpdir, None)]
+                    if value != default]
+    if combine_only and not args.combine:
+        parser.error("{0} only apply with --combine".format(", ".join(combine_only)))
+    weighted_only = [name for (name, value, default) in [("--minweight", args.minweight, 1), ("--maxtagdegree", args.maxtagdegree, None),
+                                                         ("--symmetric", args.symmetric, False)]
+                     if value != default]
+    if weighted_only and not (args.weighted or args.combine):
+        parser.error("{0} only apply with --weighted or --combine".format(", ".join(weighted_only)))
+    for (name, value) in [("--partitions", args.partitions), ("--workers", args.workers)]:
+        if value < 1:
+            parser.error("{0} must be at least 1, got {1}".format(name, value))
+    import pandas as pd # after parsing, so --help and usage errors do not load it
     
     source = args.source
     target = args.target
-    if os.path.isdir(source):
+    if args.combine:
+        languages = args.languages.split(",") if args.languages else None
+        run_stats = stats_for(target, args.stats)
+        with profiled(os.path.splitext(target)[0] + PROFILE_SUFFIX if args.profile else None):
+            combine_coocurrences(source, target, args.bytag, parse_date(args.start), parse_date(args.end), languages,
+                                 args.minweight, args.maxtagdegree, args.symmetric, args.partitions, args.workers, args.tmpdir, run_stats)
+        finish_stats(run_stats, target)
+    elif os.path.isdir(source):
         for input_file in os.listdir(source):
-            input_path = source + str(input_file)
-            edgelist = pd.read_csv(input_path, dtype=object)
-            edgelist = edgelist[["user.id_str", "hashtag"]].drop_duplicates()
-            edgelist['hashtag'] = edgelist['hashtag'].str.lower()
-            coocurrs = get_coocurrences(edgelist, args.bytag)
+            input_path = os.path.join(source, str(input_file))
             output_path = target + "/" + input_file[:-4] + "_cooccurrences.csv"
-            coocurrs.to_csv(output_path, index=False)
+            run_stats = stats_for(output_path, args.stats)
+            with profiled(output_path[:-4] + PROFILE_SUFFIX if args.profile else None):
+                start = clock()
+                edgelist = pd.read_csv(input_path, dtype=object)
+                edgelist = edgelist[["user.id_str", "hashtag"]].drop_duplicates()
+                edgelist['hashtag'] = edgelist['hashtag'].str.lower()
+                if run_stats is not None:
+                    run_stats.lap("read", start)
+                write_coocurrences(edgelist, output_path, args.bytag, args.weighted, args.minweight, args.maxtagdegree, args.symmetric,
+                                   run_stats)
+            finish_stats(run_stats, output_path)
     elif os.path.isfile(source):
-        edgelist = pd.read_csv(source, dtype=object)
-        coocurrs = get_coocurrences(edgelist, args.bytag)
-        coocurrs.to_csv(target, index=False)
+        run_stats = stats_for(target, args.stats)
+        with profiled(os.path.splitext(target)[0] + PROFILE_SUFFIX if args.profile else None):
+            start = clock()
+            edgelist = pd.read_csv(source, dtype=object)
+            if run_stats is not None:
+                run_stats.lap("read", start)
+            write_coocurrences(edgelist, target, args.bytag, args.weighted, args.minweight, args.maxtagdegree, args.symmetric, run_stats)
+        finish_stats(run_stats, target)
     else:
         print("Error finding source directory or file: {0}".format(source))
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,234 @@
+"""
+The following code was produced as part of a project sponsored by the Department of the Navy,
+Office of Naval Research under ONR Grant No. N00014-18-1-2128.
+
+Copyright 2018 The Johns Hopkins University Applied Physics Laboratory LLC
+
+Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+
+import os
+import json
+from run_manifest import TEMP_SUFFIX
+from edge_aggregation import edge_frame
+
+"""
+Graph-native output for user_interaction_networks: integer node ids and NumPy arrays instead of string edgelists.
+
+Node ids come from persistent dictionaries shared by every day and interaction: users (tweet authors, replied-to, retweeted,
+quoted and mentioned users) and hashtags. A dictionary is a text file with one name per line, the id of a name being its
+line number, so it only ever grows: days processed later append their new names, and ids written earlier stay valid.
+New names are appended and synced before any array refers to them.
+
+Each day's edges are reduced to one edge per (source, target), with the number of interactions (weight) and the time of
+the first one (timestamp, seconds since the epoch, UTC), sorted by source and target. Arrays are saved as .npy files, so
+np.load(path, mmap_mode="r") maps them without parsing or copying; load_graph does this for a whole day.
+
+* Layouts:
+- edges. source.npy, target.npy, weight.npy and timestamp.npy, one element per edge.
+- csr. rows.npy, indptr.npy, indices.npy, weight.npy and timestamp.npy: the sparse adjacency of the day, with one row
+  per source node active that day rather than per node of the dictionary, so a sparse day stays small however many
+  users the dictionary holds. rows holds the user id of each row (sorted) and indptr has one element per row (plus one),
+  so scipy.sparse.csr_matrix((weight, indices, indptr), shape=meta["shape"]) is the day's matrix, with local rows
+  and the target dictionary's ids as columns. edge_sources gives the user id of every edge in either layout.
+Node ids are int32, or int64 once a dictionary holds 2^31 names. Weights are int32 and timestamps int64.
+
+* Output structure (under user_interactions):
+graph/nodes/users.txt and graph/nodes/hashtags.txt, the node dictionaries.
+graph/{interaction}/{lang}_YYYY_MM_DD/, the arrays of one day plus meta.json (layout, dictionaries, shape of the arrays'
+matrix, dictionary sizes, dtypes, edge count).
+"""
+
+GRAPH_LAYOUTS = ["edges", "csr"]
+LAYOUT_FILES = {"edges": ["source.npy", "target.npy", "weight.npy", "timestamp.npy"],
+                "csr": ["rows.npy", "indptr.npy", "indices.npy", "weight.npy", "timestamp.npy"]}
+META_NAME = "meta.json"
+NODE_DIR = "nodes"
+# Dictionary of the target nodes of each interaction; sources are always users
+TARGET_NODES = {"replies": "users", "retweets": "users", "quotes": "users", "mentions": "users", "hashtags": "hashtags"}
+INT32_LIMIT = 2 ** 31
+
+
+def id_dtype(n_nodes):
+    import numpy as np
+    return np.int32 if n_nodes < INT32_LIMIT else np.int64
+
+
+def save_array(path, array):
+    import numpy as np
+    with open(path + TEMP_SUFFIX, 'wb') as outfile:
+        np.save(outfile, array)
+    os.replace(path + TEMP_SUFFIX, path)
+    return path
+
+
+class NodeDictionary:
+    """
+    A node dictionary file in memory. A torn last line, left by an interrupted append or by a writer still appending,
+    is not a name yet and is ignored. Only with repair (the writer, see GraphWriter) is it cut from the file, so readers
+    never change a dictionary another process may be appending to.
+    """
+
+    def __init__(self, path, repair = False):
+        self.path = path
+        self.names = []
+        self.pending = []
+        if os.path.isfile(path):
+            with open(path, 'rb') as infile:
+                data = infile.read()
+            complete = data.rfind(b"\n") + 1
+            if repair and complete < len(data): # its name was never referenced, arrays are only written after a save
+                with open(path, 'r+b') as outfile:
+                    outfile.truncate(complete)
+            self.names = data[:complete].decode("utf-8").split("\n")[:-1]
+        self.ids = {name: i for (i, name) in enumerate(self.names)}
+
+    def __len__(self):
+        return len(self.names)
+
+    def encode(self, values):
+        """
+        Ids of an array of names, adding names not seen before.
+        """
+        import pandas as pd
+        import numpy as np
+        (codes, uniques) = pd.factorize(values)
+        ids = np.empty(len(uniques), dtype=np.int64)
+        for (i, name) in enumerate(uniques):
+            node_id = self.ids.get(name)
+            if node_id is None:
+                node_id = len(self.names)
+                self.ids[name] = node_id
+                self.names.append(name)
+                self.pending.append(name)
+            ids[i] = node_id
+        return ids[codes]
+
+    def save(self):
+        """
+        Appends the names added since the last save.
+        """
+        if not self.pending:
+            return
+        with open(self.path, 'a', encoding="utf-8", newline="\n") as outfile:
+            outfile.write("".join(name + "\n" for name in self.pending))
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        self.pending = []
+
+
+class GraphWriter:
+
+    def __init__(self, output_dir, layout = "edges"):
+        if layout not in GRAPH_LAYOUTS:
+            raise ValueError("Unknown graph layout {0}. Options: {1}".format(layout, ", ".join(GRAPH_LAYOUTS)))
+        self.layout = layout
+        self.graph_dir = os.path.join(output_dir, "graph")
+        node_dir = os.path.join(self.graph_dir, NODE_DIR)
+        if not os.path.isdir(node_dir):
+            os.makedirs(node_dir)
+        self.nodes = {name: NodeDictionary(os.path.join(node_dir, name + ".txt"), repair=True) for name in sorted(set(TARGET_NODES.values()))}
+
+    def day_dir(self, interaction, lang, date):
+        return os.path.join(self.graph_dir, interaction, "{0}_{1}_{2:02}_{3:02}".format(lang, date.year, date.month, date.day))
+
+    def day_graph(self, edges, interaction):
+        """
+        Encodes one day's extracted edges and reduces them to one edge per (source, target), sorted by source and target.
+        """
+        import pandas as pd
+        edges = edge_frame(edges, interaction)
+        users = self.nodes["users"]
+        targets = self.nodes[TARGET_NODES[interaction]]
+        edges = pd.DataFrame({"source": users.encode(edges["source"].to_numpy()),
+                              "target": targets.encode(edges["target"].to_numpy()),
+                              "seconds": edges["seconds"].to_numpy()})
+        graph = edges.groupby(["source", "target"], sort=True)["seconds"].agg(["size", "min"]).reset_index()
+        return (graph, users, targets)
+
+    def write(self, edges, interaction, lang, date):
+        """
+        Writes the arrays of one day and returns the paths written.
+        """
+        import numpy as np
+        (graph, users, targets) = self.day_graph(edges, interaction)
+        for nodes in self.nodes.values():
+            nodes.save() # before any array refers to the new ids
+        day_dir = self.day_dir(interaction, lang, date)
+        if not os.path.isdir(day_dir):
+            os.makedirs(day_dir)
+        source_dtype = id_dtype(len(users))
+        target_dtype = id_dtype(len(targets))
+        arrays = {"weight.npy": graph["size"].to_numpy(dtype=np.int32),
+                  "timestamp.npy": graph["min"].to_numpy(dtype=np.int64)}
+        if self.layout == "csr":
+            (rows, counts) = np.unique(graph["source"].to_numpy(), return_counts=True) # graph is sorted by source
+            arrays["rows.npy"] = rows.astype(source_dtype)
+            arrays["indptr.npy"] = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+            arrays["indices.npy"] = graph["target"].to_numpy(dtype=target_dtype)
+            shape = [len(rows), len(targets)]
+        else:
+            arrays["source.npy"] = graph["source"].to_numpy(dtype=source_dtype)
+            arrays["target.npy"] = graph["target"].to_numpy(dtype=target_dtype)
+            shape = [len(users), len(targets)]
+        outputs = [save_array(os.path.join(day_dir, name), arrays[name]) for name in LAYOUT_FILES[self.layout]]
+        for layout in GRAPH_LAYOUTS: # files of the other layout from an earlier run would no longer match the dictionaries' meta
+            for name in LAYOUT_FILES[layout]:
+                path = os.path.join(day_dir, name)
+                if name not in LAYOUT_FILES[self.layout] and os.path.isfile(path):
+                    os.remove(path)
+        meta = {"layout": self.layout,
+                "source_nodes": "users",
+                "target_nodes": TARGET_NODES[interaction],
+                "shape": shape,
+                "nodes": [len(users), len(targets)],
+                "edges": int(graph.shape[0]),
+                "interactions": int(arrays["weight.npy"].sum()),
+                "dtypes": {name[:-len(".npy")]: str(arrays[name].dtype) for name in LAYOUT_FILES[self.layout]}}
+        meta_path = os.path.join(day_dir, META_NAME)
+        with open(meta_path + TEMP_SUFFIX, 'w', encoding="utf-8") as outfile:
+            json.dump(meta, outfile, indent=1)
+        os.replace(meta_path + TEMP_SUFFIX, meta_path)
+        return outputs + [meta_path]
+
+
+def load_graph(day_dir, mmap_mode = "r"):
+    """
+    Loads the arrays of one day, memory-mapped by default. Returns a dict of arrays plus "meta".
+    """
+    import numpy as np
+    with open(os.path.join(day_dir, META_NAME), 'r', encoding="utf-8") as infile:
+        meta = json.load(infile)
+    graph = {name[:-len(".npy")]: np.load(os.path.join(day_dir, name), mmap_mode=mmap_mode) for name in LAYOUT_FILES[meta["layout"]]}
+    graph["meta"] = meta
+    return graph
+
+
+def edge_sources(graph):
+    """
+    User id of the source of every edge of a day loaded with load_graph, in either layout.
+    """
+    import numpy as np
+    if graph["meta"]["layout"] == "csr":
+        return np.repeat(graph["rows"], np.diff(graph["indptr"]))
+    return graph["source"]
+
+
+def load_nodes(graph_dir, name):
+    """
+    Names of a node dictionary, indexed by id. The file is only read, so this is safe while a run is appending to it.
+    """
+    return NodeDictionary(os.path.join(graph_dir, NODE_DIR, name + ".txt")).names
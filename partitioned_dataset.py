@@ -0,0 +1,163 @@
+"""
+The following code was produced as part of a project sponsored by the Department of the Navy,
+Office of Naval Research under ONR Grant No. N00014-18-1-2128.
+
+Copyright 2018 The Johns Hopkins University Applied Physics Laboratory LLC
+
+Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+
+import os
+import csv
+import json
+import datetime
+import functools
+from run_manifest import TEMP_SUFFIX
+
+"""
+Hive-style partitioned layout, shared by convert_to_csvs and user_interaction_networks.
+
+Each table (tweets and users from the converter, one per interaction from the network builder) is split into partitions
+by language and date, e.g. "tweets/lang=en/date=2020-01-31/part-0.csv" (or .parquet). A catalog.json at the root of the
+dataset lists every partition with its files, row counts and sizes. The writers add the partitions of a shard once its files
+are in place and then save the catalog, once per shard, replacing it atomically, so readers never see a half-updated catalog
+or a partition whose files are still being written. Files are written under a temporary name starting with "_" (see
+run_manifest.temp_path), so one left behind by a crash is not read as data.
+
+Readers select partitions from the catalog by table, language and date (see Catalog.select and read_partitions), so a
+sparse multi-year range costs one small JSON read instead of a stat call per (language, date). Files starting with "_"
+(e.g. per-shard reports) are ignored by Hive-style readers such as pyarrow.dataset.
+"""
+
+CATALOG_NAME = "catalog.json"
+PART_NAME = "part-0"
+LAYOUTS = ["flat", "partitioned"]
+
+
+@functools.lru_cache(maxsize=4096)
+def date_value(date):
+    return "{0}-{1:02}-{2:02}".format(date.year, date.month, date.day)
+
+
+def partition_key(table, lang, date):
+    return "{0}/lang={1}/date={2}".format(table, lang, date_value(date))
+
+
+def partition_dir(root, table, lang, date):
+    return os.path.join(root, partition_key(table, lang, date))
+
+
+def part_path(root, table, lang, date, extension):
+    return os.path.join(partition_dir(root, table, lang, date), PART_NAME + "." + extension)
+
+
+def count_rows(path):
+    """
+    Number of records in a part file: from the footer for parquet, by parsing for csv (cells may hold newlines).
+    """
+    if path.endswith(".parquet"):
+        import pyarrow.parquet
+        return pyarrow.parquet.ParquetFile(path).metadata.num_rows
+    with open(path, 'r', encoding="utf-8", newline='') as infile:
+        return max(sum(1 for row in csv.reader(infile)) - 1, 0) # header
+
+
+class Catalog:
+
+    def __init__(self, root):
+        self.root = root
+        self.path = os.path.join(root, CATALOG_NAME)
+        self.partitions = {}
+        self.changed = False
+        if os.path.isfile(self.path):
+            with open(self.path, 'r', encoding="utf-8") as infile:
+                self.partitions = json.load(infile).get("partitions", {})
+
+    def add(self, table, lang, date, paths, rows = None):
+        """
+        Records the files of a partition, replacing any earlier entry. rows, if given, holds the row count of each path;
+        otherwise they are counted. Missing files are left out, and a partition without files is removed.
+        The change is only written by save, so the partitions of a shard are saved together.
+        """
+        files = []
+        for (i, path) in enumerate(paths):
+            if not os.path.isfile(path):
+                continue
+            files.append({"path": os.path.relpath(path, self.root),
+                          "rows": rows[i] if rows is not None else count_rows(path),
+                          "bytes": os.path.getsize(path)})
+        key = partition_key(table, lang, date)
+        if files:
+            self.partitions[key] = {"table": table, "lang": lang, "date": date_value(date), "files": files,
+                                    "updated": datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")}
+        else:
+            self.partitions.pop(key, None)
+        self.changed = True
+
+    def save(self):
+        """
+        Writes the catalog if partitions were added since it was read or last saved.
+        """
+        if not self.changed:
+            return
+        temp_path = self.path + TEMP_SUFFIX
+        with open(temp_path, 'w', encoding="utf-8") as outfile:
+            json.dump({"partitions": self.partitions}, outfile, indent=1, sort_keys=True)
+        os.replace(temp_path, self.path)
+        self.changed = False
+
+    def tables(self):
+        return sorted(set(entry["table"] for entry in self.partitions.values()))
+
+    def select(self, table, languages = None, start = None, end = None, dates = None):
+        """
+        Catalog entries of table, filtered by language, by an inclusive start/end date and/or by a list of dates,
+        sorted by language and date.
+        """
+        start = date_value(start) if start is not None else None
+        end = date_value(end) if end is not None else None
+        dates = set(date_value(date) for date in dates) if dates is not None else None
+        entries = []
+        for entry in self.partitions.values():
+            if entry["table"] != table or (languages is not None and entry["lang"] not in languages):
+                continue
+            if (start and entry["date"] < start) or (end and entry["date"] > end) or (dates is not None and entry["date"] not in dates):
+                continue
+            entries.append(entry)
+        return sorted(entries, key=lambda entry: (entry["lang"], entry["date"]))
+
+    def paths(self, table, languages = None, start = None, end = None, dates = None):
+        return [os.path.join(self.root, f["path"]) for entry in self.select(table, languages, start, end, dates) for f in entry["files"]]
+
+
+def read_partitions(root, table, languages = None, start = None, end = None, dates = None, columns = None):
+    """
+    Reads the matching partitions of table into one DataFrame with lang and date columns added.
+    Only the selected files are opened; csv cells are read as strings, like the scripts do.
+    """
+    import pandas as pd # the catalog itself is used by convert_to_csvs, which starts without pandas
+    frames = []
+    for entry in Catalog(root).select(table, languages, start, end, dates):
+        for f in entry["files"]:
+            path = os.path.join(root, f["path"])
+            if path.endswith(".parquet"):
+                frame = pd.read_parquet(path, columns=columns)
+            else:
+                frame = pd.read_csv(path, dtype=object, usecols=columns, lineterminator="\n")
+            frames.append(frame.assign(lang=entry["lang"], date=entry["date"]))
+    if not frames:
+        return pd.DataFrame(columns=(list(columns) if columns else []) + ["lang", "date"])
+    return pd.concat(frames, ignore_index=True)
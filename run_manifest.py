@@ -0,0 +1,156 @@
+"""
+The following code was produced as part of a project sponsored by the Department of the Navy,
+Office of Naval Research under ONR Grant No. N00014-18-1-2128.
+
+Copyright 2018 The Johns Hopkins University Applied Physics Laboratory LLC
+
+Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import os
+import json
+import hashlib
+import datetime
+import functools
+
+"""
+Manifest of completed (language, date) shards, shared by convert_to_csvs and user_interaction_networks.
+
+Each shard records its input file (path, size, mtime and optionally a checksum), a fingerprint of the run settings,
+the outputs it produced, and whether it finished. With --resume, a shard is skipped when it finished with the same
+settings, its input is unchanged and its outputs still exist. Anything else (new, changed, failed, or interrupted
+mid-write) is redone; outputs are written under a temporary name and renamed into place, so an interrupted shard
+never leaves a half-written output behind.
+
+Each record is appended as one line to a JSON-lines log next to the manifest (manifest.json.log) instead of rewriting
+the whole manifest per shard. The log is folded into manifest.json at the end of a run, or when the manifest is next
+loaded after an interrupted run; a last line cut short by the interruption is ignored.
+"""
+
+MANIFEST_NAME = "manifest.json"
+LOG_SUFFIX = ".log"
+TEMP_SUFFIX = ".tmp"
+
+
+def file_checksum(path, chunk_size = 1 << 20):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def settings_fingerprint(settings):
+    return hashlib.sha1(json.dumps(settings, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+@functools.lru_cache(maxsize=4096)
+def shard_key(lang, date):
+    return "{0}/{1}-{2:02}-{3:02}".format(lang, date.year, date.month, date.day)
+
+
+def temp_path(path):
+    """
+    Name an output is written under before being renamed to path: in the same directory, starting with "_" so that
+    dataset readers (pyarrow.dataset, Spark, Hive) skip it if an interrupted run leaves it inside a partition.
+    """
+    (directory, name) = os.path.split(path)
+    return os.path.join(directory, "_" + name + TEMP_SUFFIX)
+
+
+def replace_outputs(temp_paths, final_paths):
+    """
+    Moves freshly written outputs into place. A final output with no new counterpart is removed,
+    so the outputs always reflect the latest run of the shard.
+    """
+    for (temp_path, final_path) in zip(temp_paths, final_paths):
+        if os.path.isfile(temp_path):
+            os.replace(temp_path, final_path)
+        elif os.path.isfile(final_path):
+            os.remove(final_path)
+
+
+def remove_files(paths):
+    for path in paths:
+        if os.path.isfile(path):
+            os.remove(path)
+
+
+class RunManifest:
+
+    def __init__(self, path):
+        self.path = path
+        self.log_path = path + LOG_SUFFIX
+        self.log = None
+        self.shards = {}
+        if os.path.isfile(path):
+            with open(path, 'r', encoding="utf-8") as infile:
+                self.shards = json.load(infile).get("shards", {})
+        if os.path.isfile(self.log_path): # records of an interrupted run
+            self.replay()
+            self.compact()
+
+    def replay(self):
+        with open(self.log_path, 'r', encoding="utf-8") as infile:
+            for line in infile:
+                try:
+                    record = json.loads(line)
+                except ValueError: # cut short by the interruption
+                    break
+                self.shards[record["key"]] = record["shard"]
+
+    def is_complete(self, key, input_file, settings, use_checksum = False):
+        entry = self.shards.get(key)
+        if entry is None or entry.get("status") != "done" or entry.get("settings") != settings_fingerprint(settings):
+            return False
+        if not all(os.path.isfile(output) for output in entry.get("outputs", [])):
+            return False
+        stat = os.stat(input_file)
+        if entry.get("input") != os.path.abspath(input_file) or entry.get("size") != stat.st_size:
+            return False
+        if entry.get("mtime") == stat.st_mtime:
+            return True
+        # touched but possibly unchanged, e.g. copied again from the collection server
+        return use_checksum and entry.get("checksum") is not None and entry["checksum"] == file_checksum(input_file)
+
+    def record(self, key, input_file, settings, status, outputs = (), error = None, use_checksum = False):
+        stat = os.stat(input_file)
+        self.shards[key] = {"input": os.path.abspath(input_file),
+                            "size": stat.st_size,
+                            "mtime": stat.st_mtime,
+                            "checksum": file_checksum(input_file) if use_checksum and status == "done" else None,
+                            "settings": settings_fingerprint(settings),
+                            "status": status,
+                            "outputs": [os.path.abspath(output) for output in outputs if os.path.isfile(output)],
+                            "error": error,
+                            "finished": datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")}
+        if self.log is None:
+            self.log = open(self.log_path, 'a', encoding="utf-8")
+        self.log.write(json.dumps({"key": key, "shard": self.shards[key]}, sort_keys=True) + "\n")
+        self.log.flush()
+
+    def compact(self):
+        """
+        Writes every shard to the manifest and removes the log.
+        """
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+        temp_path = self.path + TEMP_SUFFIX
+        with open(temp_path, 'w', encoding="utf-8") as outfile:
+            json.dump({"shards": self.shards}, outfile, indent=1, sort_keys=True)
+        os.replace(temp_path, self.path)
+        if os.path.isfile(self.log_path):
+            os.remove(self.log_path)
@@ -0,0 +1,135 @@
+"""
+The following code was produced as part of a project sponsored by the Department of the Navy,
+Office of Naval Research under ONR Grant No. N00014-18-1-2128.
+
+Copyright 2018 The Johns Hopkins University Applied Physics Laboratory LLC
+
+Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import cProfile
+import contextlib
+import datetime
+import json
+import os
+import time
+from run_manifest import TEMP_SUFFIX
+
+"""
+Optional run instrumentation shared by convert_to_csvs, user_interaction_networks and get_cooccurences.
+
+A RunStats keeps counters (e.g. tweets read, parsed, filtered, written, failed, references expanded) and the time
+spent in each stage of one shard. It prints a progress line with rates at most every PROGRESS_INTERVAL seconds and
+writes a JSON report when the shard is done. The scripts only create one when --stats is given; otherwise
+the hot paths skip every timing call.
+
+With --profile, each shard (or the whole run where there are no shards) also runs under cProfile and the stats are
+dumped next to its outputs, to be read with pstats or a viewer such as snakeviz.
+"""
+
+PROGRESS_INTERVAL = 10.0 # seconds between progress lines
+REPORT_SUFFIX = "_report.json"
+PROFILE_SUFFIX = "_profile.pstats"
+
+clock = time.perf_counter
+
+
+class RunStats:
+
+    def __init__(self, label, progress_interval = PROGRESS_INTERVAL):
+        self.label = label
+        self.counters = {}
+        self.timers = {}
+        self.progress_interval = progress_interval
+        self.started = datetime.datetime.now(datetime.timezone.utc)
+        self.start_time = clock()
+        self.next_progress = self.start_time + progress_interval
+
+    def count(self, name, n = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def lap(self, stage, start):
+        """
+        Adds the time since start to stage and returns the current time, so consecutive stages can be chained.
+        """
+        now = clock()
+        self.timers[stage] = self.timers.get(stage, 0.0) + (now - start)
+        return now
+
+    def add_time(self, stage, seconds):
+        """
+        Adds time measured elsewhere, e.g. in another thread or process.
+        """
+        self.timers[stage] = self.timers.get(stage, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        start = clock()
+        try:
+            yield
+        finally:
+            self.lap(stage, start)
+
+    def elapsed(self):
+        return clock() - self.start_time
+
+    def progress(self, unit = "read"):
+        """
+        Prints a progress line if the progress interval has passed since the last one.
+        """
+        now = clock()
+        if now < self.next_progress:
+            return
+        self.next_progress = now + self.progress_interval
+        print(self.summary(unit))
+
+    def summary(self, unit = "read"):
+        elapsed = self.elapsed()
+        rate = self.counters.get(unit, 0) / elapsed if elapsed else 0.0
+        counts = ", ".join("{0} {1:,}".format(name, value) for (name, value) in sorted(self.counters.items()))
+        return "[{0}] {1:.1f}s, {2:,.0f} {3}/s: {4}".format(self.label, elapsed, rate, unit, counts)
+
+    def report(self):
+        elapsed = self.elapsed()
+        return {"label": self.label,
+                "started": self.started.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "seconds": round(elapsed, 3),
+                "counters": dict(sorted(self.counters.items())),
+                "timers": {stage: round(seconds, 3) for (stage, seconds) in sorted(self.timers.items())},
+                "rates": {name: round(value / elapsed, 1) for (name, value) in sorted(self.counters.items())} if elapsed else {}}
+
+    def write_report(self, path):
+        temp_path = path + TEMP_SUFFIX
+        with open(temp_path, 'w', encoding="utf-8") as outfile:
+            json.dump(self.report(), outfile, indent=1)
+        os.replace(temp_path, path)
+        return path
+
+
+@contextlib.contextmanager
+def profiled(path):
+    """
+    Runs the body under cProfile and dumps the stats to path. Does nothing if path is None.
+    """
+    if path is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
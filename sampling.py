@@ -0,0 +1,123 @@
+"""
+The following code was produced as part of a project sponsored by the Department of the Navy,
+Office of Naval Research under ONR Grant No. N00014-18-1-2128.
+
+Copyright 2018 The Johns Hopkins University Applied Physics Laboratory LLC
+
+Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+
+import hashlib
+import itertools
+
+"""
+Sampling and early exit for exploratory runs, shared by convert_to_csvs and user_interaction_networks.
+
+A tweet is in the sample when the hash of its id_str (or of its author's user.id_str) falls below the sample fraction.
+The hash only depends on the id, so the same tweets (or users, with all their tweets) are sampled on every day and by
+both scripts: networks built from a sampled conversion, or sampled themselves, stay consistent across days. The converter keeps
+the retweeted and quoted tweets embedded in a sampled tweet, and the network builder resolves the authors of retweeted and
+quoted tweets from every tweet read, so sampled retweets and quotes keep their targets.
+A limit stops reading each shard after that many tweets (lines, or rows of converted tweets).
+
+After a sampled or limited run, SampleEstimate extrapolates the time and output size of the full run from the part of
+each shard's input that was read and the fraction sampled. Time is scaled by the part read only, since sampled-out
+tweets are still read and decoded; it underestimates runs dominated by writing.
+"""
+
+SAMPLE_FIELDS = ["id_str", "user.id_str"]
+HASH_RANGE = 1 << 64
+
+
+def sample_hash(value):
+    return int.from_bytes(hashlib.blake2b(str(value).encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def sample_for(fraction = None, field = "id_str", limit = None):
+    """
+    Sample for the --sample, --samplefield and --limit arguments of the scripts, or None when neither a fraction nor a
+    limit is given. Given values are passed on as they are, so Sample rejects e.g. --sample 0 instead of running in full.
+    """
+    if fraction is None and limit is None:
+        return None
+    return Sample(1.0 if fraction is None else fraction, field, limit)
+
+
+class Sample:
+
+    def __init__(self, fraction = 1.0, field = "id_str", limit = None):
+        if not 0 < fraction <= 1:
+            raise ValueError("Sample fraction must be in (0, 1], got {0}".format(fraction))
+        if field not in SAMPLE_FIELDS:
+            raise ValueError("Unknown sample field {0}. Options: {1}".format(field, ", ".join(SAMPLE_FIELDS)))
+        if limit is not None and limit < 1:
+            raise ValueError("Sample limit must be at least 1, got {0}".format(limit))
+        self.fraction = fraction
+        self.field = field
+        self.limit = limit
+        self.threshold = int(fraction * HASH_RANGE)
+
+    def settings(self):
+        """
+        What the sample changes in the outputs, for run manifests.
+        """
+        return {"fraction": self.fraction, "field": self.field if self.fraction < 1 else None, "limit": self.limit}
+
+    def contains(self, value):
+        return value is not None and sample_hash(value) < self.threshold
+
+    def keep(self, tweet):
+        """
+        Whether a decoded tweet is in the sample.
+        """
+        if self.fraction >= 1:
+            return True
+        if self.field == "id_str":
+            return self.contains(tweet.get("id_str"))
+        return self.contains((tweet.get("user") or {}).get("id_str"))
+
+    def mask(self, values):
+        """
+        Boolean list marking the sampled values of a column (e.g. id_str or user.id_str of converted tweets).
+        """
+        return [self.contains(value) if isinstance(value, str) else False for value in values]
+
+    def lines(self, tweet_file):
+        return tweet_file if self.limit is None else itertools.islice(tweet_file, self.limit)
+
+
+class SampleEstimate:
+
+    def __init__(self, sample):
+        self.sample = sample
+        self.shards = []
+
+    def add(self, label, seconds, consumed, output_bytes):
+        """
+        Records a shard: its time, the part of its input read (0 to 1) and the bytes it wrote.
+        """
+        self.shards.append((label, seconds, max(consumed, 1e-9), output_bytes))
+
+    def summary(self):
+        seconds = sum(shard[1] for shard in self.shards)
+        output_bytes = sum(shard[3] for shard in self.shards)
+        full_seconds = sum(shard[1] / shard[2] for shard in self.shards)
+        full_bytes = sum(shard[3] / (shard[2] * self.sample.fraction) for shard in self.shards)
+        read = sum(shard[2] for shard in self.shards) / len(self.shards) if self.shards else 0.0
+        return ("{0} shards, {1:.1%} of their input read, {2:.0%} sampled by {3}: {4:.1f}s, {5:,} bytes written.\n"
+                "Estimated full run: {6:.1f}s ({7:.2f}h), {8:,.0f} bytes ({9:.2f} GB) written.").format(
+                    len(self.shards), read, self.sample.fraction, self.sample.field, seconds, output_bytes,
+                    full_seconds, full_seconds / 3600, full_bytes, full_bytes / 2 ** 30)
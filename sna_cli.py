@@ -0,0 +1,116 @@
+"""
+The following code was produced as part of a project sponsored by the Department of the Navy,
+Office of Naval Research under ONR Grant No. N00014-18-1-2128.
+
+Copyright 2018 The Johns Hopkins University Applied Physics Laboratory LLC
+
+Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import os
+import sys
+import datetime
+import functools
+import importlib
+
+"""
+Common command line for the processing scripts, e.g.
+
+python sna_cli.py convert --source raw --target csv --start 2020-01-01 --end 2020-01-31
+python sna_cli.py networks --source csv --target networks --start 2020-01-01 --end 2020-01-31
+
+Each command runs the cli() of its script with the remaining arguments, exactly as running the script directly would,
+and the scripts keep working on their own. Only the chosen script is imported, so a command (or its --help) does not
+pay for the imports of the others. pandas, numpy, pyarrow and scipy are only imported by the functions that use them,
+so every script (and its --help) starts without them. Check with e.g. python -X importtime -c "import convert_to_csvs",
+or benchmarks/bench_startup.py.
+
+Date ranges are built here with the standard library (pd.datetime no longer exists in current pandas) and cached,
+as are the formatted dates of the catalogs and manifests. DirectoryCache lists an input directory once per run so
+finding the input of every (language, date) does not stat each candidate path.
+
+* Input parameters:
+- command. One of the COMMANDS below.
+- The arguments of that script, see its --help.
+"""
+
+COMMANDS = {"convert": "convert_to_csvs",
+            "networks": "user_interaction_networks",
+            "cooccurrences": "get_cooccurences",
+            "authorindex": "tweet_author_index",
+            "dedup": "external_dedup"}
+
+
+def parse_date(value):
+    """
+    Date from YYYY-MM-DD, or None for None.
+    """
+    if value is None:
+        return None
+    (y, m, d) = [int(x) for x in value.split("-")]
+    return datetime.date(y, m, d)
+
+
+@functools.lru_cache(maxsize=64)
+def date_range(start, end):
+    """
+    Every date from start to end, both included, like pd.date_range with the default daily frequency.
+    Accepts dates or YYYY-MM-DD strings. Returns a tuple, shared by every caller asking for the same range.
+    """
+    if isinstance(start, str):
+        start = parse_date(start)
+    if isinstance(end, str):
+        end = parse_date(end)
+    return tuple(start + datetime.timedelta(days=i) for i in range((end - start).days + 1))
+
+
+class DirectoryCache:
+    """
+    File names of each directory asked about, listed once. Meant for one run: files created afterwards are not seen.
+    """
+    def __init__(self):
+        self.listings = {}
+
+    def names(self, directory):
+        if directory not in self.listings:
+            try:
+                with os.scandir(directory) as entries:
+                    self.listings[directory] = frozenset(entry.name for entry in entries if entry.is_file())
+            except OSError: # missing or unreadable, e.g. a language without data
+                self.listings[directory] = frozenset()
+        return self.listings[directory]
+
+    def isfile(self, path):
+        (directory, name) = os.path.split(path)
+        return name in self.names(directory or ".")
+
+
+def usage():
+    return "usage: sna_cli.py {{{0}}} [arguments]\n\ncommands:\n{1}".format(
+        ",".join(COMMANDS), "\n".join("  {0:<15} {1}.py".format(command, script) for (command, script) in COMMANDS.items()))
+
+
+def main(argv = None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or argv[0] not in COMMANDS:
+        print(usage())
+        return 0 if argv and argv[0] in ("-h", "--help") else 2
+    script = importlib.import_module(COMMANDS[argv[0]])
+    sys.argv[0] = "sna_cli.py " + argv[0] # shown by argparse in usage and errors
+    return script.cli(argv[1:])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
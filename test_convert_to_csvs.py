@@ -0,0 +1,359 @@
+"""
+Regression tests for convert_to_csvs, on synthetic day files (see benchmarks/synthetic.py).
+"""
+
+import csv
+import datetime
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import convert_to_csvs
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks"))
+import synthetic
+
+DATE = datetime.date(2020, 1, 1)
+
+
+@pytest.fixture(scope="module")
+def day_file(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("source") / "01.txt")
+    synthetic.write_day(path, "en", DATE, 600)
+    with open(path, 'a') as outfile:
+        outfile.write("{not json\n") # a failed line must be skipped the same way by both paths
+    return path
+
+
+def read_outputs(output_filename):
+    """
+    Contents of the tweet and user outputs, in that order.
+    """
+    outputs = []
+    for path in convert_to_csvs.output_paths(output_filename):
+        with open(path, 'rb') as infile:
+            outputs.append(infile.read())
+    return outputs
+
+
+@pytest.mark.parametrize("users", ["rows", "daily"])
+def test_pipeline_matches_serial(tmp_path, day_file, users):
+    serial = str(tmp_path / "serial")
+    pipelined = str(tmp_path / "pipelined")
+    keywordfilter = convert_to_csvs.KeywordFilter(["news", "vote"], "contains_keyword", False)
+    serial_rows = convert_to_csvs.process_file(day_file, serial, keywordfilter, users=users)[0]
+    # small batches, so rows from many batches and both workers are interleaved by the writer
+    pipelined_rows = convert_to_csvs.pipeline_file(day_file, pipelined, keywordfilter, users=users, workers=2, batch_size=16)[0]
+    assert all(serial_rows)
+    assert pipelined_rows == serial_rows
+    assert read_outputs(pipelined) == read_outputs(serial)
+
+
+def read_tree(directory):
+    """
+    Contents of every file under directory, by relative path, except the manifest (it records finishing times).
+    """
+    files = {}
+    for (root, dirs, names) in os.walk(directory):
+        for name in names:
+            path = os.path.join(root, name)
+            if name != convert_to_csvs.MANIFEST_NAME:
+                with open(path, 'rb') as infile:
+                    files[os.path.relpath(path, directory)] = infile.read()
+    return files
+
+
+def test_workers_match_serial(tmp_path, capsys):
+    source = str(tmp_path / "source")
+    dates = [DATE, DATE + datetime.timedelta(days=1)]
+    for (seed, lang) in enumerate(["en", "fr", "ru"]):
+        for date in dates:
+            synthetic.write_day(convert_to_csvs.INPUT_FORMAT.format(folder=source, l=lang, y=date.year, m=date.month, d=date.day),
+                                lang, date, 150, seed)
+    bad_input = convert_to_csvs.INPUT_FORMAT.format(folder=source, l="de", y=DATE.year, m=DATE.month, d=DATE.day) + ".gz"
+    os.makedirs(os.path.dirname(bad_input))
+    with open(bad_input, 'wb') as outfile:
+        outfile.write(b"not gzip") # its shard fails, the others must still be converted
+    trees = {}
+    for workers in [1, 2]:
+        target = str(tmp_path / "workers_{0}".format(workers))
+        convert_to_csvs.main(source, target, dates, workers=workers)
+        out = capsys.readouterr().out
+        assert "Unable to process {0}".format(bad_input) in out
+        if workers > 1:
+            assert "de 2020-01-01 failed" in out and "1 of 7 shards failed" in out
+        manifest = convert_to_csvs.RunManifest(os.path.join(target, convert_to_csvs.MANIFEST_NAME))
+        statuses = {key: shard["status"] for (key, shard) in manifest.shards.items()}
+        assert statuses.pop("de/2020-01-01") == "failed"
+        assert len(statuses) == 6 and set(statuses.values()) == {"done"}
+        trees[workers] = read_tree(target)
+    assert len([path for path in trees[1] if path.endswith(".csv")]) == 12 # tweets and users of six shards
+    assert not any(path.startswith("de" + os.sep) and path.endswith(".csv") for path in trees[1])
+    assert trees[2] == trees[1]
+
+
+def compress(data, suffix):
+    if suffix == ".gz":
+        import gzip
+        return gzip.compress(data)
+    if suffix == ".bz2":
+        import bz2
+        return bz2.compress(data)
+    if suffix == ".xz":
+        import lzma
+        return lzma.compress(data)
+    if suffix == ".zst":
+        zstandard = pytest.importorskip("zstandard")
+        return zstandard.ZstdCompressor().compress(data)
+    return data
+
+
+@pytest.fixture(scope="module")
+def plain_conversion(tmp_path_factory, day_file):
+    target = str(tmp_path_factory.mktemp("plain"))
+    convert_to_csvs.process_shard(("en", DATE, day_file, os.path.join(target, "en", "2020_01_01")), loads=json.loads)
+    return read_tree(target)
+
+
+@pytest.mark.parametrize("suffix", [""] + convert_to_csvs.COMPRESSED_SUFFIXES)
+@pytest.mark.parametrize("backend", convert_to_csvs.JSON_BACKENDS)
+def test_compression_and_decoder_do_not_change_outputs(tmp_path, day_file, plain_conversion, suffix, backend):
+    if backend != "json":
+        pytest.importorskip(backend)
+    source = str(tmp_path / "source")
+    path = convert_to_csvs.INPUT_FORMAT.format(folder=source, l="en", y=DATE.year, m=DATE.month, d=DATE.day)
+    os.makedirs(os.path.dirname(path))
+    with open(day_file, 'rb') as infile, open(path + suffix, 'wb') as outfile:
+        outfile.write(compress(infile.read(), suffix))
+    target = str(tmp_path / "target")
+    convert_to_csvs.main(source, target, [DATE], loads=convert_to_csvs.load_json_decoder(backend))
+    assert len(plain_conversion) == 2 # tweets and users
+    assert read_tree(target) == plain_conversion
+
+
+def user(name, followers = 1, user_id = "1"):
+    values = dict(id_str=user_id, name=name, screen_name="user" + user_id, followers_count=followers)
+    return tuple(values.get(field) for field in convert_to_csvs.USER_FIELDS)
+
+
+def history(tmp_path, observations):
+    """
+    Writes (user row, created_at) observations through a history UserDimension, returns (name, first_seen, last_seen) rows.
+    """
+    path = str(tmp_path / "users.csv")
+    with convert_to_csvs.UserDimension(convert_to_csvs.RecordWriter(path, convert_to_csvs.USER_DIMENSION_FIELDS),
+                                       history=True) as users:
+        for (row, created_at) in observations:
+            users.write(row, created_at)
+    with open(path, 'r', newline='') as infile:
+        return [(row["user.name"], row["first_seen"], row["last_seen"]) for row in csv.DictReader(infile)]
+
+
+def created_at(second):
+    return "Wed Jan 01 10:00:{0:02} +0000 2020".format(second)
+
+
+def test_history_returns_to_earlier_profile(tmp_path):
+    # out of arrival order, the later profile A is a version of its own and counts do not start versions
+    observations = [(user("A"), created_at(1)), (user("A", 5), created_at(50)), (user("B"), created_at(20)),
+                    (user("A", 2), created_at(2)), (user("B", 3), created_at(30))]
+    assert history(tmp_path, observations) == [("A", created_at(1), created_at(2)), ("B", created_at(20), created_at(30)),
+                                               ("A", created_at(50), created_at(50))]
+
+
+def test_history_changes_within_one_second(tmp_path):
+    observations = [(user("A"), created_at(1)), (user("B"), created_at(1)), (user("A"), created_at(1)),
+                    (user("C", user_id="2"), created_at(1)), (user("C", 2, user_id="2"), created_at(1))]
+    assert history(tmp_path, observations) == [("A", created_at(1), created_at(1)), ("B", created_at(1), created_at(1)),
+                                               ("A", created_at(1), created_at(1)), ("C", created_at(1), created_at(1))]
+
+
+def test_outputs_do_not_depend_on_locale(tmp_path):
+    # Arabic text cannot be encoded in ASCII, so any output opened with the locale's encoding would drop every tweet
+    day_file = str(tmp_path / "01.txt")
+    synthetic.write_day(day_file, "ar", DATE, 50)
+    expected = str(tmp_path / "expected")
+    convert_to_csvs.process_file(day_file, expected)
+    ascii_locale = str(tmp_path / "ascii_locale")
+    env = dict(os.environ, LC_ALL="C", PYTHONUTF8="0", PYTHONCOERCECLOCALE="0", PYTHONIOENCODING="utf-8")
+    script = "import convert_to_csvs, sys; convert_to_csvs.process_file(sys.argv[1], sys.argv[2])"
+    subprocess.run([sys.executable, "-c", script, day_file, ascii_locale], check=True, env=env,
+                   cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert read_outputs(ascii_locale) == read_outputs(expected)
+
+
+@pytest.fixture(scope="module")
+def doubled_file(tmp_path_factory):
+    """
+    A day file in which every line comes twice, the second copy after the whole first one.
+    """
+    path = str(tmp_path_factory.mktemp("doubled") / "01.txt")
+    synthetic.write_day(path, "en", DATE, 300)
+    with open(path, 'r', encoding="utf-8") as infile:
+        lines = infile.read()
+    with open(path, 'w', encoding="utf-8") as outfile:
+        outfile.write(lines + lines)
+    return path
+
+
+def tweet_ids(output_filename):
+    with open(convert_to_csvs.output_paths(output_filename)[0], 'r', encoding="utf-8", newline='') as infile:
+        return [row["id_str"] for row in csv.DictReader(infile)]
+
+
+def test_dedup_modes(tmp_path, doubled_file):
+    rows = {}
+    for (name, dedup, slots) in [("exact", "exact", None), ("none", "none", None), ("bounded", "bounded", 1 << 16),
+                                 ("one_slot", "bounded", 1)]:
+        output = str(tmp_path / name)
+        kwargs = {} if slots is None else {"dedup_slots": slots}
+        convert_to_csvs.process_file(doubled_file, output, dedup=dedup, **kwargs)
+        rows[name] = tweet_ids(output)
+    unique = set(rows["none"])
+    assert sorted(rows["exact"]) == sorted(unique)
+    assert len(rows["none"]) >= 2 * len(unique) # every line comes twice
+    for name in ["bounded", "one_slot"]: # duplicates may get through, new keys are never dropped
+        assert set(rows[name]) == unique
+        assert len(unique) <= len(rows[name]) <= len(rows["none"])
+    assert len(rows["bounded"]) < len(rows["none"])
+
+
+def test_dedup_slots_below_one(tmp_path):
+    with pytest.raises(ValueError):
+        convert_to_csvs.BoundedSeenSet(0)
+    with pytest.raises(SystemExit):
+        convert_to_csvs.cli(["--source", str(tmp_path), "--target", str(tmp_path / "out"), "--start", "2020-01-01",
+                             "--end", "2020-01-01", "--dedup", "bounded", "--dedupslots", "0"])
+
+
+class FakePool:
+
+    def __init__(self):
+        self.shut_down = False
+
+    def shutdown(self):
+        self.shut_down = True
+
+
+def test_transform_pool_shut_down_on_error(tmp_path, monkeypatch):
+    source = str(tmp_path / "source")
+    synthetic.write_day(convert_to_csvs.INPUT_FORMAT.format(folder=source, l="en", y=DATE.year, m=DATE.month, d=DATE.day),
+                        "en", DATE, 10)
+    pools = []
+    def open_pool(*args, **kwargs):
+        pools.append(FakePool())
+        return pools[-1]
+    def fail(*args, **kwargs):
+        raise RuntimeError("interrupted")
+    monkeypatch.setattr(convert_to_csvs, "open_transform_pool", open_pool)
+    monkeypatch.setattr(convert_to_csvs, "process_shard", fail)
+    with pytest.raises(RuntimeError):
+        convert_to_csvs.main(source, str(tmp_path / "target"), [DATE], pipeline=2)
+    assert len(pools) == 1 and pools[0].shut_down
+
+
+def test_pipeline_below_zero(tmp_path):
+    with pytest.raises(SystemExit):
+        convert_to_csvs.cli(["--source", str(tmp_path), "--target", str(tmp_path / "out"), "--start", "2020-01-01",
+                             "--end", "2020-01-01", "--pipeline", "-1"])
+
+
+# KeywordFilter against the checks it replaced: one any() over the keywords per field, every field checked
+
+def full_text(tweet):
+    return tweet['extended_tweet']['full_text'] if tweet['truncated'] else tweet['text']
+
+
+def baseline_text(keywords, tweet):
+    text = full_text(tweet).lower()
+    return any(term in text for term in keywords)
+
+
+def baseline_author(keywords, tweet):
+    return any(term.replace(" ", "") == tweet['user']['screen_name'] for term in keywords)
+
+
+def baseline_entities(keywords, tweet):
+    entities = [tweet.get('entities')]
+    if tweet['truncated']:
+        entities += [tweet['extended_tweet'].get('entities'), tweet['extended_tweet'].get('extended_entities')]
+    values = set()
+    for entity in entities:
+        if entity:
+            values.update(h['text'].lower() for h in entity.get("hashtags") or [])
+            values.update(m['screen_name'] for m in entity.get("user_mentions") or [])
+    return not values.isdisjoint(keywords)
+
+
+BASELINE_CHECKS = {"author": baseline_author, "text": baseline_text, "entities": baseline_entities}
+
+
+def keyword_tweet(text, screen_name = "someone", hashtags = (), mentions = ()):
+    return {"text": text, "truncated": False, "user": {"screen_name": screen_name},
+            "entities": {"hashtags": [{"text": h} for h in hashtags], "user_mentions": [{"screen_name": m} for m in mentions]}}
+
+
+@pytest.fixture(scope="module")
+def keyword_tweets():
+    tweets = []
+    for tweet in synthetic.TweetGenerator("en").tweets(DATE, 300):
+        tweets.append(tweet)
+        tweets.extend(tweet[field] for field in convert_to_csvs.TWEET_REF_FIELDS if tweet.get(field))
+    tweets += [keyword_tweet("I like c++ and a.b (vote) [x]"), keyword_tweet("axb wor|ld"), keyword_tweet("عاجل: أخبار اليوم"),
+               keyword_tweet("nothing", screen_name="breakingnews", hashtags=["Vote2020"], mentions=["News"])]
+    return tweets
+
+
+def keyword_sets(tweets):
+    hashtags = sorted(set(h["text"].lower() for tweet in tweets for h in (tweet.get("entities") or {}).get("hashtags", [])))
+    screen_names = sorted(set(tweet["user"]["screen_name"] for tweet in tweets))
+    return [["news", "new", "ne", "vote", "today"], # keywords that are prefixes of each other
+            hashtags[:20] + screen_names[:20] + ["breaking news", "vote2020", "News"],
+            ["c++", "a.b", "(vote)", "wor|ld", "[x]", "\\d", "^i"], # regex syntax is matched literally
+            ["أخبار", "News", "NEWS"], # the text is lowercased, keywords are not
+            [""], # an empty keyword is in every text
+            []]
+
+
+@pytest.mark.parametrize("filters", [None, ["text"], ["author"], ["entities"], ["author", "entities"]])
+def test_keyword_filter_matches_baseline(keyword_tweets, filters):
+    for keywords in keyword_sets(keyword_tweets):
+        checked = filters or convert_to_csvs.KEYWORD_FIELDS
+        for do_filter in [True, False]:
+            keywordfilter = convert_to_csvs.KeywordFilter(keywords, "contains_keyword", do_filter, filters)
+            for tweet in keyword_tweets:
+                expected = {field: BASELINE_CHECKS[field](keywords, tweet) for field in checked}
+                assert keywordfilter.check_text(tweet) == baseline_text(keywords, tweet)
+                assert keywordfilter.check_author(tweet) == baseline_author(keywords, tweet)
+                assert keywordfilter.check_entities(tweet) == baseline_entities(keywords, tweet)
+                assert keywordfilter.check_tweet(tweet) == any(expected.values())
+                (write, match) = keywordfilter.evaluate(tweet)
+                assert write == (not do_filter or any(expected.values()))
+                if match is None:
+                    assert not any(expected.values())
+                    continue
+                (field, keyword) = match
+                # the first filter, in the order filters are run, that the baseline found a keyword for
+                assert field == next(f for f in keywordfilter.filters if expected[f])
+                if field == "text":
+                    assert keyword in keywords and keyword in full_text(tweet).lower()
+                elif field == "author":
+                    assert keyword in keywords and keyword.replace(" ", "") == tweet["user"]["screen_name"]
+                else:
+                    assert keyword in keywords
+
+
+def test_evaluate_runs_each_filter_at_most_once(keyword_tweets):
+    keywordfilter = convert_to_csvs.KeywordFilter(["news", "vote"], "contains_keyword", True)
+    calls = []
+    for (field, match) in list(keywordfilter.filters.items()):
+        keywordfilter.filters[field] = lambda tweet, field=field, match=match: calls.append(field) or match(tweet)
+    for tweet in keyword_tweets:
+        del calls[:]
+        (write, found) = keywordfilter.evaluate(tweet)
+        assert len(calls) == len(set(calls))
+        if found is not None:
+            assert calls[-1] == found[0] # stops at the first match
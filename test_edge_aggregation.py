@@ -0,0 +1,142 @@
+"""
+Regression tests for edge_aggregation: merging in several passes must give the same edgelists as one pass, and a run
+must not rewrite windows outside its date range.
+"""
+
+import csv
+import datetime
+import os
+import random
+
+import pytest
+
+import edge_aggregation
+from edge_aggregation import PARTIAL_COLUMNS
+
+WINDOWS = ["2020-01-01T00:00:00Z", "2020-01-01T06:00:00Z", "2020-01-01T12:00:00Z"]
+
+
+def write_partials(directory, count = 20, rows = 50, users = 15):
+    """
+    Sorted partials like WindowAggregator.write_partial writes, with the same (window, source, target) in many of them.
+    """
+    rng = random.Random(0)
+    paths = []
+    for i in range(count):
+        keys = sorted(set((rng.choice(WINDOWS), "u{0}".format(rng.randrange(users)), "u{0}".format(rng.randrange(users)))
+                          for _ in range(rows)))
+        path = os.path.join(directory, "partial_{0:02}.csv".format(i))
+        with open(path, 'w', newline='') as outfile:
+            writer = csv.writer(outfile, lineterminator='\n')
+            writer.writerow(PARTIAL_COLUMNS)
+            for (window, source, target) in keys:
+                ts = sorted("{0}{1:02}:00Z".format(window[:14], rng.randrange(60)) for _ in range(2))
+                writer.writerow([window, source, target, rng.randrange(1, 5), ts[0], ts[1]])
+        paths.append(path)
+    return paths
+
+
+def expected_edges(paths):
+    edges = {}
+    for path in paths:
+        with open(path, 'r', newline='') as infile:
+            for row in csv.DictReader(infile):
+                key = (row["window"], row["source"], row["target"])
+                (weight, first_ts, last_ts) = edges.get(key, (0, row["first_ts"], row["last_ts"]))
+                edges[key] = (weight + int(row["weight"]), min(first_ts, row["first_ts"]), max(last_ts, row["last_ts"]))
+    return edges
+
+
+def read_edgelists(paths):
+    edgelists = {}
+    for path in paths:
+        with open(path, 'rb') as infile:
+            edgelists[os.path.basename(path)] = infile.read()
+    return edgelists
+
+
+def merge(partials, directory, fan_in):
+    os.makedirs(directory)
+    return edge_aggregation.merge_partials(partials, os.path.join(directory, "all{window}.csv"), 6 * 3600, fan_in)
+
+
+def test_multi_pass_matches_single_pass(tmp_path):
+    partials = write_partials(str(tmp_path))
+    single = merge(partials, str(tmp_path / "single"), 64)
+    multi = merge(partials, str(tmp_path / "multi"), 2) # 20 partials: 4 intermediate passes
+    assert len(single) == len(WINDOWS)
+    assert read_edgelists(multi) == read_edgelists(single)
+    assert sorted(os.listdir(str(tmp_path / "multi"))) == sorted(os.path.basename(path) for path in multi) # intermediates removed
+    assert all(os.path.isfile(path) for path in partials)
+    merged = {}
+    for (path, window) in zip(single, WINDOWS):
+        with open(path, 'r', newline='') as infile:
+            for row in csv.DictReader(infile):
+                merged[(window, row["source"], row["target"])] = (int(row["weight"]), row["first_ts"], row["last_ts"])
+    assert merged == expected_edges(partials)
+
+
+def test_fan_in_below_two(tmp_path):
+    partials = write_partials(str(tmp_path), count=3)
+    with pytest.raises(ValueError):
+        merge(partials, str(tmp_path / "out"), 1)
+
+
+def write_day_partial(aggregator, date, rows):
+    """
+    Writes (window, source, target) rows, one interaction each, as the quotes partial of an "en" day.
+    """
+    path = aggregator.partial_path("quotes", "en", date)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', newline='') as outfile:
+        writer = csv.writer(outfile, lineterminator='\n')
+        writer.writerow(PARTIAL_COLUMNS)
+        for (window, source, target) in sorted(rows):
+            writer.writerow([window, source, target, 1, window, window])
+    return path
+
+
+def test_consecutive_days_keep_earlier_windows(tmp_path):
+    aggregator = edge_aggregation.WindowAggregator(str(tmp_path), "day")
+    (day1, day2) = (datetime.date(2020, 1, 1), datetime.date(2020, 1, 2))
+    # quotes of older tweets carry the older tweet's time, so a day's partial holds edges of earlier windows
+    write_day_partial(aggregator, day1, [("2019-12-27T00:00:00Z", "u1", "u2"), ("2020-01-01T00:00:00Z", "u1", "u3"),
+                                         ("2020-01-01T00:00:00Z", "u2", "u3")])
+    first = aggregator.merge("quotes", ["en"], [day1])
+    assert [os.path.basename(path) for path in first] == ["all_2020_01_01.csv"]
+    before = read_edgelists(first)
+    write_day_partial(aggregator, day2, [("2020-01-01T00:00:00Z", "u4", "u5"), ("2020-01-02T00:00:00Z", "u1", "u3")])
+    second = aggregator.merge("quotes", ["en"], [day2])
+    assert [os.path.basename(path) for path in second] == ["all_2020_01_02.csv"]
+    assert read_edgelists(first) == before
+    assert not os.path.isfile(os.path.join(aggregator.window_dir, "quotes", "all_2019_12_27.csv"))
+
+
+def test_partly_covered_window_keeps_other_days(tmp_path):
+    aggregator = edge_aggregation.WindowAggregator(str(tmp_path), "week")
+    week = "2020-01-06T00:00:00Z" # a Monday
+    write_day_partial(aggregator, datetime.date(2020, 1, 6), [(week, "u1", "u2"), (week, "u2", "u3")])
+    write_day_partial(aggregator, datetime.date(2020, 1, 8), [(week, "u1", "u2"), ("2019-12-30T00:00:00Z", "u3", "u4")])
+    outputs = aggregator.merge("quotes", ["en"], [datetime.date(2020, 1, 8)])
+    assert [os.path.basename(path) for path in outputs] == ["all_2020_01_06.csv"]
+    with open(outputs[0], 'r', newline='') as infile:
+        edges = [(row["source"], row["target"], row["weight"]) for row in csv.DictReader(infile)]
+    assert edges == [("u1", "u2", "2"), ("u2", "u3", "1")]
+
+
+def test_range_ending_mid_window_counts_late_edges(tmp_path):
+    aggregator = edge_aggregation.WindowAggregator(str(tmp_path), "week")
+    week = "2020-01-06T00:00:00Z" # a Monday
+    write_day_partial(aggregator, datetime.date(2020, 1, 6), [(week, "u1", "u2")])
+    # recorded after the range but within its last window, e.g. on a day converted later
+    write_day_partial(aggregator, datetime.date(2020, 1, 10), [(week, "u1", "u2"), (week, "u3", "u4")])
+    write_day_partial(aggregator, datetime.date(2020, 1, 13), [("2020-01-13T00:00:00Z", "u1", "u2")]) # the next window
+    date_range = [datetime.date(2020, 1, 7), datetime.date(2020, 1, 8)] # ends on a Wednesday
+    (days, windows) = aggregator.merge_span(date_range)
+    assert (days[0], days[-1], len(days)) == (datetime.date(2020, 1, 6), datetime.date(2020, 1, 12), 7)
+    assert windows == (week, week)
+    outputs = aggregator.merge("quotes", ["en"], date_range)
+    assert [os.path.basename(path) for path in outputs] == ["all_2020_01_06.csv"]
+    with open(outputs[0], 'r', newline='') as infile:
+        edges = [(row["source"], row["target"], row["weight"]) for row in csv.DictReader(infile)]
+    assert edges == [("u1", "u2", "2"), ("u3", "u4", "1")]
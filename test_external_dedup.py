@@ -0,0 +1,80 @@
+"""
+Regression tests for external_dedup: the row kept for each key must not depend on how the rows were spilled and merged.
+"""
+
+import csv
+import itertools
+
+import pytest
+
+import external_dedup
+
+HEADER = ["key", "value"]
+
+
+def write_inputs(tmp_path, files = 3, rows = 200, keys = 37):
+    paths = []
+    values = itertools.count()
+    for i in range(files):
+        path = tmp_path / "input_{0}.csv".format(i)
+        with open(path, 'w', newline='') as outfile:
+            writer = csv.writer(outfile, lineterminator='\n')
+            writer.writerow(HEADER)
+            for j in range(rows):
+                writer.writerow(["k{0:02}".format((j * 7 + i) % keys), next(values)])
+        paths.append(str(path))
+    return paths
+
+
+def expected_rows(paths, keep):
+    """
+    The same deduplication in memory: first or last row of each key in input order, with the count, sorted by key.
+    """
+    kept = {}
+    counts = {}
+    for path in paths:
+        with open(path, 'r', newline='') as infile:
+            reader = csv.reader(infile)
+            next(reader)
+            for row in reader:
+                counts[row[0]] = counts.get(row[0], 0) + 1
+                if keep == "last" or row[0] not in kept:
+                    kept[row[0]] = row
+    return [kept[key] + [str(counts[key])] for key in sorted(kept)]
+
+
+def read_output(path):
+    with open(path, 'r', newline='') as infile:
+        return list(csv.reader(infile))
+
+
+@pytest.mark.parametrize("keep", ["first", "last"])
+def test_keep_under_spills(tmp_path, capsys, keep):
+    paths = write_inputs(tmp_path)
+    output = str(tmp_path / "output.csv")
+    # a few rows per run and 2 runs merged at once: many runs and several merge passes
+    written = external_dedup.external_dedup(paths, output, key="key", keep=keep, count=True, memory="1K", tmp_dir=str(tmp_path),
+                                            fan_in=2)
+    assert "pass 2" in capsys.readouterr().out
+    rows = read_output(output)
+    assert rows[0] == HEADER + [external_dedup.COUNT_FIELD]
+    assert rows[1:] == expected_rows(paths, keep)
+    assert written == len(rows) - 1
+
+
+@pytest.mark.parametrize("keep", ["first", "last"])
+def test_spills_match_single_run(tmp_path, keep):
+    paths = write_inputs(tmp_path)
+    (spilled, single) = (str(tmp_path / "spilled.csv"), str(tmp_path / "single.csv"))
+    external_dedup.external_dedup(paths, spilled, key="key", keep=keep, memory="1K", tmp_dir=str(tmp_path), fan_in=3)
+    external_dedup.external_dedup(paths, single, key="key", keep=keep, tmp_dir=str(tmp_path))
+    assert read_output(spilled) == read_output(single)
+
+
+@pytest.mark.parametrize("fan_in", [0, 1])
+def test_fan_in_below_two(tmp_path, fan_in):
+    paths = write_inputs(tmp_path, files=1)
+    with pytest.raises(ValueError):
+        external_dedup.external_dedup(paths, str(tmp_path / "output.csv"), fan_in=fan_in)
+    with pytest.raises(SystemExit):
+        external_dedup.cli(["--source", paths[0], "--target", str(tmp_path / "output.csv"), "--fanin", str(fan_in)])
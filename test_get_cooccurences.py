@@ -0,0 +1,126 @@
+"""
+Regression tests for get_cooccurences: weighted co-occurrences, in memory or combined out of core, must equal a
+brute-force count of the tags each pair of users shares.
+"""
+
+import csv
+import itertools
+import os
+import random
+
+import pytest
+
+import get_cooccurences
+
+USER_X = "user.id_str_x"
+USER_Y = "user.id_str_y"
+
+
+def random_edges(seed, rows = 300, users = 40, tags = 25):
+    rng = random.Random(seed)
+    return [("u{0}".format(rng.randrange(users)), rng.choice(["Tag{0}", "tag{0}"]).format(int(rng.paretovariate(1.2)) % tags))
+            for _ in range(rows)]
+
+
+def brute_force(edges, lower = False):
+    """
+    Number of distinct tags shared by each pair of users, keyed by the pair in id order.
+    """
+    tags = {}
+    for (user, tag) in edges:
+        tags.setdefault(user, set()).add(tag.lower() if lower else tag)
+    weights = {}
+    for (x, y) in itertools.combinations(sorted(tags), 2):
+        shared = len(tags[x] & tags[y])
+        if shared:
+            weights[(x, y)] = shared
+    return weights
+
+
+def read_pairs(path):
+    with open(path, 'r', encoding="utf-8", newline='') as infile:
+        return [(row[USER_X], row[USER_Y], int(row["weight"])) for row in csv.DictReader(infile)]
+
+
+def ordered(pairs):
+    weights = {}
+    for (x, y, weight) in pairs:
+        key = (min(x, y), max(x, y))
+        assert key not in weights
+        weights[key] = weight
+    return weights
+
+
+def write_edgelists(directory, names):
+    os.makedirs(directory)
+    edges = []
+    for (i, name) in enumerate(names):
+        day = random_edges(i)
+        edges.extend(day)
+        with open(os.path.join(directory, name), 'w', encoding="utf-8", newline='') as outfile:
+            writer = csv.writer(outfile, lineterminator='\n')
+            writer.writerow(["created_at", "id_str", "user.id_str", "hashtag"])
+            writer.writerows(("Wed Jan 01 10:00:00 +0000 2020", str(j), user, tag) for (j, (user, tag)) in enumerate(day))
+    return edges
+
+
+@pytest.mark.parametrize("partitions", [1, 3])
+def test_combine_matches_brute_force(tmp_path, partitions):
+    pytest.importorskip("pandas")
+    pytest.importorskip("scipy")
+    source = str(tmp_path / "hashtags")
+    names = ["en_2020_01_01.csv", "en_2020_01_02.csv", "fr_2020_01_02.csv", "en_2020_01_05.csv"]
+    edges = write_edgelists(source, names)
+    output = str(tmp_path / "combined.csv")
+    get_cooccurences.combine_coocurrences(source, output, "hashtag", partitions=partitions, tmp_dir=str(tmp_path))
+    assert ordered(read_pairs(output)) == brute_force(edges, lower=True)
+    # the window and languages select edgelists by name
+    windowed = str(tmp_path / "windowed.csv")
+    get_cooccurences.combine_coocurrences(source, windowed, "hashtag", end=get_cooccurences.parse_date("2020-01-02"),
+                                          languages=["en"], partitions=partitions, tmp_dir=str(tmp_path))
+    assert ordered(read_pairs(windowed)) == brute_force(random_edges(0) + random_edges(1), lower=True)
+
+
+@pytest.mark.parametrize("option", ["--partitions", "--workers"])
+def test_combine_options_below_one(tmp_path, option):
+    with pytest.raises(SystemExit):
+        get_cooccurences.cli(["--source", str(tmp_path), "--target", str(tmp_path / "out.csv"), "--bytag", "hashtag",
+                              "--combine", option, "0"])
+
+
+def edge_frame(edges):
+    import pandas as pd
+    return pd.DataFrame({"user.id_str": [user for (user, tag) in edges], "hashtag": [tag for (user, tag) in edges]})
+
+
+@pytest.mark.parametrize("chunk_size", [7, get_cooccurences.COOCCURRENCE_CHUNK_SIZE])
+def test_weighted_matches_brute_force(chunk_size):
+    pytest.importorskip("pandas")
+    pytest.importorskip("scipy")
+    edges = random_edges(0)
+    expected = brute_force(edges)
+    weights = get_cooccurences.get_weighted_coocurrences(edge_frame(edges), "hashtag", chunk_size=chunk_size)
+    assert ordered(zip(weights[USER_X], weights[USER_Y], weights["weight"])) == expected
+    symmetric = get_cooccurences.get_weighted_coocurrences(edge_frame(edges), "hashtag", upper_triangle=False, min_weight=2,
+                                                           chunk_size=chunk_size)
+    pairs = sorted(zip(symmetric[USER_X], symmetric[USER_Y], symmetric["weight"]))
+    assert pairs == sorted([(x, y, w) for ((x, y), w) in expected.items() if w >= 2] +
+                           [(y, x, w) for ((x, y), w) in expected.items() if w >= 2])
+
+
+def test_max_tag_degree_drops_popular_tags():
+    pytest.importorskip("pandas")
+    pytest.importorskip("scipy")
+    edges = random_edges(1)
+    users = {}
+    for (user, tag) in edges:
+        users.setdefault(tag, set()).add(user)
+    expected = brute_force([(user, tag) for (user, tag) in edges if len(users[tag]) <= 5])
+    weights = get_cooccurences.get_weighted_coocurrences(edge_frame(edges), "hashtag", max_tag_degree=5)
+    assert ordered(zip(weights[USER_X], weights[USER_Y], weights["weight"])) == expected
+
+
+@pytest.mark.parametrize("option", [["--minweight", "2"], ["--maxtagdegree", "10"], ["--symmetric"]])
+def test_weighted_options_need_weighted(tmp_path, option):
+    with pytest.raises(SystemExit):
+        get_cooccurences.cli(["--source", str(tmp_path), "--target", str(tmp_path / "out"), "--bytag", "hashtag"] + option)
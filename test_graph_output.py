@@ -0,0 +1,71 @@
+"""
+Regression tests for graph_output: node ids must not change as dictionaries grow, and reading a dictionary must never
+change it.
+"""
+
+import datetime
+import os
+
+import pytest
+
+import graph_output
+
+
+def node_path(output_dir, name = "users"):
+    return os.path.join(output_dir, "graph", graph_output.NODE_DIR, name + ".txt")
+
+
+def write_torn_dictionary(output_dir):
+    path = node_path(output_dir)
+    os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as outfile:
+        outfile.write("u1\nمستخدم\nu3".encode("utf-8")) # a writer still appending "u3\n"
+    return path
+
+
+def test_reader_ignores_torn_line(tmp_path):
+    path = write_torn_dictionary(str(tmp_path))
+    with open(path, 'rb') as infile:
+        before = infile.read()
+    assert graph_output.load_nodes(str(tmp_path / "graph"), "users") == ["u1", "مستخدم"]
+    with open(path, 'rb') as infile:
+        assert infile.read() == before
+
+
+def test_writer_repairs_torn_line(tmp_path):
+    path = write_torn_dictionary(str(tmp_path))
+    writer = graph_output.GraphWriter(str(tmp_path))
+    assert writer.nodes["users"].names == ["u1", "مستخدم"]
+    with open(path, 'rb') as infile:
+        assert infile.read() == "u1\nمستخدم\n".encode("utf-8")
+
+
+def quotes(pairs):
+    import pandas as pd
+    return pd.DataFrame({"created_at": ["Wed Jan 01 10:00:00 +0000 2020"] * len(pairs),
+                         "user.id_str": [source for (source, target) in pairs],
+                         "quoted_user": [target for (source, target) in pairs]})
+
+
+@pytest.mark.parametrize("layout", graph_output.GRAPH_LAYOUTS)
+def test_ids_stable_across_appends(tmp_path, layout):
+    pytest.importorskip("pandas")
+    pytest.importorskip("numpy")
+    output_dir = str(tmp_path)
+    days = [(datetime.date(2020, 1, 1), [("u1", "u2"), ("u2", "u3"), ("u1", "u2")]),
+            (datetime.date(2020, 1, 2), [("u4", "u1"), ("u3", "u5"), ("u2", "u3")])]
+    names = []
+    for (date, pairs) in days:
+        graph_output.GraphWriter(output_dir, layout).write(quotes(pairs), "quotes", "en", date) # a new run per day
+        names.append(graph_output.load_nodes(os.path.join(output_dir, "graph"), "users"))
+    assert names[1][:len(names[0])] == names[0]
+    assert sorted(names[1]) == ["u1", "u2", "u3", "u4", "u5"]
+    for (date, pairs) in days:
+        graph = graph_output.load_graph(os.path.join(output_dir, "graph", "quotes", "en_{0:%Y_%m_%d}".format(date)))
+        target = graph["indices"] if layout == "csr" else graph["target"]
+        edges = {(names[1][source], names[1][target]): weight
+                 for (source, target, weight) in zip(graph_output.edge_sources(graph), target, graph["weight"])}
+        expected = {}
+        for pair in pairs:
+            expected[pair] = expected.get(pair, 0) + 1
+        assert edges == expected
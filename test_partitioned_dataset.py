@@ -0,0 +1,72 @@
+"""
+Regression tests for partitioned_dataset: the catalog written by a partitioned conversion must list every partition,
+and read_partitions must read back exactly the selected ones.
+"""
+
+import csv
+import datetime
+import os
+import sys
+
+import pytest
+
+import convert_to_csvs
+from partitioned_dataset import Catalog, CATALOG_NAME, read_partitions
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks"))
+import synthetic
+
+DATES = [datetime.date(2020, 1, 1), datetime.date(2020, 1, 2)]
+LANGUAGES = ["en", "fr"]
+
+
+@pytest.fixture(scope="module")
+def dataset(tmp_path_factory):
+    source = str(tmp_path_factory.mktemp("source"))
+    target = str(tmp_path_factory.mktemp("target"))
+    for lang in LANGUAGES:
+        for date in DATES:
+            synthetic.write_day(convert_to_csvs.INPUT_FORMAT.format(folder=source, l=lang, y=date.year, m=date.month, d=date.day),
+                                lang, date, 30)
+    convert_to_csvs.main(source, target, DATES, layout="partitioned")
+    return target
+
+
+def csv_rows(path):
+    with open(path, 'r', encoding="utf-8", newline='') as infile:
+        return sum(1 for row in csv.DictReader(infile))
+
+
+def test_catalog_lists_partitions(dataset):
+    assert os.path.isfile(os.path.join(dataset, CATALOG_NAME))
+    catalog = Catalog(dataset)
+    assert catalog.tables() == convert_to_csvs.TABLES
+    for table in convert_to_csvs.TABLES:
+        expected = [os.path.join(dataset, table, "lang={0}".format(lang), "date={0:%Y-%m-%d}".format(date), "part-0.csv")
+                    for lang in LANGUAGES for date in DATES]
+        assert catalog.paths(table) == expected
+        for entry in catalog.select(table):
+            for f in entry["files"]:
+                path = os.path.join(dataset, f["path"])
+                assert f["rows"] == csv_rows(path) > 0
+                assert f["bytes"] == os.path.getsize(path)
+    assert catalog.paths("tweets", languages=["fr"], start=DATES[1]) == [
+        os.path.join(dataset, "tweets", "lang=fr", "date=2020-01-02", "part-0.csv")]
+    assert catalog.paths("tweets", dates=[datetime.date(2020, 1, 3)]) == []
+    for (directory, names, files) in os.walk(dataset): # no temporary parts left behind (nor reports, without stats)
+        assert not [name for name in files if name.startswith("_")]
+
+
+def test_read_partitions(dataset):
+    pytest.importorskip("pandas")
+    tweets = read_partitions(dataset, "tweets", languages=["en"], start=DATES[1], columns=["id_str", "user.id_str"])
+    path = os.path.join(dataset, "tweets", "lang=en", "date=2020-01-02", "part-0.csv")
+    assert list(tweets.columns) == ["id_str", "user.id_str", "lang", "date"]
+    assert len(tweets) == csv_rows(path)
+    assert set(tweets["lang"]) == {"en"} and set(tweets["date"]) == {"2020-01-02"}
+    everything = read_partitions(dataset, "users")
+    assert len(everything) == sum(f["rows"] for entry in Catalog(dataset).select("users") for f in entry["files"])
+    assert sorted(set(zip(everything["lang"], everything["date"]))) == [(lang, "{0:%Y-%m-%d}".format(date))
+                                                                        for lang in LANGUAGES for date in DATES]
+    empty = read_partitions(dataset, "tweets", languages=["de"], columns=["id_str"])
+    assert len(empty) == 0 and list(empty.columns) == ["id_str", "lang", "date"]
@@ -0,0 +1,68 @@
+"""
+Regression tests for --resume (see run_manifest.py): unchanged shards are skipped, changed, failed and incomplete
+ones are converted again.
+"""
+
+import datetime
+import os
+import sys
+
+import pytest
+
+import convert_to_csvs
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks"))
+import synthetic
+
+DATES = [datetime.date(2020, 1, 1), datetime.date(2020, 1, 2), datetime.date(2020, 1, 3)]
+
+
+def input_path(source, date, suffix = ""):
+    return convert_to_csvs.INPUT_FORMAT.format(folder=source, l="en", y=date.year, m=date.month, d=date.day) + suffix
+
+
+@pytest.fixture
+def converted(tmp_path, monkeypatch):
+    """
+    Returns a function running a resumed conversion of DATES and returning the days it converted.
+    The third day is a corrupt gzip file, so its shard fails.
+    """
+    source = str(tmp_path / "source")
+    target = str(tmp_path / "target")
+    for date in DATES[:2]:
+        synthetic.write_day(input_path(source, date), "en", date, 20)
+    with open(input_path(source, DATES[2], ".gz"), 'wb') as outfile:
+        outfile.write(b"not gzip")
+    process_shard = convert_to_csvs.process_shard
+    converted_days = []
+    def spy(shard, *args, **kwargs):
+        converted_days.append(shard[1])
+        return process_shard(shard, *args, **kwargs)
+    monkeypatch.setattr(convert_to_csvs, "process_shard", spy)
+
+    def convert(**kwargs):
+        del converted_days[:]
+        convert_to_csvs.main(source, target, DATES, resume=True, **kwargs)
+        return list(converted_days)
+    convert.source = source
+    convert.target = target
+    return convert
+
+
+def test_resume_skips_unchanged_shards(converted):
+    assert converted() == DATES
+    assert converted() == [DATES[2]] # failed shards are always redone
+    with open(input_path(converted.source, DATES[1]), 'a', encoding="utf-8") as outfile:
+        outfile.write("{not json\n") # changed input
+    os.remove(input_path(converted.source, DATES[2], ".gz"))
+    synthetic.write_day(input_path(converted.source, DATES[2], ".gz"), "en", DATES[2], 20, compress=True) # fixed input
+    assert converted() == DATES[1:]
+    assert converted() == []
+
+
+def test_resume_redoes_missing_outputs_and_new_settings(converted):
+    converted()
+    output_filename = convert_to_csvs.shard_filenames(converted.source, converted.target, "en", DATES[0])[1]
+    os.remove(convert_to_csvs.output_paths(output_filename)[1]) # the users output
+    assert converted() == [DATES[0], DATES[2]]
+    assert converted(dedup="none") == DATES # outputs written with other settings are not reused
@@ -0,0 +1,95 @@
+"""
+Regression tests for sampling.py: consistent sampling across days and runs, --limit, and the full run estimate.
+"""
+
+import datetime
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import convert_to_csvs
+import sampling
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks"))
+import synthetic
+
+DATES = [datetime.date(2020, 1, 1), datetime.date(2020, 1, 2)]
+
+
+def day_tweets(date, n_tweets = 300):
+    return list(synthetic.TweetGenerator("en", 0).tweets(date, n_tweets))
+
+
+@pytest.mark.parametrize("field", sampling.SAMPLE_FIELDS)
+def test_keep_same_across_days(field):
+    sample = sampling.Sample(0.3, field)
+    decisions = {}
+    for date in DATES:
+        for tweet in day_tweets(date):
+            key = tweet["id_str"] if field == "id_str" else tweet["user"]["id_str"]
+            decisions.setdefault(key, set()).add(sample.keep(tweet))
+            moved = dict(tweet, created_at="Sat Jan 01 00:00:00 +0000 2022") # the same tweet seen on another day
+            assert sample.keep(moved) == sample.keep(tweet)
+    assert all(len(kept) == 1 for kept in decisions.values())
+    kept = sum(True in kept for kept in decisions.values())
+    assert 0 < kept < len(decisions)
+    if field == "user.id_str": # users tweet on both days, with all their tweets in or out of the sample
+        assert len(decisions) < sum(len(day_tweets(date)) for date in DATES)
+
+
+def test_keep_same_across_runs():
+    ids = [tweet["id_str"] for tweet in day_tweets(DATES[0])]
+    script = ("import json, sys, sampling; sample = sampling.Sample(0.3); "
+              "print(json.dumps([sample.keep({'id_str': i}) for i in json.load(sys.stdin)]))")
+    runs = []
+    for seed in ["1", "2"]: # str hashes differ between these runs, the sample must not
+        env = dict(os.environ, PYTHONHASHSEED=seed)
+        result = subprocess.run([sys.executable, "-c", script], input=json.dumps(ids), capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), env=env, check=True)
+        runs.append(json.loads(result.stdout))
+    sample = sampling.Sample(0.3)
+    assert runs[0] == runs[1] == [sample.keep({"id_str": i}) for i in ids]
+
+
+def test_limit_stops_reading(tmp_path):
+    path = str(tmp_path / "01.txt")
+    synthetic.write_day(path, "en", DATES[0], 200)
+    decoded = []
+    def loads(line):
+        decoded.append(line)
+        return json.loads(line)
+    stats = convert_to_csvs.RunStats("en 2020-01-01")
+    (rows, consumed) = convert_to_csvs.process_file(path, str(tmp_path / "out"), loads=loads, stats=stats,
+                                                    sample=sampling.sample_for(limit=25))
+    assert len(decoded) == 25 and stats.counters["read"] == 25
+    assert 0 < consumed < 0.25
+    assert rows[0] >= 25 # the 25 tweets and the tweets they embed
+    (rows, consumed) = convert_to_csvs.process_file(path, str(tmp_path / "all"), sample=sampling.sample_for(limit=200))
+    assert consumed == 1.0 # the limit was not reached before the end of the file
+
+
+
+def test_limit_stops_reading_converted_rows(tmp_path):
+    pytest.importorskip("pandas")
+    import user_interaction_networks
+    path = str(tmp_path / "01.txt")
+    synthetic.write_day(path, "en", DATES[0], 200)
+    converted = str(tmp_path / "converted")
+    rows = convert_to_csvs.process_file(path, converted)[0][0]
+    tweet_path = convert_to_csvs.output_paths(converted)[0]
+    (df, consumed) = user_interaction_networks.read_source(tweet_path, "csv", ["id_str", "user.id_str"], limit=25)
+    assert len(df) == 25 and 0 < consumed < 0.25
+    (df, consumed) = user_interaction_networks.read_source(tweet_path, "csv", ["id_str", "user.id_str"], limit=rows)
+    assert len(df) == rows and consumed == 1.0
+
+def test_estimate_scales_by_part_read_and_fraction():
+    estimate = sampling.SampleEstimate(sampling.Sample(0.25))
+    estimate.add("en/2020-01-01", 10.0, 0.5, 1000) # half of the input read, a quarter of it sampled
+    estimate.add("en/2020-01-02", 4.0, 1.0, 200)
+    summary = estimate.summary()
+    assert "2 shards, 75.0% of their input read, 25% sampled by id_str: 14.0s, 1,200 bytes written." in summary
+    # time scaled by the part read only: 10 / 0.5 + 4; bytes by the part read and the fraction: 1000 / 0.125 + 200 / 0.25
+    assert "Estimated full run: 24.0s (0.01h), 8,800 bytes" in summary
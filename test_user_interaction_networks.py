@@ -0,0 +1,171 @@
+"""
+Regression tests for user_interaction_networks, on days converted from synthetic tweets (see benchmarks/synthetic.py).
+"""
+
+import csv
+import datetime
+import json
+import os
+import sys
+
+import pytest
+
+import convert_to_csvs
+import user_interaction_networks
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks"))
+import synthetic
+
+DATE = datetime.date(2020, 1, 1)
+
+
+def write_source(source, lang, date, n_tweets, seed = 0):
+    synthetic.write_day(convert_to_csvs.INPUT_FORMAT.format(folder=source, l=lang, y=date.year, m=date.month, d=date.day),
+                        lang, date, n_tweets, seed)
+
+
+def read_tree(directory):
+    """
+    Contents of every file under directory, by relative path.
+    """
+    files = {}
+    for (root, dirs, names) in os.walk(directory):
+        for name in names:
+            path = os.path.join(root, name)
+            with open(path, 'rb') as infile:
+                files[os.path.relpath(path, directory)] = infile.read()
+    return files
+
+
+def edgelists(target):
+    return {path: data for (path, data) in read_tree(os.path.join(target, "user_interactions")).items()
+            if path.endswith(".csv")}
+
+
+def test_parquet_edgelists_match_csv(tmp_path):
+    pytest.importorskip("pyarrow")
+    source = str(tmp_path / "raw")
+    write_source(source, "en", DATE, 400)
+    for output_format in convert_to_csvs.OUTPUT_FORMATS:
+        converted = str(tmp_path / ("converted_" + output_format))
+        convert_to_csvs.main(source, converted, [DATE], output_format=output_format)
+        user_interaction_networks.create_networks(converted, str(tmp_path / ("networks_" + output_format)), [DATE],
+                                                  languages=["en"], source_format=output_format)
+    csv_edges = edgelists(str(tmp_path / "networks_csv"))
+    assert len(csv_edges) == len(user_interaction_networks.NETWORK_TYPES)
+    assert all(data.count(b"\n") > 1 for data in csv_edges.values())
+    assert edgelists(str(tmp_path / "networks_parquet")) == csv_edges
+
+
+def test_parquet_schema_matches_field_kinds(tmp_path):
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.parquet
+    source = str(tmp_path / "raw")
+    write_source(source, "en", DATE, 50)
+    converted = str(tmp_path / "converted")
+    convert_to_csvs.main(source, converted, [DATE], output_format="parquet")
+    expected = {"list": pa.list_(pa.string()), "int": pa.int64(), "bool": pa.bool_(),
+                "twitter_time": pa.timestamp("ms", tz="UTC"), "epoch_ms": pa.timestamp("ms", tz="UTC")}
+    (tweet_path, user_path) = convert_to_csvs.output_paths(convert_to_csvs.shard_filenames(source, converted, "en", DATE)[1],
+                                                           "parquet")
+    for (path, fieldnames) in [(tweet_path, convert_to_csvs.FIELDNAMES), (user_path, convert_to_csvs.USER_FIELDS_OUT)]:
+        schema = pyarrow.parquet.read_schema(path)
+        assert schema.names == list(fieldnames)
+        for field in fieldnames:
+            kind = convert_to_csvs.FIELD_KINDS.get(field, "string")
+            assert schema.field(field).type == expected.get(kind, pa.string()), field
+    assert pyarrow.parquet.ParquetFile(tweet_path).metadata.num_rows > 0
+
+
+LIST_CELLS = [["news"], ["a,b", "c"], ['say "hi"', "it's"], ["back\\slash", "tab\tnew\nline"], ["أخبار", "عاجل"],
+              ["новости", "выборы"], ["mixed", "日本", "émoji 🎉"], []]
+
+
+def test_decode_list_column_json():
+    pd = pytest.importorskip("pandas")
+    cells = pd.Series([convert_to_csvs.encode_list(values) for values in LIST_CELLS])
+    assert cells[4] == '["أخبار", "عاجل"]' # non-ASCII written as it is, not escaped
+    assert user_interaction_networks.decode_list_column(cells) == LIST_CELLS
+
+
+def test_decode_list_column_repr_fallback():
+    pd = pytest.importorskip("pandas")
+    # older versions of convert_to_csvs wrote str(list), which is not JSON once a cell holds a quote
+    cells = pd.Series([str(values) for values in LIST_CELLS])
+    assert user_interaction_networks.decode_list_column(cells) == LIST_CELLS
+    mixed = pd.Series([convert_to_csvs.encode_list(LIST_CELLS[1]), str(LIST_CELLS[2]), str(LIST_CELLS[4])])
+    assert user_interaction_networks.decode_list_column(mixed) == [LIST_CELLS[1], LIST_CELLS[2], LIST_CELLS[4]]
+
+
+def test_hashtags_round_trip_through_csv(tmp_path):
+    pytest.importorskip("pandas")
+    rows = [("Wed Jan 01 10:00:{0:02} +0000 2020".format(i), str(i), "u{0}".format(i), convert_to_csvs.encode_list(values))
+            for (i, values) in enumerate(LIST_CELLS)]
+    path = str(tmp_path / "day.csv")
+    with open(path, 'w', encoding="utf-8", newline='') as outfile:
+        writer = csv.writer(outfile, lineterminator='\n')
+        writer.writerow(["created_at", "id_str", "user.id_str", "hashtags"])
+        writer.writerows(rows)
+    df = user_interaction_networks.read_source(path, "csv", ["created_at", "id_str", "user.id_str", "hashtags"])[0]
+    hashtags = user_interaction_networks.extract_hashtags(df)
+    assert hashtags["hashtags"].tolist() == [values for values in LIST_CELLS if values]
+
+
+def raw_tweet(tweet_id, user_id, text, created_at, retweeted_status = None):
+    tweet = {"id_str": str(tweet_id), "text": text, "created_at": created_at, "truncated": False, "lang": "en",
+             "user": {"id_str": str(user_id), "screen_name": "user{0}".format(user_id)},
+             "entities": {"hashtags": [], "user_mentions": [], "urls": [], "symbols": []}}
+    if retweeted_status is not None:
+        tweet["retweeted_status"] = retweeted_status
+    return tweet
+
+
+def write_raw_day(source, date, tweets):
+    path = convert_to_csvs.INPUT_FORMAT.format(folder=source, l="en", y=date.year, m=date.month, d=date.day)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding="utf-8") as outfile:
+        for tweet in tweets:
+            outfile.write(json.dumps(tweet) + "\n")
+
+
+def retweeted_users(target, date):
+    path = os.path.join(target, "user_interactions", "retweets", "en_{0:%Y_%m_%d}.csv".format(date))
+    with open(path, 'r', encoding="utf-8", newline='') as infile:
+        return {row["id_str"]: row["retweeted_user"] for row in csv.DictReader(infile)}
+
+
+def test_author_index_resolves_earlier_days(tmp_path):
+    pytest.importorskip("pandas")
+    from tweet_author_index import TweetAuthorIndex
+    (day1, day2) = (DATE, DATE + datetime.timedelta(days=1))
+    source = str(tmp_path / "raw")
+    converted = str(tmp_path / "converted")
+    original = raw_tweet(100, 1, "hello world", "Wed Jan 01 10:00:00 +0000 2020")
+    write_raw_day(source, day1, [original, raw_tweet(101, 3, "good morning", "Wed Jan 01 11:00:00 +0000 2020")])
+    write_raw_day(source, day2, [raw_tweet(200, 2, "RT @user1: hello world", "Thu Jan 02 09:00:00 +0000 2020", original),
+                                 raw_tweet(201, 3, "RT @user3: good morning", "Thu Jan 02 09:30:00 +0000 2020",
+                                           raw_tweet(101, 3, "good morning", "Wed Jan 01 11:00:00 +0000 2020"))])
+    convert_to_csvs.main(source, converted, [day1])
+    # a filtered day keeps the retweet but not the tweet it embeds, so its author is only known from day 1
+    convert_to_csvs.main(source, converted, [day2], convert_to_csvs.KeywordFilter(["rt @user1"], "contains_keyword", True, ["text"]))
+
+    user_interaction_networks.create_networks(converted, str(tmp_path / "plain"), [day1, day2], ["retweets"], ["en"])
+    assert retweeted_users(str(tmp_path / "plain"), day2) == {"200": ""} # unresolved, as without the index
+
+    index_path = str(tmp_path / "authors.sqlite")
+    with TweetAuthorIndex(index_path) as index:
+        user_interaction_networks.create_networks(converted, str(tmp_path / "indexed"), [day1, day2], ["retweets"], ["en"],
+                                                  author_index=index)
+        assert retweeted_users(str(tmp_path / "indexed"), day2) == {"200": "1"}
+        indexed = len(index)
+        assert indexed == 3 # 100 and 101 from day 1, 200 from day 2
+    with TweetAuthorIndex(index_path) as index: # a later run over the same days adds nothing
+        user_interaction_networks.create_networks(converted, str(tmp_path / "again"), [day1, day2], ["retweets"], ["en"],
+                                                  author_index=index)
+        assert len(index) == indexed
+        day1_file = convert_to_csvs.output_paths(convert_to_csvs.shard_filenames(source, converted, "en", day1)[1])[0]
+        os.utime(day1_file, (0, 0)) # touched: read again, its tweets are not added twice
+        assert index.update_from_file(day1_file) == 0
+        assert index.update_from_file(day1_file) is None
+        assert len(index) == indexed
+        assert index.lookup(["100", "200", "999"]) == {"100": "1", "200": "2"}
@@ -0,0 +1,164 @@
+"""
+The following code was produced as part of a project sponsored by the Department of the Navy,
+Office of Naval Research under ONR Grant No. N00014-18-1-2128.
+
+Copyright 2018 The Johns Hopkins University Applied Physics Laboratory LLC
+
+Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import os
+import argparse
+import sqlite3
+from partitioned_dataset import Catalog, CATALOG_NAME
+
+"""
+Persistent tweet id -> author id index, built from the output of convert_to_csvs.
+
+user_interaction_networks uses it to resolve the author of retweeted and quoted tweets that were recorded
+on a different day (or in a different language) than the retweet itself.
+
+The index is a SQLite file holding tweet and user ids as integers, plus the size and modification time of
+every converted file already indexed. Re-running the update only reads new or changed files.
+
+* Input parameters:
+- source. Directory written by convert_to_csvs (language subdirectories of daily files, or a partitioned dataset with a catalog).
+- index. Path of the index file. Created if missing.
+- format. Nullable. csv (default) or parquet.
+"""
+
+LOOKUP_BATCH_SIZE = 500000 # ids sent to SQLite per lookup batch
+
+
+class TweetAuthorIndex:
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS authors (tweet_id INTEGER PRIMARY KEY, user_id INTEGER)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS sources (source TEXT PRIMARY KEY, size INTEGER, mtime REAL, tweets INTEGER)")
+        self.connection.commit()
+
+    def is_indexed(self, source_file):
+        stat = os.stat(source_file)
+        row = self.connection.execute("SELECT size, mtime FROM sources WHERE source = ?",
+                                      (os.path.abspath(source_file),)).fetchone()
+        return row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime
+
+    def add(self, tweet_ids, user_ids, source_file = None):
+        """
+        Adds (tweet id, user id) pairs given as id strings. Pairs with missing or non-numeric ids are skipped,
+        and a tweet already in the index keeps its first recorded author.
+        """
+        pairs = ((int(t), int(u)) for (t, u) in zip(tweet_ids, user_ids)
+                 if isinstance(t, str) and isinstance(u, str) and t.isdigit() and u.isdigit())
+        with self.connection:
+            before = self.connection.total_changes
+            self.connection.executemany("INSERT OR IGNORE INTO authors (tweet_id, user_id) VALUES (?, ?)", pairs)
+            added = self.connection.total_changes - before
+            if source_file is not None:
+                stat = os.stat(source_file)
+                self.connection.execute("INSERT OR REPLACE INTO sources (source, size, mtime, tweets) VALUES (?, ?, ?, ?)",
+                                        (os.path.abspath(source_file), stat.st_size, stat.st_mtime, added))
+        return added
+
+    def update_from_file(self, source_file, source_format = "csv"):
+        """
+        Indexes one converted day file unless it is already indexed and unchanged.
+        Returns the number of new tweets, or None if the file was skipped.
+        """
+        if self.is_indexed(source_file):
+            return None
+        import pandas as pd # lookups and the author index CLI start without it
+        columns = ["id_str", "user.id_str"]
+        if source_format == "parquet":
+            df = pd.read_parquet(source_file, columns=columns)
+        else:
+            df = pd.read_csv(source_file, lineterminator="\n", dtype=object, usecols=columns)
+        return self.add(df["id_str"].tolist(), df["user.id_str"].tolist(), source_file)
+
+    def lookup(self, tweet_ids):
+        """
+        Returns {tweet id: user id} (as strings) for the given ids that are in the index.
+        Ids are joined against the index in large batches through a temporary table.
+        """
+        ids = sorted({int(t) for t in tweet_ids if isinstance(t, str) and t.isdigit()})
+        found = {}
+        cursor = self.connection.cursor()
+        cursor.execute("CREATE TEMP TABLE IF NOT EXISTS lookup_ids (tweet_id INTEGER PRIMARY KEY)")
+        for start in range(0, len(ids), LOOKUP_BATCH_SIZE):
+            cursor.execute("DELETE FROM lookup_ids")
+            cursor.executemany("INSERT INTO lookup_ids (tweet_id) VALUES (?)", ((t,) for t in ids[start:start + LOOKUP_BATCH_SIZE]))
+            for (tweet_id, user_id) in cursor.execute("SELECT a.tweet_id, a.user_id FROM lookup_ids l JOIN authors a ON a.tweet_id = l.tweet_id"):
+                found[str(tweet_id)] = str(user_id)
+        self.connection.commit()
+        return found
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM authors").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def update_index(index, source_dir, source_format = "csv", languages = None):
+    """
+    Indexes every converted day file under source_dir (tweets only, not the _users files).
+    A partitioned dataset (convert_to_csvs --layout partitioned) is read through its catalog.
+    """
+    if os.path.isfile(os.path.join(source_dir, CATALOG_NAME)):
+        for path in Catalog(source_dir).paths("tweets", languages):
+            if not path.endswith("." + source_format):
+                continue
+            added = index.update_from_file(path, source_format)
+            if added is not None:
+                print("{0}: {1} new tweets".format(os.path.relpath(path, source_dir), added))
+        return
+    for lang in sorted(os.listdir(source_dir)):
+        lang_dir = os.path.join(source_dir, lang)
+        if not os.path.isdir(lang_dir) or (languages and lang not in languages):
+            continue
+        for filename in sorted(os.listdir(lang_dir)):
+            if not filename.endswith("." + source_format) or filename.endswith("_users." + source_format):
+                continue
+            added = index.update_from_file(os.path.join(lang_dir, filename), source_format)
+            if added is not None:
+                print("{0}/{1}: {2} new tweets".format(lang, filename, added))
+
+
+def cli(argv = None):
+    parser = argparse.ArgumentParser(description="Build or update the tweet id -> author id index from converted tweets.")
+    parser.add_argument('--source', help="source directory (output of convert_to_csvs)", required = True)
+    parser.add_argument('--index', help="path of the index file", required = True)
+    parser.add_argument('--format', help="Format of the converted tweets. Options: csv, parquet. Default csv.", required = False,
+                        choices = ["csv", "parquet"], default = "csv")
+    args = parser.parse_args(argv)
+
+    with TweetAuthorIndex(args.index) as index:
+        print("==Updating Tweet Author Index==")
+        update_index(index, args.source, args.format)
+        print("==Done! {0} tweets indexed==".format(len(index)))
+
+
+if __name__ == '__main__':
+    cli()
@@ -22,9 +22,19 @@ ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSI
 import os
 import sys
 import argparse
-import pandas as pd
 import ast
 import csv
+import json
+import io
+import itertools
+from tweet_author_index import TweetAuthorIndex
+from run_manifest import RunManifest, MANIFEST_NAME, shard_key, temp_path
+from run_stats import RunStats, REPORT_SUFFIX, PROFILE_SUFFIX, clock, profiled
+from edge_aggregation import WindowAggregator
+from graph_output import GraphWriter, GRAPH_LAYOUTS
+from partitioned_dataset import Catalog, LAYOUTS, PART_NAME, date_value
+from sampling import SampleEstimate, SAMPLE_FIELDS, sample_for
+import sna_cli
 """
 Script creates interaction networks from Twitter data that has been previously converted into csvs.
 
@@ -42,10 +52,34 @@ These interaction networks are edgelists based on one of the following types of
 - end. Last dated to parse (if exists). Date format: "YYYY-MM-DD"
 - interactions. Nullable. Comma-separated list of interations. Will extract all interactions by default.
 - languages. Nullable. Comma-separated list of languages. Will extract lal languages by default.
+- authorindex. Nullable. Path of a tweet author index (see tweet_author_index.py). If given, it is updated with every
+  day in the range first, and retweeted/quoted authors missing from the same day's tweets are looked up in it.
+- resume. Nullable. If present, skips (language, date) shards already processed with the same settings from an unchanged input.
+- checksum. Nullable. If present, input checksums are recorded and compared when a file's mtime changed but its size did not.
+- format. Nullable. csv (default) or parquet, matching the --format used by convert_to_csvs.
+  With parquet only the columns needed for the chosen interactions are read.
+- window. Nullable. If given (hour, day, week, all, or a length such as 6h, 3d, 2w), also writes weighted edgelists
+  (source, target, weight, first_ts, last_ts) per window overlapping the date range under user_interactions/aggregated
+  (see edge_aggregation.py).
+- bylanguage. Nullable. With window, keeps languages separate instead of aggregating across them.
+- graph. Nullable. If given (edges or csr), also writes each day's edges as NumPy arrays of integer node ids under
+  user_interactions/graph, with node dictionaries shared across days (see graph_output.py).
+- sourcelayout. Nullable. flat (default) or partitioned, matching the --layout used by convert_to_csvs. With partitioned,
+  the days to process are looked up in the source catalog instead of checking for every (language, date) file.
+- layout. Nullable. flat (default, see below) or partitioned: "user_interactions/{interaction}/lang=xx/date=YYYY-MM-DD/part-0.csv",
+  with a catalog.json in user_interactions listing every partition with its row count and size (see partitioned_dataset.py).
+- sample. Nullable. Fraction of converted tweets to use, e.g. 0.01, chosen by a hash of samplefield: the same tweets (or users)
+  on every day, and the same ones as convert_to_csvs --sample (see sampling.py).
+- samplefield. Nullable. id_str (default) or user.id_str, to sample users with all their tweets.
+- limit. Nullable. Only reads the first this many tweets of each day.
+  With sample or limit, an estimate of the time and output size of the full run is printed at the end.
+- stats. Nullable. If present, prints rates and writes "{lang}_YYYY_MM_DD_report.json" in user_interactions with the number of
+tweets and edges per interaction and the time spent reading, extracting and writing.
+- profile. Nullable. If present, each day runs under cProfile and its stats are saved as "{lang}_YYYY_MM_DD_profile.pstats".
 
 * Source directory structure:
 Source dir contains subdirectories specific to language.
-Each subdirectory contains csv files labeled by date (see source_file_format).
+Each subdirectory contains csv (or parquet) files labeled by date (see source_file_format).
 
 * Target directory structure:
 A new folder called 'user_interactions" will be placed in the target directory.
@@ -53,11 +87,124 @@ Each type of interaction will be stored in a subdirectory underneath this new fo
 Subdirectories and dates will be collapsed into the output file format, e.g. "ar_YYYY_MM_DD.csv"
 - This is done to enable simpler file concatenation across languages in a future step.
  -- This may be done, for example, to create a network of all interactions in a single day across all languages.
+A manifest.json in "user_interactions" records the input, settings and status of every processed day (see run_manifest.py).
 
 """
 # Global Defaults
 NETWORK_TYPES = ["replies", "retweets", "quotes", "mentions", "hashtags"]
 LANGUAGES = ["ar", "de", "en", "fr", "ru"]
+SOURCE_FORMATS = ["csv", "parquet"]
+TWITTER_TIME_FORMAT = "%a %b %d %H:%M:%S +0000 %Y"
+
+# List column and output column name for interactions written one row per list element
+EMBEDDED_FIELDS = {"mentions": ("user_id_mentions", "user_id.mention"),
+                   "hashtags": ("hashtags", "hashtag")}
+
+# Columns each interaction type reads from the converted tweets
+NETWORK_COLUMNS = {"replies": ["created_at", "id_str", "user.id_str", "in_reply_to_user_id_str", "in_reply_to_status_id_str"],
+                   "retweets": ["created_at", "id_str", "user.id_str", "retweeted_status"],
+                   "quotes": ["created_at", "id_str", "user.id_str", "quoted_status"],
+                   "mentions": ["created_at", "id_str", "user.id_str", "user_id_mentions"],
+                   "hashtags": ["created_at", "id_str", "user.id_str", "hashtags"]}
+
+
+def network_columns(network_choices):
+    columns = []
+    for interaction in network_choices:
+        for column in NETWORK_COLUMNS[interaction]:
+            if column not in columns:
+                columns.append(column)
+    return columns
+
+
+def read_parquet_source(source_file, columns, limit = None):
+    """
+    Reads only the needed columns of a parquet file written by convert_to_csvs --format parquet, or only its first limit rows.
+    created_at is turned back into Twitter's string format so edgelists match the csv path.
+    """
+    import pandas as pd
+    if limit is None:
+        df = pd.read_parquet(source_file, columns=columns)
+    else:
+        import pyarrow.parquet
+        batch = next(pyarrow.parquet.ParquetFile(source_file).iter_batches(batch_size=limit, columns=columns), None)
+        df = batch.to_pandas() if batch is not None else pd.read_parquet(source_file, columns=columns)
+    if "created_at" in df.columns:
+        df["created_at"] = df["created_at"].dt.strftime(TWITTER_TIME_FORMAT)
+    return df
+
+
+def read_csv_head(source_file, columns, limit):
+    """
+    Reads the first limit rows of a converted csv without reading the rest of the file.
+    Returns them with the part of the file they take up.
+    """
+    import pandas as pd
+    lines = []
+    def read_lines(infile):
+        for line in iter(infile.readline, ""):
+            lines.append(line)
+            yield line
+    with open(source_file, 'r', encoding="utf-8", newline='') as infile:
+        for row in itertools.islice(csv.reader(read_lines(infile)), limit + 1): # header and limit rows (cells may hold newlines)
+            pass
+        consumed = infile.tell() / max(os.fstat(infile.fileno()).st_size, 1)
+    return (pd.read_csv(io.StringIO("".join(lines)), lineterminator="\n", dtype=object, usecols=columns), min(consumed, 1.0))
+
+
+def read_source(source_file, source_format, columns, limit = None):
+    """
+    Reads one day of converted tweets, only the first limit rows if given. Returns the tweets and the part of the file read.
+    """
+    import pandas as pd
+    consumed = 1.0
+    if source_format == "parquet":
+        df = read_parquet_source(source_file, columns, limit)
+        if limit is not None:
+            import pyarrow.parquet
+            consumed = min(limit / max(pyarrow.parquet.ParquetFile(source_file).metadata.num_rows, 1), 1.0)
+    elif limit is not None:
+        (df, consumed) = read_csv_head(source_file, columns, limit)
+    else:
+        df = pd.read_csv(source_file, lineterminator="\n", dtype=object, usecols=columns)
+    return (df, consumed)
+
+
+def decode_list(cell):
+    try:
+        return json.loads(cell)
+    except ValueError: # Python repr written by older versions of convert_to_csvs, e.g. ['a', "b'c"]
+        return ast.literal_eval(cell)
+
+
+def decode_list_column(values):
+    """
+    Decodes a column of list cells. convert_to_csvs writes JSON arrays, so the whole column is parsed
+    with a single json.loads call; columns in the old repr format fall back to parsing cell by cell.
+    """
+    cells = values.tolist()
+    try:
+        lists = json.loads("[" + ",".join(cells) + "]")
+        if len(lists) == len(cells) and all(isinstance(l, list) for l in lists):
+            return lists
+    except ValueError:
+        pass
+    return [decode_list(cell) for cell in cells]
+
+
+def parse_list_column(df, field):
+    """
+    Keeps rows with a non-empty list in field, decoding csv cells into lists.
+    Parquet list columns arrive already parsed.
+    """
+    import pandas as pd
+    values = df[field]
+    if len(values) > 0 and isinstance(values.iloc[0], str):
+        df = df.loc[values.str.len() != 2].copy() # string representation of empty list is '[]'
+        df[field] = pd.Series(decode_list_column(df[field]), index=df.index, dtype=object)
+    else:
+        df = df.loc[values.apply(len) > 0].copy()
+    return df
 
 def extract_replies(df):
     replies = df[["created_at", "id_str", "user.id_str",
@@ -66,42 +213,78 @@ def extract_replies(df):
     replies = replies.drop_duplicates()
     return replies
 
-def extract_retweets(df):
-    retweet_refs = df[["id_str", "user.id_str"]].rename(columns={"user.id_str": "retweeted_user",
-                                              "id_str": "retweeted_status"})
+def tweet_authors(df):
+    """
+    Lookup from id_str to user.id_str, built once per day and shared by retweet and quote extraction.
+    """
+    import pandas as pd
+    authors = df[["id_str", "user.id_str"]].drop_duplicates("id_str")
+    return pd.Series(authors["user.id_str"].values, index=authors["id_str"].values)
+
+def resolve_authors(statuses, authors, author_index = None):
+    """
+    Maps referenced tweet ids to their authors using the same day's tweets, then the
+    cross-day TweetAuthorIndex (if given) for any that were recorded on another day.
+    """
+    users = statuses.map(authors)
+    if author_index is not None:
+        missing = users.isnull()
+        if missing.any():
+            found = author_index.lookup(statuses[missing].unique().tolist())
+            users[missing] = statuses[missing].map(found)
+    return users
+
+def extract_retweets(df, authors = None, author_index = None):
+    if authors is None:
+        authors = tweet_authors(df)
     retweets = df[["created_at", "id_str", "user.id_str", "retweeted_status"]]
-    retweets = retweets[retweets["retweeted_status"].notnull()]
-    retweets_with_refs = pd.merge(retweets, retweet_refs,
-                                  on="retweeted_status",
-                                  how="left")
-    retweets_with_refs = retweets_with_refs.drop_duplicates()
-    return retweets_with_refs   
-
-def extract_quotes(df):
-    quote_refs = df[["id_str", "user.id_str"]].rename(columns={"user.id_str": "quoted_user",
-                                            "id_str": "quoted_status"})
+    retweets = retweets[retweets["retweeted_status"].notnull()].copy()
+    retweets["retweeted_user"] = resolve_authors(retweets["retweeted_status"], authors, author_index)
+    retweets = retweets.drop_duplicates()
+    return retweets
+
+def extract_quotes(df, authors = None, author_index = None):
+    if authors is None:
+        authors = tweet_authors(df)
     quotes = df[["created_at", "id_str", "user.id_str", "quoted_status"]]
-    quotes = quotes[quotes["quoted_status"].notnull()]
-    quotes_with_refs = pd.merge(quotes, quote_refs,
-                                  on="quoted_status",
-                                how="left")
-    quotes_with_refs = quotes_with_refs.drop_duplicates()
-    return quotes_with_refs
+    quotes = quotes[quotes["quoted_status"].notnull()].copy()
+    quotes["quoted_user"] = resolve_authors(quotes["quoted_status"], authors, author_index)
+    quotes = quotes.drop_duplicates()
+    return quotes
 
 def extract_mentions(df):
     mentions = df[["created_at", "id_str", "user.id_str", "user_id_mentions"]]
     mentions = mentions.loc[mentions['user_id_mentions'].notnull()]
-    mentions = mentions.loc[mentions['user_id_mentions'].str.len() != 2] # string representation of empty list is '[]'
-    mentions['user_id_mentions'] = mentions['user_id_mentions'].apply(ast.literal_eval)
+    mentions = parse_list_column(mentions, 'user_id_mentions')
     return mentions
 
 def extract_hashtags(df):
     hashtags = df[["created_at", "id_str", "user.id_str", "hashtags"]]
     hashtags = hashtags.loc[hashtags['hashtags'].notnull()]
-    hashtags = hashtags.loc[hashtags['hashtags'].str.len() != 2] # string representation of empty list is '[]'
-    hashtags['hashtags'] = hashtags['hashtags'].apply(ast.literal_eval)
+    hashtags = parse_list_column(hashtags, 'hashtags')
     return hashtags
 
+def extract_interactions(df, network_choices = NETWORK_TYPES, author_index = None, authors = None):
+    """
+    Extracts every requested interaction type from one day's tweets, computing shared lookups once.
+    Yields (interaction, edges) in NETWORK_TYPES order so each edgelist can be written and freed in turn.
+    """
+    if authors is None and ("retweets" in network_choices or "quotes" in network_choices):
+        authors = tweet_authors(df)
+    for interaction in NETWORK_TYPES:
+        if interaction not in network_choices:
+            continue
+        if interaction == "replies":
+            yield (interaction, extract_replies(df))
+        elif interaction == "retweets":
+            yield (interaction, extract_retweets(df, authors, author_index))
+        elif interaction == "quotes":
+            yield (interaction, extract_quotes(df, authors, author_index))
+        elif interaction == "mentions":
+            yield (interaction, extract_mentions(df))
+        elif interaction == "hashtags":
+            yield (interaction, extract_hashtags(df))
+
 def write_edgelist(df, output_file_format, interaction_type, lang, date):
     output_file = output_file_format.format(
                                                     interaction=interaction_type,
@@ -109,7 +292,10 @@ def write_edgelist(df, output_file_format, interaction_type, lang, date):
                                                     y=date.year,
                                                     m=date.month,
                                                     d=date.day)
-    df.to_csv(output_file, index=False, float_format='%f')
+    os.makedirs(os.path.dirname(output_file), exist_ok=True) # partition directories are created as days are written
+    df.to_csv(temp_path(output_file), index=False, float_format='%f')
+    os.replace(temp_path(output_file), output_file) # never leave a half-written edgelist behind
+    return output_file
 
 def write_embedded_edgelist(df, output_file_format, embedded_field, output_field, interaction_type, lang, date):
     output_file = output_file_format.format(
@@ -118,24 +304,80 @@ def write_embedded_edgelist(df, output_file_format, embedded_field, output_field
                                                                 y=date.year,
                                                                 m=date.month,
                                                                 d=date.day)
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
     headers = list(df.columns)
     headers.remove(embedded_field)
     headers.append(output_field)
-    with open(output_file, 'w') as out:
+    # one row per list element, written in bulk
+    edges = df[['created_at', 'id_str', 'user.id_str', embedded_field]].explode(embedded_field)
+    with open(temp_path(output_file), 'w', encoding="utf-8", newline='') as out:
         writer = csv.writer(out)
         writer.writerow(headers)
-        for i in range(df.shape[0]):
-            row = df.iloc[i]
-            for f_index in range(len(row[embedded_field])):
-                writer.writerow([row['created_at'], row['id_str'], row['user.id_str'], row[embedded_field][f_index]])
+        writer.writerows(zip(edges['created_at'].tolist(), edges['id_str'].tolist(),
+                             edges['user.id_str'].tolist(), edges[embedded_field].tolist()))
+    os.replace(temp_path(output_file), output_file)
+    return output_file
+
+def edge_count(edges, interaction):
+    if interaction in EMBEDDED_FIELDS:
+        return int(edges[EMBEDDED_FIELDS[interaction][0]].str.len().sum()) # one edge per list element
+    return edges.shape[0]
+
+def process_day(source_file, source_format, columns, network_choices, author_index, output_file_format, lang, date, outputs,
+                run_stats = None, aggregator = None, graph_writer = None, catalog = None, sample = None, read_state = None):
+    """
+    Extracts and writes every chosen edgelist of one day. Written paths are appended to outputs as they are produced,
+    so the caller can record them even if a later interaction fails. With a catalog, each edgelist is added to it once written.
+    With a sample, only the edges of sampled tweets are extracted, and read_state["consumed"] is set to the part of the file read.
+    """
+    start = clock()
+    (df, consumed) = read_source(source_file, source_format, columns, sample.limit if sample is not None else None)
+    if read_state is not None:
+        read_state["consumed"] = consumed
+    authors = None
+    if sample is not None and sample.fraction < 1:
+        if "retweets" in network_choices or "quotes" in network_choices:
+            authors = tweet_authors(df) # from every tweet read, so retweets of unsampled tweets still resolve
+        df = df.loc[sample.mask(df[sample.field])].reset_index(drop=True)
+    if run_stats is not None:
+        start = run_stats.lap("read", start)
+        run_stats.count("tweets", df.shape[0])
+    for (interaction, edges) in extract_interactions(df, network_choices, author_index, authors):
+        if run_stats is not None:
+            start = run_stats.lap("extract", start)
+        if interaction in EMBEDDED_FIELDS:
+            (embedded_field, output_field) = EMBEDDED_FIELDS[interaction]
+            outputs.append(write_embedded_edgelist(edges, output_file_format, embedded_field, output_field, interaction, lang, date))
+        else:
+            outputs.append(write_edgelist(edges, output_file_format, interaction, lang, date))
+        if catalog is not None:
+            catalog.add(interaction, lang, date, outputs[-1:], [edge_count(edges, interaction)])
+        if run_stats is not None:
+            start = run_stats.lap("write", start)
+            run_stats.count(interaction, edge_count(edges, interaction))
+        if aggregator is not None:
+            outputs.append(aggregator.write_partial(edges, interaction, lang, date))
+            if run_stats is not None:
+                start = run_stats.lap("aggregate", start)
+        if graph_writer is not None:
+            outputs.extend(graph_writer.write(edges, interaction, lang, date))
+            if run_stats is not None:
+                start = run_stats.lap("graph", start)
+    del df
+    return outputs
 
-def create_networks(source_dir, target_dir, date_range, network_choices = NETWORK_TYPES, languages = LANGUAGES):
+def create_networks(source_dir, target_dir, date_range, network_choices = NETWORK_TYPES, languages = LANGUAGES, source_format = "csv",
+                    author_index = None, resume = False, checksum = False, stats = False, profile = False, window = None,
+                    by_language = False, graph = None, source_layout = "flat", layout = "flat", sample = None):
     print("==Creating User Interaction Networks==")
     
     # structuring basic file formats
-    source_file_format = source_dir + "/{l}/{y}_{m:02}_{d:02}.csv"
+    source_file_format = source_dir + "/{l}/{y}_{m:02}_{d:02}." + source_format
     output_dir = target_dir + "/user_interactions/"
     output_file_format = output_dir + "{interaction}/{l}_{y}_{m:02}_{d:02}.csv"
+    if layout == "partitioned":
+        output_file_format = output_dir + "{interaction}/lang={l}/date={y}-{m:02}-{d:02}/" + PART_NAME + ".csv"
+    shard_file_format = output_dir + "{l}_{y}_{m:02}_{d:02}" # reports and profiles
     print("Output directory will be {0}".format(output_dir))
 
     print("==Creating Folders if Needed==")
@@ -149,55 +391,147 @@ def create_networks(source_dir, target_dir, date_range, network_choices = NETWOR
         else:
             print("{0} already exists".format(interaction_dir))
 
-    GET_RETWEETS = "retweets" in network_choices
-    GET_REPLIES = "replies" in network_choices
-    GET_QUOTES = "quotes" in network_choices
-    GET_MENTIONS = "mentions" in network_choices
-    GET_HASHTAGS = "hashtags" in network_choices
+    columns = network_columns(network_choices) # only read what the chosen interactions need
+    manifest = RunManifest(output_dir + MANIFEST_NAME)
+    settings = {"format": source_format, "types": sorted(network_choices), "author_index": author_index is not None}
+    aggregator = None
+    if window is not None:
+        aggregator = WindowAggregator(output_dir, window, by_language)
+        settings["window"] = aggregator.window
+    graph_writer = None
+    if graph is not None:
+        graph_writer = GraphWriter(output_dir, graph)
+        settings["graph"] = graph
+    catalog = None
+    if layout == "partitioned":
+        catalog = Catalog(output_dir)
+        settings["layout"] = layout
+    estimate = None
+    if sample is not None:
+        settings["sample"] = sample.settings()
+        estimate = SampleEstimate(sample)
+    source_files = None
+    if source_layout == "partitioned":
+        # one catalog read instead of a stat per (language, date), every language for the author index
+        source_files = {(entry["lang"], entry["date"]): os.path.join(source_dir, f["path"])
+                        for entry in Catalog(source_dir).select("tweets", dates=date_range) for f in entry["files"]
+                        if f["path"].endswith("." + source_format)}
+
+    listing = sna_cli.DirectoryCache() # one listing per language directory instead of a stat per (language, date)
+
+    def find_source(lang, date):
+        if source_files is not None:
+            return source_files.get((lang, date_value(date)))
+        source_file = source_file_format.format(l=lang, y=date.year, m=date.month, d=date.day)
+        return source_file if listing.isfile(source_file) else None
+
+    if author_index is not None and ("retweets" in network_choices or "quotes" in network_choices):
+        # index the whole range first, in every language and not only those processed: the index is keyed by tweet id,
+        # so a retweet in one language of a tweet in another resolves
+        if source_files is not None:
+            index_languages = sorted(set(lang for (lang, date) in source_files))
+        else:
+            index_languages = sorted(name for name in os.listdir(source_dir) if os.path.isdir(os.path.join(source_dir, name)))
+        print("==Updating Tweet Author Index==")
+        for lang in index_languages:
+            for date in date_range:
+                source_file = find_source(lang, date)
+                if source_file is not None:
+                    author_index.update_from_file(source_file, source_format)
 
     print("==Processing Files==")
     for lang in languages:
         print("Language: {0}".format(lang))
         for date in date_range:
-            source_file = source_file_format.format(l=lang, y=date.year, m=date.month, d=date.day)
-            if os.path.isfile(source_file):
+            source_file = find_source(lang, date)
+            if source_file is not None:
+                key = shard_key(lang, date)
+                if resume and manifest.is_complete(key, source_file, settings, checksum):
+                    print("{0}-{1}-{2} already processed, skipping".format(date.year, date.month, date.day))
+                    continue
                 print("{0}-{1}-{2}".format(date.year, date.month, date.day))
-                df = pd.read_csv(source_file, lineterminator="\n", dtype=object)
-                if GET_REPLIES:
-                    replies = extract_replies(df)
-                    write_edgelist(replies, output_file_format, "replies", lang, date)
-                if GET_RETWEETS:
-                    retweets = extract_retweets(df)
-                    write_edgelist(retweets, output_file_format, "retweets", lang, date)
-                if GET_QUOTES:
-                    quotes = extract_quotes(df)
-                    write_edgelist(quotes, output_file_format, "quotes", lang, date)
-                if GET_MENTIONS:
-                    mentions = extract_mentions(df)
-                    write_embedded_edgelist(mentions, output_file_format, "user_id_mentions", "user_id.mention", "mentions", lang, date)
-                if GET_HASHTAGS:
-                    hashtags = extract_hashtags(df)
-                    write_embedded_edgelist(hashtags, output_file_format, "hashtags", "hashtag", "hashtags", lang, date)
+                shard_file = shard_file_format.format(l=lang, y=date.year, m=date.month, d=date.day)
+                run_stats = RunStats("{0} {1}-{2:02}-{3:02}".format(lang, date.year, date.month, date.day)) if stats else None
+                outputs = []
+                read_state = {"consumed": 1.0}
+                day_start = clock()
+                try:
+                    with profiled(shard_file + PROFILE_SUFFIX if profile else None):
+                        outputs = process_day(source_file, source_format, columns, network_choices, author_index, output_file_format,
+                                              lang, date, outputs, run_stats, aggregator, graph_writer, catalog, sample,
+                                              read_state)
+                except Exception as e:
+                    manifest.record(key, source_file, settings, "failed", outputs, "{0}: {1}".format(type(e).__name__, e))
+                    raise
+                finally:
+                    if catalog is not None:
+                        catalog.save() # once per day, with every edgelist written
+                manifest.record(key, source_file, settings, "done", outputs, use_checksum=checksum)
+                if estimate is not None:
+                    estimate.add(key, clock() - day_start, read_state["consumed"],
+                                 sum(os.path.getsize(output) for output in outputs if os.path.isfile(output)))
+                if run_stats is not None:
+                    print(run_stats.summary(unit="tweets"))
+                    run_stats.write_report(shard_file + REPORT_SUFFIX)
+    manifest.compact()
+
+    if aggregator is not None:
+        print("==Aggregating {0} windows==".format(aggregator.window))
+        for interaction in network_choices:
+            outputs = aggregator.merge(interaction, languages, date_range)
+            print("{0}: {1} edgelists".format(interaction, len(outputs)))
                     
+    if estimate is not None:
+        print("==Sample Estimate==")
+        print(estimate.summary())
     print("==Done!==")
 
-if __name__ == '__main__':
+def cli(argv = None):
     parser = argparse.ArgumentParser(description="Create user-user networks based on Twitter interactions.")
     parser.add_argument('--source', help="source directory", required = True)
     parser.add_argument('--target', help="target directory", required = True)
     parser.add_argument('--start', help="First date to parse (if exists). Date format: YYYY-MM-DD", required = True)
     parser.add_argument('--end', help="Last date to parse (if exists). Date format: YYYY-MM-DD", required = True)
     parser.add_argument('--types', help="Nullable. Comma-separated list of interactions. Will extract all interactions by default.", required = False)
+    parser.add_argument('--format', help="Format of the converted tweets. Options: csv, parquet. Default csv.", required = False,
+                        choices = SOURCE_FORMATS, default = "csv")
+    parser.add_argument('--authorindex', help="Nullable. Path of a tweet author index (see tweet_author_index.py) used to resolve retweets and quotes of tweets from other days. Created or updated as needed.", required = False)
+    parser.add_argument('--resume', help="If included, skips days the manifest records as processed with the same settings and an unchanged input.",
+                        required = False, action='store_true', default = False)
+    parser.add_argument('--checksum', help="If included, records input checksums so that inputs which were only touched still count as unchanged.",
+                        required = False, action='store_true', default = False)
+    parser.add_argument('--window', help="Nullable. Also writes weighted edgelists per time window. Options: hour, day, week, all, or a length such as 6h, 3d, 2w.", required = False)
+    parser.add_argument('--bylanguage', help="If included with --window, aggregates each language separately instead of across languages.",
+                        required = False, action='store_true', default = False)
+    parser.add_argument('--graph', help="Nullable. Also writes each day's edges as NumPy arrays of integer node ids. Options: edges, csr.", required = False,
+                        choices = GRAPH_LAYOUTS)
+    parser.add_argument('--sourcelayout', help="Layout of the converted tweets. Options: flat, partitioned, matching the --layout used by convert_to_csvs. Default flat.",
+                        required = False, choices = LAYOUTS, default = "flat")
+    parser.add_argument('--layout', help="Output layout. Options: flat ({interaction}/{lang}_YYYY_MM_DD.csv), partitioned ({interaction}/lang=xx/date=YYYY-MM-DD/part-0.csv, with a catalog). Default flat.",
+                        required = False, choices = LAYOUTS, default = "flat")
+    parser.add_argument('--sample', help="Nullable. Fraction of tweets to use, chosen by a hash of --samplefield.", required = False,
+                        type = float, default = None)
+    parser.add_argument('--samplefield', help="Field hashed for --sample. Options: id_str, user.id_str. Default id_str.", required = False,
+                        choices = SAMPLE_FIELDS, default = "id_str")
+    parser.add_argument('--limit', help="Nullable. Only reads the first this many tweets of each day.", required = False, type = int, default = None)
+    parser.add_argument('--stats', help="If included, prints rates and writes a JSON report of counters and stage timings per day.",
+                        required = False, action='store_true', default = False)
+    parser.add_argument('--profile', help="If included, runs each day under cProfile and saves the stats in the output directory.",
+                        required = False, action='store_true', default = False)
     parser.add_argument('--languages', help="Nullable. Comma-separated list of languages. Will extract all languages by default.", required = False)
     
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    try:
+        sample = sample_for(args.sample, args.samplefield, args.limit)
+    except ValueError as e:
+        parser.error(str(e))
     
     # Assert source directory exists
     if not os.path.isdir(args.source):
-        print("Error: source directory {0} not found".format(source_dir))
+        print("Error: source directory {0} not found".format(args.source))
     else:
         if args.types:
-            net_types = args.types.sep(",")
+            net_types = args.types.split(",")
         else:
             net_types = NETWORK_TYPES
         if args.languages:
@@ -206,17 +540,25 @@ if __name__ == '__main__':
             languages = LANGUAGES
         try:
             # Generate date range
-            start_date = [int(x) for x in args.start.split("-")]
-            start_date = pd.datetime(start_date[0], start_date[1], start_date[2])
-            end_date = [int(x) for x in args.end.split("-")]
-            end_date = pd.datetime(end_date[0], end_date[1], end_date[2])
-            date_range = pd.date_range(start_date, end_date)
+            date_range = sna_cli.date_range(args.start, args.end)
         except Exception as e:
             print("Error creating date range. Given values: {0} - {1}".format(args.start, args.end))
             print(e)
+            return
+        author_index = TweetAuthorIndex(args.authorindex) if args.authorindex else None
         try:
-            create_networks(source_dir=args.source, target_dir=args.target, date_range=date_range, network_choices=net_types, languages=languages)
+            create_networks(source_dir=args.source, target_dir=args.target, date_range=date_range, network_choices=net_types, languages=languages,
+                            source_format=args.format, author_index=author_index, resume=args.resume, checksum=args.checksum,
+                            stats=args.stats, profile=args.profile, window=args.window, by_language=args.bylanguage,
+                            graph=args.graph, source_layout=args.sourcelayout, layout=args.layout,
+                            sample=sample)
         except Exception as e:
             print("Error creating networks")
             print(e)
-            
+        finally:
+            if author_index is not None:
+                author_index.close()
+
+
+if __name__ == '__main__':
+    cli()